@@ -3,11 +3,21 @@ API 路由定义
 """
 
 import json
-from typing import List, Dict, Any, Optional
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+import threading
+from typing import List, Dict, Any, Optional, Union, Literal
+from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
 from pydantic import BaseModel
 from .model_manager import model_manager
+from .session_manager import session_manager
+from .response_cache import response_cache
+from .request_coalescer import request_coalescer
+from .scheduler import request_scheduler
+from .tracing import tracer
+from .memory_monitor import memory_monitor
+from .transcribe_jobs import transcription_job_manager
+from .embeddings import embedding_service, encode_embeddings, embeddings_to_bytes
 from utils.log_util import default_logger as logger
 
 router = APIRouter()
@@ -20,12 +30,45 @@ class Message(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     history: Optional[List[Message]] = []
+    # 采样参数，未设置时使用模型默认配置；temperature 为 0 时使用贪心解码，结果可被缓存
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    top_k: Optional[int] = None
+    max_tokens: Optional[int] = None
+    repetition_penalty: Optional[float] = None
+    # 随机种子，设置后由批量引擎生成，相同请求可复现相同输出
+    seed: Optional[int] = None
+    # 调度优先级，未设置时使用租户的默认优先级（通常为 interactive）
+    priority: Optional[Literal["interactive", "batch"]] = None
+    # 约束输出格式，如 {"type": "json_schema", "json_schema": {"schema": {...}}} 或 {"type": "regex", "regex": "..."}
+    response_format: Optional[Dict[str, Any]] = None
+
+    def sampling_params(self):
+        return {
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "top_k": self.top_k,
+            "max_new_tokens": self.max_tokens,
+            "repetition_penalty": self.repetition_penalty,
+            "seed": self.seed,
+            "response_format": self.response_format,
+        }
 
 class ChatResponse(BaseModel):
     response: str
     success: bool
     error: Optional[str] = None
 
+class ChatBatchRequest(BaseModel):
+    requests: List[ChatRequest]
+    # 整个批次作为一个请求调度，默认为 batch 优先级
+    priority: Optional[Literal["interactive", "batch"]] = "batch"
+
+class ChatBatchResponse(BaseModel):
+    responses: List[ChatResponse]
+    success: bool
+    error: Optional[str] = None
+
 class HealthResponse(BaseModel):
     status: str
     message: str
@@ -34,15 +77,113 @@ class ModelInfoResponse(BaseModel):
     model_config = {"protected_namespaces": ()}
     
     model_name: str
-    device: str
+    device: Optional[str] = None
     is_loaded: bool
     model_size: Optional[int] = None
+    load_seconds: Optional[float] = None
+    version: Optional[int] = None
+    active_requests: int = 0
+    standby: Optional[Dict[str, Any]] = None
+    swap: Dict[str, Any] = {}
+    grammar_cache: Optional[Dict[str, Any]] = None
+
+class ModelSwapRequest(BaseModel):
+    model_config = {"protected_namespaces": ()}
+    
+    model_name: str
+    # 切换后将旧模型保留在内存中，回滚时无需重新加载
+    keep_previous: bool = False
+    # 为 False 时立即返回，通过 GET /model/swap 查询进度
+    wait: bool = False
+
+class SessionCreateRequest(BaseModel):
+    system_prompt: Optional[str] = None
+
+class SessionChatRequest(BaseModel):
+    message: str
+
+class SessionResponse(BaseModel):
+    session_id: str
+    turns: int
+    num_tokens: int
+    has_kv_cache: bool
+    size_bytes: int
+    created_at: float
+    expires_at: float
+
+class EmbeddingRequest(BaseModel):
+    input: Union[str, List[str]]
+    pooling: Literal["mean", "last"] = "mean"
+    dtype: Literal["float32", "float16"] = "float32"
+    # float: JSON 数组；base64: 小端序二进制的 base64；raw: 直接返回 application/octet-stream
+    encoding_format: Literal["float", "base64", "raw"] = "base64"
+    normalize: bool = True
+
+class EmbeddingResponse(BaseModel):
+    model_config = {"protected_namespaces": ()}
+    
+    model_name: str
+    shape: List[int]
+    dtype: str
+    encoding_format: str
+    data: Union[str, List[List[float]]]
+    num_tokens: int
+
+def _sse_response(chunks):
+    """将文本块迭代器（同步或异步）包装为 SSE 流式响应"""
+    # 同步迭代器的每次迭代在线程池的不同线程中执行，span 显式传入
+    span = tracer.current_span()
+    if not hasattr(chunks, "__aiter__"):
+        chunks = iterate_in_threadpool(chunks)
+    
+    async def generate():
+        count = 0
+        try:
+            # 发送开始标记
+            yield f"data: {json.dumps({'type': 'start', 'content': ''})}\n\n"
+            
+            # 流式生成响应
+            async for chunk in chunks:
+                if count == 0 and span is not None:
+                    span.event("sse.first_chunk")
+                count += 1
+                # 发送文本块
+                yield f"data: {json.dumps({'type': 'chunk', 'content': chunk})}\n\n"
+            
+            # 发送结束标记
+            yield f"data: {json.dumps({'type': 'end', 'content': ''})}\n\n"
+            if span is not None:
+                span.set(**{"sse.chunks": count})
+            
+        except Exception as e:
+            logger.error(f"流式生成失败: {e}")
+            if span is not None:
+                span.set(**{"sse.chunks": count, "sse.error": str(e)})
+            # 发送错误信息
+            yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
+    
+    return StreamingResponse(
+        generate(),
+        media_type="text/plain",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"  # 禁用 nginx 缓冲
+        }
+    )
+
+def _get_session_or_404(session_id):
+    try:
+        return session_manager.get_session(session_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    """普通聊天接口"""
+async def chat(request: ChatRequest, x_api_key: Optional[str] = Header(None)):
+    """普通聊天接口，按 X-API-Key 区分租户进行公平调度"""
     try:
         logger.info(f"收到聊天请求: {request.message}")
+        request_scheduler.bind(x_api_key, request.priority)
         
         # 转换历史记录格式
         history = []
@@ -50,7 +191,8 @@ async def chat(request: ChatRequest):
             history = [{"role": msg.role, "content": msg.content} for msg in request.history]
         
         # 生成响应
-        response = model_manager.generate_response(request.message, history)
+        # 在事件循环中等待引擎线程的输出，确定性请求同样在事件循环中经过响应缓存和请求合并
+        response = await model_manager.agenerate_response(request.message, history, request.sampling_params())
         logger.info(f"生成响应完成:{response}")
         
         return ChatResponse(
@@ -66,44 +208,49 @@ async def chat(request: ChatRequest):
             error=str(e)
         )
 
+@router.post("/chat/batch", response_model=ChatBatchResponse)
+async def chat_batch(request: ChatBatchRequest, x_api_key: Optional[str] = Header(None)):
+    """批量聊天接口，多个请求在同一批次中生成，各自使用自己的采样参数"""
+    try:
+        logger.info(f"收到批量聊天请求: {len(request.requests)} 条")
+        request_scheduler.bind(x_api_key, request.priority)
+        
+        items = [
+            (
+                item.message,
+                [{"role": msg.role, "content": msg.content} for msg in item.history or []],
+                item.sampling_params(),
+            )
+            for item in request.requests
+        ]
+        responses = await run_in_threadpool(model_manager.generate_batch, items)
+        
+        return ChatBatchResponse(
+            responses=[ChatResponse(response=response, success=True) for response in responses],
+            success=True
+        )
+        
+    except Exception as e:
+        logger.error(f"批量聊天请求处理失败: {e}")
+        return ChatBatchResponse(
+            responses=[],
+            success=False,
+            error=str(e)
+        )
+
 @router.post("/chat/stream")
-async def chat_stream(request: ChatRequest):
+async def chat_stream(request: ChatRequest, x_api_key: Optional[str] = Header(None)):
     """流式聊天接口"""
     try:
         logger.info(f"收到流式聊天请求: {request.message}")
+        request_scheduler.bind(x_api_key, request.priority)
         
         # 转换历史记录格式
         history = []
         if request.history:
             history = [{"role": msg.role, "content": msg.content} for msg in request.history]
         
-        def generate():
-            try:
-                # 发送开始标记
-                yield f"data: {json.dumps({'type': 'start', 'content': ''})}\n\n"
-                
-                # 流式生成响应
-                for chunk in model_manager.generate_response_stream(request.message, history):
-                    # 发送文本块
-                    yield f"data: {json.dumps({'type': 'chunk', 'content': chunk})}\n\n"
-                
-                # 发送结束标记
-                yield f"data: {json.dumps({'type': 'end', 'content': ''})}\n\n"
-                
-            except Exception as e:
-                logger.error(f"流式生成失败: {e}")
-                # 发送错误信息
-                yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
-        
-        return StreamingResponse(
-            generate(),
-            media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no"  # 禁用 nginx 缓冲
-            }
-        )
+        return _sse_response(model_manager.generate_response_astream(request.message, history, request.sampling_params()))
         
     except Exception as e:
         logger.error(f"流式聊天请求处理失败: {e}")
@@ -133,17 +280,65 @@ async def get_model_info():
     try:
         info = model_manager.get_model_info()
         
-        return ModelInfoResponse(
-            model_name=info["model_name"],
-            device=info["device"],
-            is_loaded=info["is_loaded"],
-            model_size=info["model_size"]
-        )
+        return ModelInfoResponse(**info)
         
     except Exception as e:
         logger.error(f"获取模型信息失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/embeddings", response_model=EmbeddingResponse)
+async def create_embeddings(request: EmbeddingRequest):
+    """向量嵌入接口，复用已加载的模型"""
+    texts = [request.input] if isinstance(request.input, str) else request.input
+    try:
+        embeddings, num_tokens = await run_in_threadpool(
+            embedding_service.embed, texts, request.pooling, request.normalize, request.dtype
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"向量计算失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if request.encoding_format == "raw":
+        return Response(
+            content=embeddings_to_bytes(embeddings),
+            media_type="application/octet-stream",
+            headers={
+                "X-Embedding-Shape": ",".join(str(d) for d in embeddings.shape),
+                "X-Embedding-Dtype": request.dtype,
+                "X-Num-Tokens": str(num_tokens),
+            }
+        )
+    
+    if request.encoding_format == "float":
+        data = embeddings.astype("float32").tolist()
+    else:
+        data = encode_embeddings(embeddings)
+    
+    return EmbeddingResponse(
+        model_name=model_manager.model_name,
+        shape=list(embeddings.shape),
+        dtype=request.dtype,
+        encoding_format=request.encoding_format,
+        data=data,
+        num_tokens=num_tokens
+    )
+
+@router.get("/metrics")
+async def get_metrics():
+    """获取服务运行指标"""
+    return {
+        "response_cache": response_cache.get_stats(),
+        "sessions": session_manager.get_stats(),
+        "request_coalescing": request_coalescer.get_stats(),
+        "transcription": transcription_job_manager.get_stats(),
+        "scheduler": request_scheduler.get_stats(),
+        "engine": model_manager.get_engine_stats(),
+        "tracing": tracer.get_stats(),
+        "memory": memory_monitor.get_stats(),
+    }
+
 @router.post("/model/load")
 async def load_model():
     """加载模型"""
@@ -156,4 +351,91 @@ async def load_model():
         
     except Exception as e:
         logger.error(f"加载模型失败: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _run_in_background(fn, *args):
+    """在后台线程中执行模型切换，失败信息记录在 swap_status 中"""
+    def run():
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.error(f"模型切换失败: {e}")
+    threading.Thread(target=run, name="model-swap", daemon=True).start()
+
+@router.post("/model/swap")
+async def swap_model(request: ModelSwapRequest):
+    """热切换模型：后台加载新模型，旧模型继续服务，加载完成后切换并排空旧模型"""
+    if model_manager.swap_status["state"] in ("loading", "draining"):
+        raise HTTPException(status_code=409, detail="已有模型切换在进行中")
+    
+    if not request.wait:
+        _run_in_background(model_manager.swap_model, request.model_name, request.keep_previous)
+        return {"status": "accepted", "target": request.model_name}
+    
+    try:
+        result = await run_in_threadpool(model_manager.swap_model, request.model_name, request.keep_previous)
+        return {"status": "swapped", **result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/model/rollback")
+async def rollback_model(wait: bool = False):
+    """回滚到上一个模型，上一个模型保留在内存中时立即切换"""
+    if model_manager.swap_status["state"] in ("loading", "draining"):
+        raise HTTPException(status_code=409, detail="已有模型切换在进行中")
+    
+    if not wait:
+        _run_in_background(model_manager.rollback)
+        return {"status": "accepted"}
+    
+    try:
+        result = await run_in_threadpool(model_manager.rollback)
+        return {"status": "swapped", **result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/model/swap")
+async def get_swap_status():
+    """查询模型切换进度和最近一次切换的耗时"""
+    return model_manager.swap_status
+
+@router.post("/sessions", response_model=SessionResponse)
+async def create_session(request: SessionCreateRequest):
+    """创建服务端会话"""
+    session = session_manager.create_session(request.system_prompt)
+    return SessionResponse(**session.to_dict(session_manager.ttl_seconds))
+
+@router.get("/sessions/{session_id}", response_model=SessionResponse)
+async def get_session(session_id: str):
+    """获取会话信息"""
+    session = _get_session_or_404(session_id)
+    return SessionResponse(**session.to_dict(session_manager.ttl_seconds))
+
+@router.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """删除会话"""
+    if not session_manager.delete_session(session_id):
+        raise HTTPException(status_code=404, detail=f"会话不存在或已过期: {session_id}")
+    return {"status": "deleted", "session_id": session_id}
+
+@router.post("/sessions/{session_id}/chat", response_model=ChatResponse)
+async def session_chat(session_id: str, request: SessionChatRequest, x_api_key: Optional[str] = Header(None)):
+    """会话聊天接口，只需发送新消息"""
+    session = _get_session_or_404(session_id)
+    request_scheduler.bind(x_api_key)
+    try:
+        logger.info(f"收到会话聊天请求 [{session_id}]: {request.message}")
+        response = await run_in_threadpool(model_manager.generate_session_response, session, request.message)
+        return ChatResponse(response=response, success=True)
+        
+    except Exception as e:
+        logger.error(f"会话聊天请求处理失败: {e}")
+        return ChatResponse(response="", success=False, error=str(e))
+
+@router.post("/sessions/{session_id}/chat/stream")
+async def session_chat_stream(session_id: str, request: SessionChatRequest, x_api_key: Optional[str] = Header(None)):
+    """会话流式聊天接口，只需发送新消息"""
+    session = _get_session_or_404(session_id)
+    request_scheduler.bind(x_api_key)
+    logger.info(f"收到会话流式聊天请求 [{session_id}]: {request.message}")
+    return _sse_response(model_manager.generate_session_response_stream(session, request.message))
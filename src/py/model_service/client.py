@@ -12,37 +12,75 @@ from typing import List, Dict, Any, Optional
 class QwenClient:
     """Qwen3 模型服务客户端"""
     
-    def __init__(self, base_url: str = "http://localhost:19100"):
+    def __init__(self, base_url: str = "http://localhost:19100", api_key: Optional[str] = None):
         self.base_url = base_url.rstrip('/')
         self.api_base = f"{self.base_url}/api/v1"
+        # 复用连接；api_key 通过 X-API-Key 请求头发送，服务端据此区分租户进行调度
+        self.http = requests.Session()
+        if api_key:
+            self.http.headers["X-API-Key"] = api_key
         
-    def chat(self, message: str, history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
-        """普通聊天"""
+    def chat(self, message: str, history: Optional[List[Dict[str, str]]] = None,
+             response_format: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """普通聊天，response_format 用于约束输出格式"""
         url = f"{self.api_base}/chat"
         
         payload = {
             "message": message,
             "history": history or []
         }
+        if response_format:
+            payload["response_format"] = response_format
         
         try:
-            response = requests.post(url, json=payload, timeout=300)
+            response = self.http.post(url, json=payload, timeout=300)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
             return {"success": False, "error": str(e)}
     
-    def chat_stream(self, message: str, history: Optional[List[Dict[str, str]]] = None):
-        """流式聊天"""
+    def chat_stream(self, message: str, history: Optional[List[Dict[str, str]]] = None,
+                    response_format: Optional[Dict[str, Any]] = None):
+        """流式聊天，response_format 用于约束输出格式"""
         url = f"{self.api_base}/chat/stream"
         
         payload = {
             "message": message,
             "history": history or []
         }
+        if response_format:
+            payload["response_format"] = response_format
         
+        yield from self._stream_events(url, payload)
+    
+    def chat_batch(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """批量聊天，每项包含 message 以及可选的 history、采样参数和 response_format"""
+        url = f"{self.api_base}/chat/batch"
+        
+        try:
+            response = self.http.post(url, json={"requests": items}, timeout=600)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            return {"success": False, "error": str(e)}
+    
+    def chat_json(self, message: str, schema: Optional[Dict[str, Any]] = None,
+                  history: Optional[List[Dict[str, str]]] = None) -> Any:
+        """按 JSON Schema 约束生成并解析结果，未指定 schema 时只保证输出为 JSON 对象"""
+        if schema is None:
+            response_format = {"type": "json_object"}
+        else:
+            response_format = {"type": "json_schema", "json_schema": {"schema": schema}}
+        
+        result = self.chat(message, history, response_format=response_format)
+        if not result.get("success"):
+            raise RuntimeError(result.get("error") or "请求失败")
+        return json.loads(result["response"])
+    
+    def _stream_events(self, url: str, payload: Dict[str, Any]):
+        """发送请求并逐个解析 SSE 事件"""
         try:
-            response = requests.post(url, json=payload, stream=True, timeout=300)
+            response = self.http.post(url, json=payload, stream=True, timeout=300)
             response.raise_for_status()
             
             client = sseclient.SSEClient(response)
@@ -58,12 +96,120 @@ class QwenClient:
         except requests.exceptions.RequestException as e:
             yield {"type": "error", "content": str(e)}
     
+    def create_session(self, system_prompt: Optional[str] = None) -> Dict[str, Any]:
+        """创建服务端会话"""
+        url = f"{self.api_base}/sessions"
+        
+        try:
+            response = self.http.post(url, json={"system_prompt": system_prompt}, timeout=10)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            return {"error": str(e)}
+    
+    def session_chat(self, session_id: str, message: str) -> Dict[str, Any]:
+        """会话聊天，只发送新消息"""
+        url = f"{self.api_base}/sessions/{session_id}/chat"
+        
+        try:
+            response = self.http.post(url, json={"message": message}, timeout=300)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            return {"success": False, "error": str(e)}
+    
+    def session_chat_stream(self, session_id: str, message: str):
+        """会话流式聊天，只发送新消息"""
+        url = f"{self.api_base}/sessions/{session_id}/chat/stream"
+        yield from self._stream_events(url, {"message": message})
+    
+    def delete_session(self, session_id: str) -> Dict[str, Any]:
+        """删除服务端会话"""
+        url = f"{self.api_base}/sessions/{session_id}"
+        
+        try:
+            response = self.http.delete(url, timeout=10)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            return {"error": str(e)}
+    
+    def create_embeddings(self, texts: List[str], pooling: str = "mean", dtype: str = "float32",
+                          encoding_format: str = "base64") -> Dict[str, Any]:
+        """计算文本向量，base64 格式的结果可用 numpy.frombuffer 按 dtype 和 shape 还原"""
+        url = f"{self.api_base}/embeddings"
+        
+        payload = {
+            "input": texts,
+            "pooling": pooling,
+            "dtype": dtype,
+            "encoding_format": encoding_format
+        }
+        
+        try:
+            response = self.http.post(url, json=payload, timeout=300)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            return {"error": str(e)}
+    
+    def stream_subtitles(self, audio_path: str, fmt: str = "srt", language: Optional[str] = None):
+        """上传音频并逐条返回字幕文本，每识别完一段即可得到对应字幕"""
+        url = f"{self.api_base}/subtitles/stream"
+        params = {"format": fmt}
+        if language:
+            params["language"] = language
+        
+        with open(audio_path, "rb") as f:
+            response = self.http.post(url, params=params, data=f, stream=True, timeout=3600)
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+            if chunk:
+                yield chunk
+    
+    def submit_transcription(self, audio_path: str, language: Optional[str] = None) -> Dict[str, Any]:
+        """提交转写任务，返回任务 ID"""
+        url = f"{self.api_base}/transcribe"
+        params = {"language": language} if language else {}
+        
+        try:
+            with open(audio_path, "rb") as f:
+                response = self.http.post(url, params=params, data=f, timeout=600)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            return {"error": str(e)}
+    
+    def get_transcription(self, job_id: str) -> Dict[str, Any]:
+        """查询转写任务状态和已识别的段落"""
+        url = f"{self.api_base}/transcribe/{job_id}"
+        
+        try:
+            response = self.http.get(url, timeout=10)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            return {"error": str(e)}
+    
+    def stream_transcription(self, job_id: str):
+        """以 SSE 流式获取转写任务的段落"""
+        url = f"{self.api_base}/transcribe/{job_id}/stream"
+        
+        try:
+            response = self.http.get(url, stream=True, timeout=3600)
+            response.raise_for_status()
+            for event in sseclient.SSEClient(response).events():
+                if event.data:
+                    yield json.loads(event.data)
+        except requests.exceptions.RequestException as e:
+            yield {"type": "error", "content": str(e)}
+    
     def health_check(self) -> Dict[str, Any]:
         """健康检查"""
         url = f"{self.api_base}/health"
         
         try:
-            response = requests.get(url, timeout=10)
+            response = self.http.get(url, timeout=10)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -74,7 +220,7 @@ class QwenClient:
         url = f"{self.api_base}/model/info"
         
         try:
-            response = requests.get(url, timeout=10)
+            response = self.http.get(url, timeout=10)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -85,7 +231,30 @@ class QwenClient:
         url = f"{self.api_base}/model/load"
         
         try:
-            response = requests.post(url, timeout=300)
+            response = self.http.post(url, timeout=300)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            return {"error": str(e)}
+    
+    def swap_model(self, model_name: str, keep_previous: bool = False, wait: bool = True) -> Dict[str, Any]:
+        """热切换模型，wait 为 True 时等待切换和旧模型排空完成"""
+        url = f"{self.api_base}/model/swap"
+        payload = {"model_name": model_name, "keep_previous": keep_previous, "wait": wait}
+        
+        try:
+            response = self.http.post(url, json=payload, timeout=3600)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            return {"error": str(e)}
+    
+    def rollback_model(self, wait: bool = True) -> Dict[str, Any]:
+        """回滚到上一个模型"""
+        url = f"{self.api_base}/model/rollback"
+        
+        try:
+            response = self.http.post(url, params={"wait": wait}, timeout=3600)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -0,0 +1,835 @@
+"""
+约束解码
+
+将 JSON Schema 或正则表达式编译为有限状态机，生成时只允许能使输出继续匹配的 token：
+- 正则表达式先构造 NFA，再按需做子集构造得到字符级 DFA
+- 把 tokenizer 词表组织成前缀树，从每个 DFA 状态出发沿前缀树遍历一次，
+  得到该状态下允许的 token 集合，按位图保存
+- 编译时从初始状态出发预计算所有可达状态，结果按 (正则表达式) 缓存在模型槽位上
+
+生成时每一步只需按当前状态查出掩码张量并 masked_fill，状态转移沿所选 token 的文本
+在已缓存的 DFA 字符转移上走几步，不会在解码循环中遍历词表。
+
+限制：
+- 只支持正则表达式的常用子集（字符、字符类、分组、|、* + ? {m,n}），不支持反向引用和断言
+- JSON Schema 按属性声明顺序输出，不支持递归引用；无约束的对象/数组按有限嵌套深度展开
+- 字符串的 pattern 按整体匹配，且不会生成需要转义的字符（引号、反斜杠、控制字符）
+- 词表中只表示半个 UTF-8 字符的 token 不参与约束解码，模型需用完整字符的 token 输出
+"""
+
+import json
+import time
+import threading
+from collections import OrderedDict
+import torch
+from transformers import LogitsProcessor
+from utils.log_util import default_logger as logger
+
+# 不可能匹配的状态，以及生成结束符之后的状态
+DEAD_STATE = -1
+FINAL_STATE = -2
+
+# 单个语法允许的最大状态数，防止过于宽松的正则表达式编译出巨大的状态机
+MAX_GRAMMAR_STATES = 10000
+
+# 每个语法在各设备上缓存的掩码张量数量上限
+MAX_CACHED_MASKS = 256
+
+# 无约束对象/数组的最大嵌套深度
+FREE_FORM_DEPTH = 2
+
+
+class CharSet:
+    """字符集合，由若干闭区间组成，可取反"""
+
+    def __init__(self, ranges, negated=False):
+        self.ranges = tuple(ranges)
+        self.negated = negated
+
+    @classmethod
+    def literal(cls, ch):
+        return cls([(ord(ch), ord(ch))])
+
+    def matches(self, ch):
+        code = ord(ch)
+        for lo, hi in self.ranges:
+            if lo <= code <= hi:
+                return not self.negated
+        return self.negated
+
+    def excluding(self, ranges):
+        """去掉 ranges 中字符后的集合"""
+        if self.negated:
+            return CharSet(self.ranges + tuple(ranges), negated=True)
+        kept = []
+        for lo, hi in self.ranges:
+            pieces = [(lo, hi)]
+            for ex_lo, ex_hi in ranges:
+                pieces = [
+                    piece
+                    for p_lo, p_hi in pieces
+                    for piece in ((p_lo, min(p_hi, ex_lo - 1)), (max(p_lo, ex_hi + 1), p_hi))
+                    if piece[0] <= piece[1]
+                ]
+            kept.extend(pieces)
+        return CharSet(kept)
+
+    def to_regex(self):
+        if not self.negated and len(self.ranges) == 1 and self.ranges[0][0] == self.ranges[0][1]:
+            return _regex_char(self.ranges[0][0], _REGEX_SPECIAL)
+        body = "".join(
+            _regex_char(lo, _CLASS_SPECIAL) if lo == hi
+            else f"{_regex_char(lo, _CLASS_SPECIAL)}-{_regex_char(hi, _CLASS_SPECIAL)}"
+            for lo, hi in self.ranges
+        )
+        return f"[{'^' if self.negated else ''}{body}]"
+
+
+_REGEX_SPECIAL = set("\\.^$|?*+()[]{}")
+_CLASS_SPECIAL = set("\\[]^-")
+
+
+def _regex_char(code, special):
+    """单个字符在正则表达式中的写法，控制字符用 \\x 转义"""
+    if code < 0x20 or code == 0x7F:
+        return f"\\x{code:02x}"
+    ch = chr(code)
+    return "\\" + ch if ch in special else ch
+
+
+_DIGIT = [(ord("0"), ord("9"))]
+_WORD = [(ord("a"), ord("z")), (ord("A"), ord("Z")), (ord("0"), ord("9")), (ord("_"), ord("_"))]
+_SPACE = [(ord(c), ord(c)) for c in " \t\n\r\f\v"]
+_SHORTHAND = {"d": _DIGIT, "w": _WORD, "s": _SPACE}
+_CONTROL = {"n": "\n", "t": "\t", "r": "\r", "f": "\f", "v": "\v", "0": "\0"}
+_ANY_EXCEPT_NEWLINE = CharSet([(ord("\n"), ord("\n"))], negated=True)
+
+
+class RegexParser:
+    """
+    把正则表达式解析为语法树
+
+    节点: ("set", CharSet) / ("seq", [节点]) / ("alt", [节点]) / ("repeat", 节点, 最少, 最多或 None)
+    """
+
+    def __init__(self, pattern):
+        # 约束解码总是整体匹配，开头的 ^ 和结尾的 $ 没有额外含义
+        if pattern.startswith("^"):
+            pattern = pattern[1:]
+        if pattern.endswith("$") and not pattern.endswith("\\$"):
+            pattern = pattern[:-1]
+        self.pattern = pattern
+        self.pos = 0
+
+    def parse(self):
+        node = self._alternation()
+        if self.pos != len(self.pattern):
+            self._error("多余的 ')'")
+        return node
+
+    def _error(self, message):
+        raise ValueError(f"正则表达式解析失败 (位置 {self.pos}): {message}: {self.pattern!r}")
+
+    def _peek(self):
+        return self.pattern[self.pos] if self.pos < len(self.pattern) else None
+
+    def _next(self):
+        ch = self._peek()
+        if ch is None:
+            self._error("意外的结尾")
+        self.pos += 1
+        return ch
+
+    def _alternation(self):
+        branches = [self._sequence()]
+        while self._peek() == "|":
+            self.pos += 1
+            branches.append(self._sequence())
+        return branches[0] if len(branches) == 1 else ("alt", branches)
+
+    def _sequence(self):
+        items = []
+        while self._peek() not in (None, "|", ")"):
+            items.append(self._quantified(self._atom()))
+        return ("seq", items)
+
+    def _quantified(self, node):
+        while True:
+            ch = self._peek()
+            if ch == "*":
+                bounds = (0, None)
+            elif ch == "+":
+                bounds = (1, None)
+            elif ch == "?":
+                bounds = (0, 1)
+            elif ch == "{" and self._is_counted_repeat():
+                bounds = self._counted_repeat()
+            else:
+                return node
+            if ch != "{":
+                self.pos += 1
+            # 非贪婪修饰不改变可匹配的语言
+            if self._peek() == "?":
+                self.pos += 1
+            node = ("repeat", node, bounds[0], bounds[1])
+
+    def _is_counted_repeat(self):
+        end = self.pattern.find("}", self.pos)
+        body = self.pattern[self.pos + 1:end] if end != -1 else ""
+        return bool(body) and all(c.isdigit() or c == "," for c in body) and body[0] != ","
+
+    def _counted_repeat(self):
+        end = self.pattern.index("}", self.pos)
+        body = self.pattern[self.pos + 1:end]
+        self.pos = end + 1
+        if "," not in body:
+            return int(body), int(body)
+        low, high = body.split(",", 1)
+        low, high = int(low), (int(high) if high else None)
+        if high is not None and high < low:
+            self._error("重复次数范围无效")
+        return low, high
+
+    def _atom(self):
+        ch = self._next()
+        if ch == "(":
+            # 非捕获分组和捕获分组在这里没有区别
+            if self.pattern.startswith("?:", self.pos):
+                self.pos += 2
+            elif self._peek() == "?":
+                self._error("不支持断言和命名分组")
+            node = self._alternation()
+            if self._next() != ")":
+                self._error("缺少 ')'")
+            return node
+        if ch == "[":
+            return ("set", self._char_class())
+        if ch == ".":
+            return ("set", _ANY_EXCEPT_NEWLINE)
+        if ch == "\\":
+            return ("set", self._escape(in_class=False))
+        if ch in "*+?":
+            self._error(f"'{ch}' 前没有可重复的内容")
+        if ch in "^$":
+            self._error("只支持开头的 ^ 和结尾的 $，匹配字面字符需转义")
+        return ("set", CharSet.literal(ch))
+
+    def _escape(self, in_class):
+        ch = self._next()
+        if ch in _SHORTHAND:
+            return CharSet(_SHORTHAND[ch])
+        if ch.lower() in _SHORTHAND:
+            if in_class:
+                self._error(f"字符类中不支持 \\{ch}")
+            return CharSet(_SHORTHAND[ch.lower()], negated=True)
+        if ch in _CONTROL:
+            return CharSet.literal(_CONTROL[ch])
+        if ch in "xu":
+            width = 2 if ch == "x" else 4
+            digits = self.pattern[self.pos:self.pos + width]
+            if len(digits) != width or any(c not in "0123456789abcdefABCDEF" for c in digits):
+                self._error(f"\\{ch} 后需要 {width} 位十六进制数")
+            self.pos += width
+            return CharSet.literal(chr(int(digits, 16)))
+        if ch.isalnum():
+            self._error(f"不支持的转义 \\{ch}")
+        return CharSet.literal(ch)
+
+    def _class_char(self):
+        """字符类中的单个字符，返回 (字符, None) 或 (None, 简写字符集)"""
+        ch = self._next()
+        if ch != "\\":
+            return ch, None
+        escaped = self._escape(in_class=True)
+        if len(escaped.ranges) == 1 and escaped.ranges[0][0] == escaped.ranges[0][1]:
+            return chr(escaped.ranges[0][0]), None
+        return None, escaped
+
+    def _char_class(self):
+        negated = self._peek() == "^"
+        if negated:
+            self.pos += 1
+        ranges = []
+        first = True
+        while True:
+            if self._peek() == "]" and not first:
+                self.pos += 1
+                break
+            first = False
+            ch, shorthand = self._class_char()
+            if shorthand is not None:
+                ranges.extend(shorthand.ranges)
+                continue
+            if self._peek() == "-" and self.pattern[self.pos + 1:self.pos + 2] not in ("]", ""):
+                self.pos += 1
+                end, shorthand = self._class_char()
+                if shorthand is not None or ord(end) < ord(ch):
+                    self._error("字符范围无效")
+                ranges.append((ord(ch), ord(end)))
+            else:
+                ranges.append((ord(ch), ord(ch)))
+        return CharSet(ranges, negated=negated)
+
+
+def tree_to_regex(node):
+    """把 RegexParser 的语法树重新写成正则表达式"""
+    kind = node[0]
+    if kind == "set":
+        return node[1].to_regex()
+    if kind == "seq":
+        return "".join(tree_to_regex(item) for item in node[1])
+    if kind == "alt":
+        return "(" + "|".join(tree_to_regex(branch) for branch in node[1]) + ")"
+    _, child, low, high = node
+    body = tree_to_regex(child)
+    if child[0] != "set":
+        body = f"({body})"
+    return f"{body}{{{low},{'' if high is None else high}}}"
+
+
+def map_charsets(node, fn):
+    """对语法树中的每个字符集合应用 fn，返回新的语法树"""
+    kind = node[0]
+    if kind == "set":
+        return ("set", fn(node[1]))
+    if kind in ("seq", "alt"):
+        return (kind, [map_charsets(item, fn) for item in node[1]])
+    _, child, low, high = node
+    return ("repeat", map_charsets(child, fn), low, high)
+
+
+class RegexFSM:
+    """字符级 DFA，由 NFA 按需做子集构造，每个状态的字符转移缓存在各自的字典中"""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        # NFA: 每个状态的字符边 [(CharSet, 目标)] 和空边 [目标]
+        self._edges = []
+        self._eps = []
+        start, self._accept = self._build(RegexParser(pattern).parse())
+
+        self._state_sets = []
+        self._state_ids = {}
+        self._accepting = []
+        self._rows = []
+        self.initial_state = self._state_id(self._closure({start}))
+
+    def _new_state(self):
+        self._edges.append([])
+        self._eps.append([])
+        return len(self._edges) - 1
+
+    def _build(self, node):
+        """Thompson 构造，返回片段的 (起点, 终点)"""
+        kind = node[0]
+        start = self._new_state()
+        if kind == "set":
+            end = self._new_state()
+            self._edges[start].append((node[1], end))
+            return start, end
+        if kind == "seq":
+            end = start
+            for item in node[1]:
+                item_start, item_end = self._build(item)
+                self._eps[end].append(item_start)
+                end = item_end
+            return start, end
+        if kind == "alt":
+            end = self._new_state()
+            for branch in node[1]:
+                branch_start, branch_end = self._build(branch)
+                self._eps[start].append(branch_start)
+                self._eps[branch_end].append(end)
+            return start, end
+
+        _, child, low, high = node
+        end = start
+        for _ in range(low):
+            item_start, item_end = self._build(child)
+            self._eps[end].append(item_start)
+            end = item_end
+        if high is None:
+            # 零次或多次：片段终点可以回到起点
+            item_start, item_end = self._build(child)
+            loop = self._new_state()
+            self._eps[end].append(loop)
+            self._eps[loop].append(item_start)
+            self._eps[item_end].append(loop)
+            return start, loop
+        tail = self._new_state()
+        self._eps[end].append(tail)
+        for _ in range(high - low):
+            item_start, item_end = self._build(child)
+            self._eps[end].append(item_start)
+            self._eps[item_end].append(tail)
+            end = item_end
+        return start, tail
+
+    def _closure(self, states):
+        stack = list(states)
+        closure = set(states)
+        while stack:
+            for target in self._eps[stack.pop()]:
+                if target not in closure:
+                    closure.add(target)
+                    stack.append(target)
+        return frozenset(closure)
+
+    def _state_id(self, state_set):
+        state = self._state_ids.get(state_set)
+        if state is None:
+            state = len(self._state_sets)
+            self._state_ids[state_set] = state
+            self._state_sets.append(state_set)
+            self._accepting.append(self._accept in state_set)
+            self._rows.append({})
+        return state
+
+    @property
+    def num_states(self):
+        return len(self._state_sets)
+
+    def is_accepting(self, state):
+        return state >= 0 and self._accepting[state]
+
+    def row(self, state):
+        """状态的转移缓存（字符 -> 状态），未缓存的字符需调用 next_state"""
+        return self._rows[state]
+
+    def next_state(self, state, ch):
+        target = self._rows[state].get(ch)
+        if target is None:
+            moved = {
+                dst
+                for src in self._state_sets[state]
+                for charset, dst in self._edges[src]
+                if charset.matches(ch)
+            }
+            target = self._state_id(self._closure(moved)) if moved else DEAD_STATE
+            self._rows[state][ch] = target
+        return target
+
+    def walk(self, state, text):
+        for ch in text:
+            state = self.next_state(state, ch)
+            if state == DEAD_STATE:
+                break
+        return state
+
+
+class TokenVocabulary:
+    """tokenizer 词表的前缀树，用于一次遍历求出某个状态下所有可接受的 token"""
+
+    def __init__(self, tokenizer, eos_token_ids):
+        self.size = len(tokenizer)
+        self.eos_token_ids = sorted(set(eos_token_ids))
+        # 特殊 token 和额外添加的 token（如 <think>）不参与约束解码
+        excluded = set(tokenizer.all_special_ids) | set(getattr(tokenizer, "added_tokens_decoder", {}))
+
+        # 节点: [子节点字典, 在此结束的 token id 列表]
+        self.root = [{}, []]
+        # token id -> 文本，不参与约束解码的 token 为 None，生成时按文本计算状态转移
+        self.texts = [None] * self.size
+        count = 0
+        tokens = tokenizer.convert_ids_to_tokens(list(range(self.size)))
+        for token_id, token in enumerate(tokens):
+            if token is None or token_id in excluded:
+                continue
+            text = tokenizer.convert_tokens_to_string([token])
+            # 只含半个 UTF-8 字符的 token 解码为替换字符，无法按字符匹配
+            if not text or "�" in text:
+                continue
+            node = self.root
+            for ch in text:
+                child = node[0].get(ch)
+                if child is None:
+                    child = node[0][ch] = [{}, []]
+                node = child
+            node[1].append(token_id)
+            self.texts[token_id] = text
+            count += 1
+        logger.info(f"约束解码词表构建完成: {count}/{self.size} 个 token")
+
+
+class TokenGuide:
+    """
+    编译好的 token 级状态机
+
+    每个状态只保存允许 token 的位图（词表 15 万时每个状态约 19 KB），
+    下一状态在生成时沿 token 文本走 DFA 得到，字符转移在编译时都已缓存。
+    掩码张量按 (状态, 设备, 宽度) 缓存，数量有上限。
+    """
+
+    def __init__(self, fsm, vocabulary):
+        self.fsm = fsm
+        self.vocabulary = vocabulary
+        self.initial_state = fsm.initial_state
+        self.num_states = 0
+        self._allowed = {}
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+        self._compile()
+
+    def _compile(self):
+        """从初始状态出发预计算所有可达状态的允许 token"""
+        pending = [self.initial_state]
+        while pending:
+            state = pending.pop()
+            if state in self._allowed:
+                continue
+            if len(self._allowed) >= MAX_GRAMMAR_STATES:
+                raise ValueError(f"约束语法过于复杂，状态数超过 {MAX_GRAMMAR_STATES}")
+            allowed, targets = self._scan(state)
+            if self.fsm.is_accepting(state) or not allowed:
+                # 可以结束时允许结束符；词表无法继续匹配时也只能结束，避免整行 -inf
+                allowed.extend(self.vocabulary.eos_token_ids)
+            self._allowed[state] = self._pack(allowed)
+            pending.extend(s for s in targets if s not in self._allowed)
+        self.num_states = len(self._allowed)
+        self._allowed[DEAD_STATE] = self._allowed[FINAL_STATE] = self._pack(self.vocabulary.eos_token_ids)
+
+    def _pack(self, token_ids):
+        bits = bytearray((self.vocabulary.size + 7) // 8)
+        for token_id in token_ids:
+            bits[token_id >> 3] |= 1 << (token_id & 7)
+        return bytes(bits)
+
+    def _scan(self, state):
+        """沿词表前缀树与 DFA 同步遍历，死状态处剪枝，返回 (允许的 token, 可到达的状态)"""
+        allowed = []
+        targets = set()
+        fsm = self.fsm
+        stack = [(self.vocabulary.root, state)]
+        while stack:
+            node, current = stack.pop()
+            row = fsm.row(current)
+            for ch, child in node[0].items():
+                target = row.get(ch)
+                if target is None:
+                    target = fsm.next_state(current, ch)
+                if target == DEAD_STATE:
+                    continue
+                if child[1]:
+                    allowed.extend(child[1])
+                    targets.add(target)
+                if child[0]:
+                    stack.append((child, target))
+        return allowed, targets
+
+    def is_allowed(self, state, token_id):
+        bits = self._allowed[state]
+        return 0 <= token_id < self.vocabulary.size and bool(bits[token_id >> 3] >> (token_id & 7) & 1)
+
+    def next_state(self, state, token_id):
+        if state < 0 or token_id in self.vocabulary.eos_token_ids:
+            return FINAL_STATE
+        if not self.is_allowed(state, token_id):
+            return DEAD_STATE
+        return self.fsm.walk(state, self.vocabulary.texts[token_id])
+
+    def blocked_mask(self, state, device, width):
+        """该状态下禁止的 token 掩码（True 表示禁止）"""
+        key = (state, str(device), width)
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                return mask
+        bits = torch.frombuffer(bytearray(self._allowed[state]), dtype=torch.uint8)
+        allowed = ((bits.unsqueeze(1) >> torch.arange(8, dtype=torch.uint8)) & 1).view(-1).bool()
+        mask = torch.ones(width, dtype=torch.bool)
+        count = min(width, self.vocabulary.size)
+        mask[:count] = ~allowed[:count]
+        mask = mask.to(device)
+        with self._lock:
+            self._masks[key] = mask
+            while len(self._masks) > MAX_CACHED_MASKS:
+                self._masks.popitem(last=False)
+        return mask
+
+
+class GrammarLogitsProcessor(LogitsProcessor):
+    """按状态机屏蔽不合法 token 的 logits 处理器，每个请求使用一个新实例"""
+
+    def __init__(self, guide):
+        self.guide = guide
+        self._states = None
+
+    def __call__(self, input_ids, scores):
+        if self._states is None:
+            # 第一步，还没有生成任何 token
+            self._states = [self.guide.initial_state] * input_ids.shape[0]
+        else:
+            last_tokens = input_ids[:, -1].tolist()
+            self._states = [
+                self.guide.next_state(state, token_id)
+                for state, token_id in zip(self._states, last_tokens)
+            ]
+        width = scores.shape[-1]
+        blocked = torch.stack([
+            self.guide.blocked_mask(state, scores.device, width) for state in self._states
+        ])
+        return scores.masked_fill(blocked, float("-inf"))
+
+
+# ---------------------------------------------------------------------------
+# JSON Schema -> 正则表达式
+# ---------------------------------------------------------------------------
+
+WHITESPACE = r"[ ]?"
+_STRING_CHAR = r'([^"\\\x00-\x1f]|\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})'
+STRING = f'"{_STRING_CHAR}*"'
+INTEGER = r"-?(0|[1-9][0-9]*)"
+NUMBER = INTEGER + r"(\.[0-9]+)?([eE][+-]?[0-9]+)?"
+BOOLEAN = "(true|false)"
+NULL = "null"
+
+STRING_FORMATS = {
+    "date": r'"[0-9]{4}-[0-9]{2}-[0-9]{2}"',
+    "time": r'"[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]+)?(Z|[+-][0-9]{2}:[0-9]{2})?"',
+    "date-time": r'"[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]+)?(Z|[+-][0-9]{2}:[0-9]{2})?"',
+    "uuid": r'"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"',
+}
+
+def escape_regex(text):
+    return "".join("\\" + ch if ch in _REGEX_SPECIAL else ch for ch in text)
+
+
+# JSON 字符串中不能直接出现的字符: 控制字符、引号和反斜杠
+_JSON_UNSAFE = [(0x00, 0x1F), (ord('"'), ord('"')), (ord("\\"), ord("\\"))]
+
+
+def _string_pattern(pattern):
+    """
+    字符串的 pattern 约束，只匹配能直接写在 JSON 字符串中的字符
+
+    pattern 的每个字符集合都去掉控制字符、引号和反斜杠，即与 JSON 字符串字符集求交，
+    否则模型可以按 pattern 输出引号提前结束字符串，生成无效的 JSON。
+    """
+    def restrict(charset):
+        restricted = charset.excluding(_JSON_UNSAFE)
+        if not restricted.negated and not restricted.ranges:
+            raise ValueError(f"pattern 只能匹配 JSON 字符串中需要转义的字符: {pattern!r}")
+        return restricted
+
+    return tree_to_regex(map_charsets(RegexParser(pattern).parse(), restrict))
+
+
+def _json_literal(value):
+    return escape_regex(json.dumps(value, ensure_ascii=False))
+
+
+def _alternatives(patterns):
+    return "(" + "|".join(patterns) + ")"
+
+
+def _repeat_list(item, min_items=0, max_items=None):
+    """逗号分隔的 item 列表，不含外层括号"""
+    sep = f"{WHITESPACE},{WHITESPACE}"
+    if max_items == 0:
+        return ""
+    rest_min = max(min_items - 1, 0)
+    rest_max = "" if max_items is None else str(max_items - 1)
+    body = f"{item}({sep}{item}){{{rest_min},{rest_max}}}"
+    return body if min_items > 0 else f"({body})?"
+
+
+def _free_form(depth):
+    """无约束的 JSON 值，对象和数组按有限深度展开"""
+    scalars = [STRING, NUMBER, BOOLEAN, NULL]
+    if depth <= 0:
+        return _alternatives(scalars)
+    inner = _free_form(depth - 1)
+    array = rf"\[{WHITESPACE}{_repeat_list(inner)}{WHITESPACE}\]"
+    member = f"{STRING}{WHITESPACE}:{WHITESPACE}{inner}"
+    obj = rf"\{{{WHITESPACE}{_repeat_list(member)}{WHITESPACE}\}}"
+    return _alternatives(scalars + [array, obj])
+
+
+def _object_members(properties):
+    """
+    按声明顺序输出属性，可选属性可以省略
+
+    以“第一个出现的属性”为分支：该属性之前的必须都是可选的，
+    之后的必需属性前固定有逗号，可选属性连同逗号一起可省略。
+    """
+    sep = f"{WHITESPACE},{WHITESPACE}"
+    branches = []
+    for first, (_, first_pattern, _) in enumerate(properties):
+        parts = [first_pattern]
+        for _, pattern, is_required in properties[first + 1:]:
+            parts.append(f"{sep}{pattern}" if is_required else f"({sep}{pattern})?")
+        branches.append("".join(parts))
+        if properties[first][2]:
+            break
+    body = _alternatives(branches) if branches else ""
+    if not any(is_required for _, _, is_required in properties):
+        body = f"({body})?" if body else ""
+    return body
+
+
+def schema_to_regex(schema, root=None, depth=0):
+    """把 JSON Schema 转换为匹配其 JSON 文本的正则表达式"""
+    if root is None:
+        root = schema
+    if depth > 32:
+        raise ValueError("JSON Schema 嵌套过深或存在递归引用")
+    if schema is True or schema == {}:
+        return _free_form(FREE_FORM_DEPTH)
+    if not isinstance(schema, dict):
+        raise ValueError(f"无效的 JSON Schema: {schema!r}")
+
+    if "$ref" in schema:
+        ref = schema["$ref"]
+        if not ref.startswith("#/"):
+            raise ValueError(f"只支持文档内引用: {ref}")
+        target = root
+        for part in ref[2:].split("/"):
+            target = target[part]
+        return schema_to_regex(target, root, depth + 1)
+    if "const" in schema:
+        return _json_literal(schema["const"])
+    if "enum" in schema:
+        return _alternatives([_json_literal(value) for value in schema["enum"]])
+    for key in ("anyOf", "oneOf"):
+        if key in schema:
+            return _alternatives([schema_to_regex(s, root, depth + 1) for s in schema[key]])
+    if "allOf" in schema:
+        if len(schema["allOf"]) != 1:
+            raise ValueError("allOf 只支持单个子 Schema")
+        return schema_to_regex(schema["allOf"][0], root, depth + 1)
+
+    schema_type = schema.get("type")
+    if isinstance(schema_type, list):
+        return _alternatives([schema_to_regex({**schema, "type": t}, root, depth + 1) for t in schema_type])
+    if schema_type is None:
+        if "properties" in schema:
+            schema_type = "object"
+        elif "items" in schema:
+            schema_type = "array"
+        else:
+            return _free_form(FREE_FORM_DEPTH)
+
+    if schema_type == "string":
+        if "pattern" in schema:
+            return f'"({_string_pattern(schema["pattern"])})"'
+        if schema.get("format") in STRING_FORMATS:
+            return STRING_FORMATS[schema["format"]]
+        if "minLength" in schema or "maxLength" in schema:
+            low = schema.get("minLength", 0)
+            high = schema.get("maxLength", "")
+            return f'"{_STRING_CHAR}{{{low},{high}}}"'
+        return STRING
+    if schema_type == "integer":
+        return INTEGER
+    if schema_type == "number":
+        return NUMBER
+    if schema_type == "boolean":
+        return BOOLEAN
+    if schema_type == "null":
+        return NULL
+    if schema_type == "array":
+        items = schema.get("items")
+        item = schema_to_regex(items, root, depth + 1) if items is not None else _free_form(FREE_FORM_DEPTH - 1)
+        body = _repeat_list(item, schema.get("minItems", 0), schema.get("maxItems"))
+        return rf"\[{WHITESPACE}{body}{WHITESPACE}\]"
+    if schema_type == "object":
+        properties = schema.get("properties")
+        if not properties:
+            member = f"{STRING}{WHITESPACE}:{WHITESPACE}{_free_form(FREE_FORM_DEPTH - 1)}"
+            return rf"\{{{WHITESPACE}{_repeat_list(member)}{WHITESPACE}\}}"
+        required = set(schema.get("required", []))
+        members = [
+            (
+                name,
+                f"{_json_literal(name)}{WHITESPACE}:{WHITESPACE}{schema_to_regex(sub, root, depth + 1)}",
+                name in required,
+            )
+            for name, sub in properties.items()
+        ]
+        return rf"\{{{WHITESPACE}{_object_members(members)}{WHITESPACE}\}}"
+    raise ValueError(f"不支持的 JSON Schema 类型: {schema_type}")
+
+
+def response_format_to_regex(response_format):
+    """
+    把请求中的 response_format 转换为正则表达式，不需要约束时返回 None
+
+    支持:
+        {"type": "text"}
+        {"type": "json_object"}
+        {"type": "json_schema", "json_schema": {"name": ..., "schema": {...}}}
+        {"type": "regex", "regex": "..."}
+    """
+    if not response_format:
+        return None
+    kind = response_format.get("type")
+    if kind in (None, "text"):
+        return None
+    if kind == "json_object":
+        return schema_to_regex({"type": "object"})
+    if kind == "json_schema":
+        spec = response_format.get("json_schema") or {}
+        schema = spec.get("schema", spec)
+        return schema_to_regex(schema)
+    if kind == "regex":
+        if not response_format.get("regex"):
+            raise ValueError("response_format 缺少 regex")
+        return response_format["regex"]
+    raise ValueError(f"不支持的 response_format 类型: {kind}")
+
+
+class GrammarCompiler:
+    """为一个 tokenizer 编译并缓存约束语法，每个模型槽位一个实例"""
+
+    def __init__(self, tokenizer, eos_token_ids, max_entries=32):
+        self.tokenizer = tokenizer
+        self.eos_token_ids = eos_token_ids
+        self.max_entries = max_entries
+        self._vocabulary = None
+        self._guides = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def vocabulary(self):
+        if self._vocabulary is None:
+            self._vocabulary = TokenVocabulary(self.tokenizer, self.eos_token_ids)
+        return self._vocabulary
+
+    def compile(self, pattern):
+        """编译正则表达式为 TokenGuide，相同正则表达式复用缓存"""
+        # 编译只在首次遇到某个语法时发生，串行执行避免重复编译同一个语法
+        with self._lock:
+            guide = self._guides.get(pattern)
+            if guide is not None:
+                self._guides.move_to_end(pattern)
+                self.hits += 1
+                return guide
+
+            self.misses += 1
+            start = time.perf_counter()
+            guide = TokenGuide(RegexFSM(pattern), self.vocabulary)
+            logger.info(
+                f"约束语法编译完成: {guide.num_states} 个状态，耗时 {time.perf_counter() - start:.2f}s"
+            )
+            self._guides[pattern] = guide
+            while len(self._guides) > self.max_entries:
+                self._guides.popitem(last=False)
+            return guide
+
+    def logits_processor(self, response_format):
+        """为 response_format 创建新的 logits 处理器，不需要约束时返回 None"""
+        pattern = response_format_to_regex(response_format)
+        if pattern is None:
+            return None
+        return GrammarLogitsProcessor(self.compile(pattern))
+
+    def clear(self):
+        """丢弃已编译的语法（包括缓存在设备上的 token 掩码），词表索引保留"""
+        with self._lock:
+            self._guides.clear()
+
+    def get_stats(self):
+        return {"entries": len(self._guides), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,147 @@
+"""
+向量嵌入
+
+复用 ModelManager 已加载的模型计算文本向量：
+- 按 token 长度排序分桶组 batch，padding 长度向上取整到桶大小，减少无效计算
+- 支持 mean / last-token 两种池化方式
+- 结果以 float32 或 float16 的 numpy 数组返回，便于以二进制形式编码
+"""
+
+import base64
+import numpy as np
+import torch
+from .model_manager import model_manager
+from utils.log_util import default_logger as logger
+
+POOLING_METHODS = ("mean", "last")
+OUTPUT_DTYPES = {"float32": np.float32, "float16": np.float16}
+
+
+class EmbeddingService:
+    """基于已加载语言模型的向量嵌入服务"""
+
+    def __init__(self, manager, max_batch_size=32, max_batch_tokens=16384,
+                 max_length=8192, bucket_size=64):
+        """
+        Args:
+            manager: 通过 use_slot() 提供 model / tokenizer 的 ModelManager
+            max_batch_size: 单个 batch 的最大文本数
+            max_batch_tokens: 单个 batch padding 后的最大 token 数
+            max_length: 单条文本的最大 token 数，超出部分截断
+            bucket_size: padding 长度向上取整的粒度
+        """
+        self.manager = manager
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_length = max_length
+        self.bucket_size = bucket_size
+
+    def _bucket_length(self, length):
+        return min(-(-length // self.bucket_size) * self.bucket_size, self.max_length)
+
+    def _make_batches(self, token_ids):
+        """按长度排序后切分 batch，返回每个 batch 的原始下标列表"""
+        order = sorted(range(len(token_ids)), key=lambda i: len(token_ids[i]))
+        batches = []
+        current = []
+        for i in order:
+            # 排序后当前文本最长，决定整个 batch 的 padding 长度
+            padded = self._bucket_length(len(token_ids[i]))
+            if current and (
+                len(current) >= self.max_batch_size
+                or padded * (len(current) + 1) > self.max_batch_tokens
+            ):
+                batches.append(current)
+                current = []
+            current.append(i)
+        if current:
+            batches.append(current)
+        return batches
+
+    def _forward(self, slot, batch_ids, pooling):
+        """对一个 batch 做前向计算并池化"""
+        model = slot.model
+        tokenizer = slot.tokenizer
+        pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+
+        seq_len = self._bucket_length(max(len(ids) for ids in batch_ids))
+        input_ids = torch.full((len(batch_ids), seq_len), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch_ids), seq_len), dtype=torch.long)
+        for row, ids in enumerate(batch_ids):
+            # 右侧 padding，last-token 池化取每行最后一个有效位置
+            input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, :len(ids)] = 1
+
+        input_ids = input_ids.to(model.device)
+        attention_mask = attention_mask.to(model.device)
+
+        # 只运行 decoder 主干，跳过词表投影
+        decoder = model.get_decoder() if hasattr(model, "get_decoder") else model
+        with torch.no_grad():
+            outputs = decoder(input_ids=input_ids, attention_mask=attention_mask)
+        hidden = outputs.last_hidden_state.float()
+
+        if pooling == "last":
+            lengths = attention_mask.sum(dim=1) - 1
+            pooled = hidden[torch.arange(hidden.shape[0], device=hidden.device), lengths]
+        else:
+            mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        return pooled
+
+    def embed(self, texts, pooling="mean", normalize=True, dtype="float32"):
+        """
+        计算文本向量
+
+        Args:
+            texts: 文本列表
+            pooling: 池化方式，mean 或 last
+            normalize: 是否做 L2 归一化
+            dtype: 输出精度，float32 或 float16
+
+        Returns:
+            tuple: (形状为 [len(texts), hidden_size] 的 numpy 数组, 总 token 数)
+        """
+        if not texts:
+            raise ValueError("输入文本不能为空")
+        if pooling not in POOLING_METHODS:
+            raise ValueError(f"不支持的池化方式: {pooling}")
+        if dtype not in OUTPUT_DTYPES:
+            raise ValueError(f"不支持的输出精度: {dtype}")
+
+        # 整个请求使用同一个模型版本，热切换期间不会混用新旧模型
+        with self.manager.use_slot() as slot:
+            tokenizer = slot.tokenizer
+            token_ids = [
+                tokenizer.encode(text, add_special_tokens=False)[:self.max_length] or [tokenizer.eos_token_id]
+                for text in texts
+            ]
+
+            batches = self._make_batches(token_ids)
+            logger.info(f"计算向量: {len(texts)} 条文本，{len(batches)} 个 batch")
+
+            result = None
+            for indices in batches:
+                # 在引擎线程中两步之间执行，不与生成同时使用模型
+                pooled = slot.worker.call(self._forward, slot, [token_ids[i] for i in indices], pooling)
+                if normalize:
+                    pooled = torch.nn.functional.normalize(pooled, p=2, dim=-1)
+                if result is None:
+                    result = np.empty((len(texts), pooled.shape[-1]), dtype=OUTPUT_DTYPES[dtype])
+                result[indices] = pooled.cpu().numpy().astype(OUTPUT_DTYPES[dtype], copy=False)
+
+        return result, sum(len(ids) for ids in token_ids)
+
+
+def embeddings_to_bytes(array):
+    """将向量矩阵转换为行优先、小端序的原始字节"""
+    return np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<")).tobytes()
+
+
+def encode_embeddings(array):
+    """将向量矩阵编码为 base64 字符串"""
+    return base64.b64encode(embeddings_to_bytes(array)).decode("ascii")
+
+
+# 全局向量嵌入服务实例，复用全局模型管理器加载的模型
+embedding_service = EmbeddingService(model_manager)
@@ -0,0 +1,382 @@
+"""
+批量生成引擎
+
+按步驱动的连续批处理：
+- 新序列的 prompt 按固定大小分块预填充，每一步在 token 预算内穿插在运行中序列的解码之间，
+  长 prompt 不会让其他序列的逐 token 输出长时间停顿
+- 预填充完成的序列带着自己的 KV cache 加入运行批次
+- 运行中的序列每一步一起前向一个 token，批次组成不变时直接复用上一步的批量 KV cache，
+  有序列加入或结束时才把各序列的 cache 按左填充重新拼接
+- 每一步所有序列的 logits 一起交给 BatchSampler，按各自的采样参数一次完成采样
+
+每一步的 token 预算为 max_step_tokens（解码的序列各计 1 个 token，其余分给预填充块）；
+设置 target_step_ms 时按实测的每 token 耗时自动调整预算，使单步耗时（即其他序列的 token 间隔）
+不超过目标。
+
+只计算最后一个位置的 lm_head，长 prompt 预填充时不会生成 [长度, 词表] 的 logits。
+"""
+
+import time
+import uuid
+from collections import deque
+import torch
+import torch.nn.functional as F
+from .sampler import BatchSampler
+
+# 每一步至少预填充的 token 数，避免运行中的序列很多时预填充完全停滞
+MIN_PREFILL_TOKENS = 32
+
+
+def to_legacy_cache(cache):
+    """把模型返回的 cache 转换为每层 (key, value) 的列表"""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    if hasattr(cache, "key_cache"):
+        return list(zip(cache.key_cache, cache.value_cache))
+    return [tuple(layer) for layer in cache]
+
+
+def to_model_cache(layers):
+    """把每层 (key, value) 的列表转换为模型可接受的 DynamicCache"""
+    from transformers import DynamicCache
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(tuple(layers))
+    return DynamicCache(tuple(layers))
+
+
+class IncrementalDecoder:
+    """逐 token 增量解码文本，等待多字节字符完整后再输出，换行后从新位置开始解码"""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self._ids = []
+        self._printed = 0
+
+    def push(self, token_id):
+        self._ids.append(token_id)
+        text = self.tokenizer.decode(self._ids, skip_special_tokens=True)
+        if text.endswith("�"):
+            return ""
+        new_text = text[self._printed:]
+        if text.endswith("\n"):
+            self._ids = []
+            self._printed = 0
+        else:
+            self._printed = len(text)
+        return new_text
+
+
+class Sequence:
+    """引擎中的一个生成请求"""
+
+    def __init__(self, prompt_ids, params, eos_token_ids, logits_processor=None, request_id=None,
+                 cache=None, cache_len=0, keep_cache=False):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.prompt_ids = list(prompt_ids)
+        self.params = params
+        self.eos_token_ids = set(eos_token_ids)
+        self.logits_processor = logits_processor
+        self.output_ids = []
+        # 不在运行批次中时，序列自己持有每层 (key, value)；可以带着 prompt 前缀的 cache 加入（会话复用）
+        self.cache = cache
+        # 已写入 KV cache 的 token 数
+        self.cache_len = cache_len
+        # 结束后保留 KV cache（覆盖 prompt 和已输入模型的输出 token），供会话下一轮复用
+        self.keep_cache = keep_cache
+        self.presence = None
+        self.generator = None
+        self.finish_reason = None
+        self.arrived_at = time.perf_counter()
+        self.first_token_at = None
+
+    @property
+    def finished(self):
+        return self.finish_reason is not None
+
+
+class GenerationEngine:
+    """单个模型槽位上的批量生成引擎，step() 需在同一线程中串行调用"""
+
+    def __init__(self, slot, max_batch_size=32, prefill_chunk_size=512, max_step_tokens=2048,
+                 target_step_ms=None):
+        self.slot = slot
+        self.max_batch_size = max_batch_size
+        self.prefill_chunk_size = prefill_chunk_size
+        self.max_step_tokens = max_step_tokens
+        self.target_step_ms = target_step_ms
+        self.sampler = BatchSampler()
+        self.decoder = slot.model.get_decoder()
+        self.lm_head = slot.model.get_output_embeddings()
+        self.device = slot.model.device
+        self.waiting = deque()
+        # 已接纳、prompt 尚未全部写入 KV cache 的序列
+        self.prefilling = []
+        self.running = []
+        # 当前批量 KV cache 对应的序列 id、cache 和 attention mask
+        self._batch_ids = None
+        self._batch_cache = None
+        self._batch_mask = None
+        # 每 token 耗时的滑动平均（毫秒），用于按 target_step_ms 调整预算
+        self._ms_per_token = None
+        self._last_totals = (0, 0)
+        self.steps = 0
+        self.prefill_tokens = 0
+        self.decode_tokens = 0
+
+    @property
+    def has_work(self):
+        return bool(self.waiting or self.prefilling or self.running)
+
+    def add(self, seq):
+        self.waiting.append(seq)
+        return seq
+
+    def abort(self, seq, reason="abort"):
+        """结束序列并释放它的 KV cache"""
+        self._remove(seq)
+        seq.finish_reason = seq.finish_reason or reason
+        seq.cache = None
+
+    def suspend(self, seqs):
+        """把序列移出引擎（如调度器抢占），KV cache 留在序列上，之后用 resume() 继续"""
+        self._split_batch()
+        for seq in seqs:
+            self._remove(seq)
+
+    def resume(self, seq):
+        """继续被 suspend() 移出的序列，prompt 未预填充完的从断点继续预填充"""
+        if seq.finished:
+            return
+        if seq.output_ids:
+            self.running.append(seq)
+        else:
+            self.waiting.appendleft(seq)
+
+    def reset(self):
+        """丢弃所有序列和批量 KV cache（前向出错后恢复到初始状态）"""
+        for seq in list(self.waiting) + self.prefilling + self.running:
+            seq.cache = None
+        self.waiting.clear()
+        self.prefilling = []
+        self.running = []
+        self._batch_ids = self._batch_cache = self._batch_mask = None
+
+    def _remove(self, seq):
+        if seq in self.waiting:
+            self.waiting.remove(seq)
+        if seq in self.prefilling:
+            self.prefilling.remove(seq)
+        if seq in self.running:
+            self.running.remove(seq)
+
+    def step_budget(self):
+        """本步可处理的 token 数"""
+        budget = self.max_step_tokens
+        if self.target_step_ms and self._ms_per_token:
+            budget = min(budget, int(self.target_step_ms / self._ms_per_token))
+        return budget
+
+    def step(self):
+        """
+        执行一步：运行中的序列各解码一个 token，剩余预算分给等待中序列的预填充块
+
+        Returns:
+            [(序列, 新 token id)]，只在预填充中的步骤可能为空
+        """
+        start = time.perf_counter()
+        with torch.inference_mode():
+            rows, logits = [], []
+            budget = self.step_budget()
+            if self.running:
+                logits.append(self._decode(self.running))
+                rows.extend(self.running)
+                budget -= len(self.running)
+                self.decode_tokens += len(self.running)
+
+            while self.waiting and len(self.running) + len(self.prefilling) < self.max_batch_size:
+                self.prefilling.append(self.waiting.popleft())
+
+            # 按接纳顺序分块预填充，先接纳的序列先完成
+            admitted = []
+            budget = max(budget, MIN_PREFILL_TOKENS)
+            for seq in list(self.prefilling):
+                if budget <= 0:
+                    break
+                size = min(self.prefill_chunk_size, budget, len(seq.prompt_ids) - seq.cache_len)
+                seq_logits = self._prefill_chunk(seq, size)
+                budget -= size
+                self.prefill_tokens += size
+                if seq_logits is not None:
+                    self.prefilling.remove(seq)
+                    logits.append(seq_logits)
+                    rows.append(seq)
+                    admitted.append(seq)
+
+            if not rows:
+                self._record_step(start)
+                return []
+
+            tokens = self._sample(rows, torch.cat(logits)).tolist()
+
+            events = []
+            for seq, token_id in zip(rows, tokens):
+                self._append(seq, token_id)
+                events.append((seq, token_id))
+        self.running.extend(admitted)
+        finished = [s for s in self.running if s.finished]
+        if any(seq.keep_cache for seq in finished):
+            self._split_batch(keep=[seq for seq in finished if seq.keep_cache])
+        for seq in finished:
+            self._remove(seq)
+            if not seq.keep_cache:
+                seq.cache = None
+        self._record_step(start)
+        return events
+
+    def _record_step(self, start):
+        """记录单步耗时，更新每 token 耗时的滑动平均"""
+        self.steps += 1
+        tokens = self.prefill_tokens + self.decode_tokens - sum(self._last_totals)
+        if tokens:
+            ms_per_token = (time.perf_counter() - start) * 1000 / tokens
+            if self._ms_per_token is None:
+                self._ms_per_token = ms_per_token
+            else:
+                self._ms_per_token = 0.8 * self._ms_per_token + 0.2 * ms_per_token
+        self._last_totals = (self.prefill_tokens, self.decode_tokens)
+
+    def get_stats(self):
+        return {
+            "steps": self.steps,
+            "waiting": len(self.waiting),
+            "prefilling": len(self.prefilling),
+            "running": len(self.running),
+            "prefill_tokens": self.prefill_tokens,
+            "decode_tokens": self.decode_tokens,
+            "step_budget": self.step_budget(),
+            "ms_per_token": round(self._ms_per_token, 3) if self._ms_per_token else None,
+        }
+
+    def _forward(self, need_logits=True, **kwargs):
+        """前向计算，只对最后一个位置计算 lm_head"""
+        outputs = self.decoder(**kwargs, use_cache=True)
+        logits = None
+        if need_logits:
+            logits = self.lm_head(outputs.last_hidden_state[:, -1:, :])[:, -1, :]
+        return logits, outputs.past_key_values
+
+    def _prefill_chunk(self, seq, size):
+        """预填充 prompt 的下一块，prompt 全部写入 KV cache 后返回最后一个位置的 logits"""
+        start = seq.cache_len
+        end = start + size
+        done = end >= len(seq.prompt_ids)
+        kwargs = {
+            "input_ids": torch.tensor([seq.prompt_ids[start:end]], dtype=torch.long, device=self.device),
+            "position_ids": torch.arange(start, end, device=self.device).unsqueeze(0),
+        }
+        if seq.cache is not None:
+            kwargs["past_key_values"] = to_model_cache(seq.cache)
+        logits, cache = self._forward(need_logits=done, **kwargs)
+        seq.cache = to_legacy_cache(cache)
+        seq.cache_len = end
+        if not done:
+            return None
+        seq.generator = seq.params.make_generator(self.device)
+        return logits
+
+    def _decode(self, seqs):
+        ids = tuple(seq.request_id for seq in seqs)
+        if ids != self._batch_ids:
+            self._split_batch()
+            self._merge_batch(seqs)
+
+        input_ids = torch.tensor([[seq.output_ids[-1]] for seq in seqs], dtype=torch.long, device=self.device)
+        position_ids = torch.tensor([[seq.cache_len] for seq in seqs], dtype=torch.long, device=self.device)
+        self._batch_mask = torch.cat(
+            [self._batch_mask, self._batch_mask.new_ones((len(seqs), 1))], dim=1
+        )
+        logits, self._batch_cache = self._forward(
+            input_ids=input_ids,
+            attention_mask=self._batch_mask,
+            position_ids=position_ids,
+            past_key_values=self._batch_cache,
+        )
+        for seq in seqs:
+            seq.cache_len += 1
+        return logits
+
+    def _merge_batch(self, seqs):
+        """把各序列的 cache 左填充到相同长度后拼成一个批次"""
+        max_len = max(seq.cache_len for seq in seqs)
+        mask = torch.zeros((len(seqs), max_len), dtype=torch.long, device=self.device)
+        layers = []
+        for layer_index in range(len(seqs[0].cache)):
+            keys, values = [], []
+            for seq in seqs:
+                key, value = seq.cache[layer_index]
+                pad = max_len - seq.cache_len
+                keys.append(F.pad(key, (0, 0, pad, 0)) if pad else key)
+                values.append(F.pad(value, (0, 0, pad, 0)) if pad else value)
+            layers.append((torch.cat(keys), torch.cat(values)))
+        for row, seq in enumerate(seqs):
+            mask[row, max_len - seq.cache_len:] = 1
+            seq.cache = None
+
+        self._batch_ids = tuple(seq.request_id for seq in seqs)
+        self._batch_cache = to_model_cache(layers)
+        self._batch_mask = mask
+
+    def _split_batch(self, keep=()):
+        """批次组成变化前，把仍在运行的序列（以及 keep 中已结束的序列）的 cache 从批量 cache 中切出来"""
+        if self._batch_ids is None:
+            return
+        alive = {seq.request_id: seq for seq in list(self.running) + list(keep) if not seq.finished or seq in keep}
+        layers = to_legacy_cache(self._batch_cache)
+        total = self._batch_mask.shape[1]
+        for row, request_id in enumerate(self._batch_ids):
+            seq = alive.get(request_id)
+            if seq is None:
+                continue
+            start = total - seq.cache_len
+            seq.cache = [
+                (key[row:row + 1, :, start:, :], value[row:row + 1, :, start:, :])
+                for key, value in layers
+            ]
+        self._batch_ids = self._batch_cache = self._batch_mask = None
+
+    def _sample(self, rows, logits):
+        # 约束解码等逐序列的处理器只作用在各自的行上
+        for row, seq in enumerate(rows):
+            if seq.logits_processor is not None:
+                last = seq.output_ids[-1] if seq.output_ids else 0
+                input_ids = torch.tensor([[last]], dtype=torch.long, device=logits.device)
+                logits[row:row + 1] = seq.logits_processor(input_ids, logits[row:row + 1])
+
+        presence = None
+        if any(seq.params.repetition_penalty != 1.0 for seq in rows):
+            vocab = logits.shape[-1]
+            for seq in rows:
+                if seq.presence is None and seq.params.repetition_penalty != 1.0:
+                    seq.presence = torch.zeros(vocab, dtype=torch.bool, device=logits.device)
+                    seq.presence[torch.tensor(seq.prompt_ids + seq.output_ids, device=logits.device)] = True
+            empty = torch.zeros(vocab, dtype=torch.bool, device=logits.device)
+            presence = torch.stack([seq.presence if seq.presence is not None else empty for seq in rows])
+
+        return self.sampler.sample(
+            logits,
+            [seq.params for seq in rows],
+            presence=presence,
+            generators=[seq.generator for seq in rows],
+        )
+
+    def _append(self, seq, token_id):
+        if seq.first_token_at is None:
+            seq.first_token_at = time.perf_counter()
+        if token_id in seq.eos_token_ids:
+            seq.finish_reason = "stop"
+            return
+        seq.output_ids.append(token_id)
+        if seq.presence is not None:
+            seq.presence[token_id] = True
+        if len(seq.output_ids) >= seq.params.max_new_tokens:
+            seq.finish_reason = "length"
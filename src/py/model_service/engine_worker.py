@@ -0,0 +1,359 @@
+"""
+引擎线程
+
+每个模型槽位一个常驻线程，独占该槽位的模型并驱动批量生成引擎：
+- 请求方把分好词的序列提交给引擎线程，向调度器申请名额后立即返回；被调度的序列在下一步
+  加入运行批次，所有并发请求在同一个批次中逐 token 生成，不再为每个请求创建生成线程，
+  也不会有多个线程同时调用模型
+- 每个序列的输出通过自己的 TokenStream 推送 token id：在事件循环中提交的请求使用 asyncio 队列，
+  引擎线程通过 call_soon_threadsafe 写入，等待输出时不占用线程池线程；同步调用方使用普通队列
+- 每一步生成或预填充后向调度器报告用量，被抢占或限流的请求移出批次（KV cache 保留，
+  预填充到一半的从断点继续），重新调度后继续
+- 请求方停止读取（客户端断开）时取消请求，序列在下一步之前移出批次并归还名额
+- 其他需要使用模型的操作（如计算嵌入向量）通过 call() 在两步之间由引擎线程执行
+- 前向出错时结束批次中的所有请求并重置引擎，线程继续服务后续请求
+"""
+
+import time
+import queue
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future
+from .scheduler import request_scheduler
+from utils.log_util import default_logger as logger
+
+
+class StreamEnd:
+    """输出流的结束标记"""
+
+    def __init__(self, finish_reason=None, error=None):
+        self.finish_reason = finish_reason
+        self.error = error
+
+
+class TokenStream:
+    """一个序列的输出：引擎线程写入 token id，请求方同步或异步迭代，生成出错时在迭代处抛出异常"""
+
+    def __init__(self, loop=None):
+        self._loop = loop
+        self._queue = asyncio.Queue() if loop is not None else queue.SimpleQueue()
+        self.closed = False
+        self.finish_reason = None
+
+    def put(self, item):
+        """由引擎线程调用，请求方的事件循环已关闭时返回 False"""
+        if self._loop is None:
+            self._queue.put(item)
+            return True
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+            return True
+        except RuntimeError:
+            return False
+
+    def close(self, finish_reason=None, error=None):
+        if self.closed:
+            return
+        self.closed = True
+        self.put(StreamEnd(finish_reason, error))
+
+    def _end(self, item):
+        self.finish_reason = item.finish_reason
+        if item.error is not None:
+            raise RuntimeError(f"生成失败: {item.error}") from item.error
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if isinstance(item, StreamEnd):
+                self._end(item)
+                return
+            yield item
+
+    async def __aiter__(self):
+        while True:
+            item = await self._queue.get()
+            if isinstance(item, StreamEnd):
+                self._end(item)
+                return
+            yield item
+
+
+class GenerationJob:
+    """一次提交：一个或多个序列共用一个调度名额（批量请求一次提交多个序列）"""
+
+    def __init__(self, seqs, loop=None):
+        self.seqs = seqs
+        self.streams = {seq.request_id: TokenStream(loop) for seq in seqs}
+        self.ticket = None
+        # queued -> running -> (suspended -> running)* -> done
+        self.state = "queued"
+        self.cancel_requested = False
+        self.error = None
+        self.submitted_ns = time.time_ns()
+        self.admitted_ns = None
+        self.first_token_ns = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def output_tokens(self):
+        return sum(len(seq.output_ids) for seq in self.seqs)
+
+    def stream(self, seq=None):
+        return self.streams[(seq or self.seqs[0]).request_id]
+
+    def wait(self, timeout=None):
+        """等待所有序列生成结束，生成出错时抛出异常"""
+        self._done.wait(timeout)
+        if self.error is not None:
+            raise RuntimeError(f"生成失败: {self.error}") from self.error
+
+
+class EngineWorker:
+    """模型槽位的引擎线程"""
+
+    def __init__(self, slot, engine, scheduler=None):
+        self.slot = slot
+        self.engine = engine
+        self.scheduler = scheduler or request_scheduler
+        # 调度器回调和请求方写入、引擎线程取出；引擎线程持有 _cond 时不调用调度器
+        self._cond = threading.Condition()
+        self._admitted = deque()
+        self._cancelled = deque()
+        self._calls = deque()
+        self._live = set()
+        self._stopping = False
+        # 只由引擎线程访问：已加入引擎的序列 id -> 所属 job
+        self._jobs = {}
+        # 下次重新调度因配额等待的请求的时间（令牌桶恢复不会触发调度）
+        self._poll_at = None
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.suspensions = 0
+        self._thread = threading.Thread(target=self._run, name=f"engine-{slot.version}", daemon=True)
+        self._thread.start()
+
+    def submit(self, seqs, cost, loop=None):
+        """
+        提交序列并申请调度名额，立即返回
+
+        Args:
+            seqs: 共用一个名额的序列
+            cost: 调度开销估算
+            loop: 请求方所在的事件循环，设置时输出写入 asyncio 队列
+
+        Returns:
+            GenerationJob，生成结束前槽位保持被占用
+        """
+        job = GenerationJob(seqs, loop)
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("引擎线程已停止")
+            self._live.add(job)
+            self.submitted += 1
+        self.slot.acquire()
+        # 调度器可能在 submit 中直接回调 on_admit，此时不能持有 _cond
+        ticket = self.scheduler.submit(cost, on_admit=lambda ticket: self._on_admit(job, ticket))
+        with self._cond:
+            job.ticket = ticket
+            if ticket.state == "waiting":
+                self._poll_at = time.monotonic()
+                self._cond.notify()
+        return job
+
+    def cancel(self, job):
+        """请求方不再读取输出时调用，已结束的 job 忽略"""
+        with self._cond:
+            if job.done or job.cancel_requested:
+                return
+            job.cancel_requested = True
+            self._cancelled.append(job)
+            self._cond.notify()
+
+    def call(self, fn, *args, **kwargs):
+        """在引擎线程中两步之间执行 fn 并返回结果，用于需要独占模型的操作"""
+        if threading.current_thread() is self._thread:
+            return fn(*args, **kwargs)
+        future = Future()
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("引擎线程已停止")
+            self._calls.append((future, fn, args, kwargs))
+            self._cond.notify()
+        return future.result()
+
+    def shutdown(self, timeout=30):
+        """停止引擎线程，未完成的请求以错误结束"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _on_admit(self, job, ticket):
+        """调度器回调（持有调度器锁）：新调度或恢复的请求在下一步加入引擎"""
+        with self._cond:
+            job.ticket = ticket
+            self._admitted.append(job)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not (self._stopping or self._admitted or self._cancelled or self._calls
+                           or self.engine.has_work):
+                    timeout = None if self._poll_at is None else self._poll_at - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                if self._stopping:
+                    break
+                cancelled, self._cancelled = self._cancelled, deque()
+                admitted, self._admitted = self._admitted, deque()
+                calls, self._calls = self._calls, deque()
+
+            self._poll_scheduler()
+            for job in cancelled:
+                self._cancel(job)
+            for job in admitted:
+                self._start(job)
+            for future, fn, args, kwargs in calls:
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except Exception as e:
+                    future.set_exception(e)
+            if self.engine.has_work:
+                self._step()
+        self._stop()
+
+    def _poll_scheduler(self):
+        if self._poll_at is None or time.monotonic() < self._poll_at:
+            return
+        delay = self.scheduler.poll()
+        with self._cond:
+            self._poll_at = time.monotonic() + delay if delay is not None else None
+
+    def _start(self, job):
+        if job.done:
+            return
+        if job.state == "suspended":
+            for seq in job.seqs:
+                self.engine.resume(seq)
+        else:
+            job.admitted_ns = time.time_ns()
+            for seq in job.seqs:
+                self._jobs[seq.request_id] = job
+                self.engine.add(seq)
+        job.state = "running"
+
+    def _step(self):
+        # 预填充中的序列按 cache_len 的变化得到本步写入 KV cache 的 prompt token 数
+        prefilling = [(seq, seq.cache_len) for seq in list(self.engine.waiting) + self.engine.prefilling]
+        try:
+            events = self.engine.step()
+        except Exception as e:
+            seqs = list(self.engine.waiting) + self.engine.prefilling + self.engine.running
+            failed = {self._jobs[seq.request_id] for seq in seqs}
+            logger.error(f"引擎前向失败，结束批次中的 {len(failed)} 个请求: {e}")
+            self.engine.reset()
+            for job in failed:
+                self.failed += 1
+                self._finish(job, error=e)
+            return
+
+        now_ns = time.time_ns()
+        tokens = {}
+        prefilled = {}
+        for seq, cache_len in prefilling:
+            if seq.cache_len > cache_len:
+                job = self._jobs[seq.request_id]
+                prefilled[job] = prefilled.get(job, 0) + seq.cache_len - cache_len
+                tokens.setdefault(job, 0)
+        disconnected = set()
+        for seq, token_id in events:
+            job = self._jobs[seq.request_id]
+            if job.first_token_ns is None:
+                job.first_token_ns = now_ns
+            tokens[job] = tokens.get(job, 0) + 1
+            stream = job.streams[seq.request_id]
+            if token_id not in seq.eos_token_ids and not stream.put(token_id):
+                disconnected.add(job)
+            if seq.finished:
+                stream.close(seq.finish_reason)
+
+        for job, count in tokens.items():
+            if job in disconnected:
+                self._cancel(job)
+                continue
+            # 只有预填充进度的 job 以 0 个 token 检查，长 prompt 在预填充块之间也能被抢占或限流
+            proceed = self.scheduler.try_checkpoint(job.ticket, count, prefilled.get(job, 0))
+            if all(seq.finished for seq in job.seqs):
+                self.completed += 1
+                self._finish(job)
+            elif not proceed:
+                self._suspend(job)
+
+    def _suspend(self, job):
+        """被抢占或限流：移出批次，KV cache 留在序列上，等待调度器再次调度"""
+        self.engine.suspend([seq for seq in job.seqs if not seq.finished])
+        job.state = "suspended"
+        self.suspensions += 1
+        with self._cond:
+            self._poll_at = time.monotonic()
+
+    def _cancel(self, job):
+        if job.done:
+            return
+        for seq in job.seqs:
+            self.engine.abort(seq, "cancelled")
+        self.cancelled += 1
+        self._finish(job)
+
+    def _finish(self, job, error=None):
+        """结束 job：关闭输出流、归还调度名额和槽位"""
+        if job.done:
+            return
+        job.error = error
+        for seq in job.seqs:
+            self._jobs.pop(seq.request_id, None)
+            job.streams[seq.request_id].close(seq.finish_reason, error)
+        if job.ticket is not None:
+            self.scheduler.release(job.ticket)
+        job.state = "done"
+        with self._cond:
+            self._live.discard(job)
+        job._done.set()
+        self.slot.release()
+
+    def _stop(self):
+        with self._cond:
+            jobs = list(self._live)
+            calls, self._calls = self._calls, deque()
+        error = RuntimeError("模型已卸载")
+        for job in jobs:
+            for seq in job.seqs:
+                self.engine.abort(seq, "cancelled")
+            self._finish(job, error=error)
+        for future, _, _, _ in calls:
+            future.set_exception(error)
+        self.engine.reset()
+        logger.info(f"引擎线程已停止 (模型版本 {self.slot.version})")
+
+    def get_stats(self):
+        with self._cond:
+            live = len(self._live)
+        return {
+            "jobs": live,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+            "suspensions": self.suspensions,
+            "engine": self.engine.get_stats(),
+        }
@@ -0,0 +1,144 @@
+"""
+对话历史压缩
+
+在 tokenize 之前按 token 预算裁剪对话历史：
+- 固定保留开头的 system 提示词
+- 从最新一轮开始向前保留尽可能多的完整对话（滑动窗口）
+- 可选地将被裁掉的旧对话交给摘要函数生成摘要，摘要按内容哈希缓存
+"""
+
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from utils.log_util import default_logger as logger
+
+# 各模型的 prompt token 预算，未列出的模型使用 DEFAULT_CONTEXT_BUDGET
+MODEL_CONTEXT_BUDGETS = {
+    "Qwen/Qwen3-8B": 16384,
+    "Qwen/Qwen3-4B": 16384,
+    "Qwen/Qwen2.5-3B-Instruct": 16384,
+    "qwen/Qwen2.5-3B-Instruct": 16384,
+}
+DEFAULT_CONTEXT_BUDGET = 8192
+
+# chat template 为每条消息附加的角色标记等开销（估算值）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = "以下是之前对话的摘要：\n{summary}"
+
+
+class HistoryCompactor:
+    """基于 token 预算的对话历史压缩器"""
+
+    def __init__(self, tokenizer, max_prompt_tokens=DEFAULT_CONTEXT_BUDGET,
+                 summarizer=None, summary_cache_size=256):
+        """
+        Args:
+            tokenizer: 用于统计 token 数的 tokenizer
+            max_prompt_tokens: 送入模型的 prompt token 上限
+            summarizer: 可选的摘要函数，接收被裁掉的消息列表，返回摘要文本
+            summary_cache_size: 摘要缓存条目数上限
+        """
+        self.tokenizer = tokenizer
+        self.max_prompt_tokens = max_prompt_tokens
+        self.summarizer = summarizer
+        self.summary_cache_size = summary_cache_size
+        self._summary_cache = OrderedDict()
+        self._summary_lock = threading.Lock()
+        self._count_content_tokens = lru_cache(maxsize=4096)(self._count_content_tokens_uncached)
+
+    @classmethod
+    def for_model(cls, model_name, tokenizer, max_prompt_tokens=None, **kwargs):
+        """按模型名称创建压缩器，max_prompt_tokens 为空时使用该模型的默认预算"""
+        if max_prompt_tokens is None:
+            max_prompt_tokens = MODEL_CONTEXT_BUDGETS.get(model_name, DEFAULT_CONTEXT_BUDGET)
+        return cls(tokenizer, max_prompt_tokens=max_prompt_tokens, **kwargs)
+
+    def _count_content_tokens_uncached(self, content):
+        return len(self.tokenizer.encode(content, add_special_tokens=False))
+
+    def count_tokens(self, message):
+        """估算单条消息的 token 数"""
+        return self._count_content_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    def compact(self, messages):
+        """
+        压缩对话历史
+
+        Args:
+            messages: 完整消息列表，最后一条为本轮用户输入
+
+        Returns:
+            list: 不超过 token 预算（最新一轮始终保留）的消息列表
+        """
+        if not messages:
+            return messages
+
+        # 开头的 system 消息固定保留
+        num_pinned = 0
+        while num_pinned < len(messages) - 1 and messages[num_pinned]["role"] == "system":
+            num_pinned += 1
+        pinned = messages[:num_pinned]
+        turns = messages[num_pinned:]
+
+        budget = self.max_prompt_tokens - sum(self.count_tokens(m) for m in pinned)
+        total = sum(self.count_tokens(m) for m in turns)
+        if total <= budget:
+            return messages
+
+        start = self._window_start(turns, budget)
+        dropped, kept = turns[:start], turns[start:]
+
+        if self.summarizer is not None and dropped:
+            summary_message = {"role": "system", "content": SUMMARY_PROMPT.format(summary=self._summarize(dropped))}
+            summary_tokens = self.count_tokens(summary_message)
+            if summary_tokens < budget:
+                # 摘要需要占用预算，窗口相应缩小；新裁掉的消息不再重新摘要，保证摘要可被缓存复用
+                start += self._window_start(kept, budget - summary_tokens)
+                kept = turns[start:]
+                logger.info(f"对话历史压缩: 摘要 {len(dropped)} 条旧消息，丢弃 {start - len(dropped)} 条，保留 {len(kept)} 条")
+                return pinned + [summary_message] + kept
+
+        logger.info(f"对话历史压缩: 丢弃 {start} 条旧消息，保留 {len(kept)} 条")
+        return pinned + kept
+
+    def _window_start(self, turns, budget):
+        """从最新消息向前累加，返回预算内可保留的起始下标"""
+        used = 0
+        start = len(turns)
+        for i in range(len(turns) - 1, -1, -1):
+            used += self.count_tokens(turns[i])
+            if used > budget and i < len(turns) - 1:
+                break
+            start = i
+        # 窗口从用户消息开始，避免保留半轮对话
+        while start < len(turns) - 1 and turns[start]["role"] != "user":
+            start += 1
+        return start
+
+    def _summarize(self, dropped):
+        """生成被裁掉消息的摘要，按内容哈希缓存"""
+        key = hashlib.sha256(
+            json.dumps(dropped, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+        with self._summary_lock:
+            if key in self._summary_cache:
+                self._summary_cache.move_to_end(key)
+                return self._summary_cache[key]
+
+        summary = self.summarizer(dropped)
+
+        with self._summary_lock:
+            self._summary_cache[key] = summary
+            while len(self._summary_cache) > self.summary_cache_size:
+                self._summary_cache.popitem(last=False)
+        return summary
+
+    def clear_cache(self):
+        """清空摘要和 token 计数缓存"""
+        with self._summary_lock:
+            self._summary_cache.clear()
+        self._count_content_tokens.cache_clear()
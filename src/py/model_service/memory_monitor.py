@@ -0,0 +1,301 @@
+"""
+内存监控
+
+长时间运行的服务 RSS 缓慢上涨时，用于判断涨在哪里以及是否在泄漏：
+- 后台线程定期采样 RSS、线程数、文件描述符数和 torch 显存分配器统计（已分配、已预留、峰值、
+  分配重试和 OOM 次数），每隔若干次采样统计一次 Python 堆中各类型的对象个数
+- 按最近一段时间的 RSS 样本拟合增长速率，超过阈值时记录警告；对象个数与第一次统计相比
+  增长最多的类型一起给出，便于定位泄漏的对象
+- 配置了水位线时，RSS 或显存占用超过水位线会依次执行注册的缓存清理（响应缓存、会话 KV cache、
+  约束解码缓存等），然后 gc、归还空闲的 malloc 内存和 torch 缓存的显存；两次清理之间有冷却时间
+
+环境变量:
+    MODEL_SERVICE_MEMORY_SAMPLE_INTERVAL: 采样间隔（秒，默认 30）
+    MODEL_SERVICE_MEMORY_WATERMARK_MB: RSS 水位线（MB），未设置时不按 RSS 清理
+    MODEL_SERVICE_GPU_MEMORY_WATERMARK: 显存水位线（已预留占总显存的比例，如 0.9），未设置时不按显存清理
+"""
+
+import os
+import gc
+import time
+import ctypes
+import threading
+from collections import deque, Counter
+import torch
+from utils.log_util import default_logger as logger
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+# 保留的样本数，按默认间隔约 2 小时
+HISTORY_SIZE = 240
+
+# 拟合 RSS 增长速率至少需要的样本数和时间跨度（秒），避免把短时波动当作增长
+MIN_TREND_SAMPLES = 10
+MIN_TREND_SECONDS = 600
+
+# RSS 增长速率超过该值（MB/小时）时记录疑似泄漏的警告
+LEAK_WARNING_MB_PER_HOUR = 100
+
+# 每隔多少次采样统计一次 Python 对象类型（遍历整个堆，开销较大）
+TYPE_CENSUS_EVERY = 10
+
+# 报告的对象类型个数
+TOP_TYPES = 20
+
+# 两次清理之间的最短间隔（秒）
+TRIM_COOLDOWN_SECONDS = 60
+
+
+def _read_proc_status():
+    """读取 /proc/self/status 中的 VmRSS 和 Threads，非 Linux 系统返回空字典"""
+    try:
+        with open("/proc/self/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {}
+    status = {}
+    if "VmRSS" in fields:
+        status["rss_bytes"] = int(fields["VmRSS"].split()[0]) * 1024
+    if "Threads" in fields:
+        status["os_threads"] = int(fields["Threads"])
+    return status
+
+
+def _count_fds():
+    if PSUTIL_AVAILABLE and hasattr(psutil.Process(), "num_fds"):
+        return psutil.Process().num_fds()
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def _malloc_trim():
+    """把 glibc malloc 的空闲内存归还给系统，不是 glibc 时跳过"""
+    try:
+        return bool(ctypes.CDLL("libc.so.6").malloc_trim(0))
+    except (OSError, AttributeError):
+        return False
+
+
+def torch_memory_stats():
+    """各 CUDA 设备的显存分配器统计，没有 CUDA 时返回空列表"""
+    if not torch.cuda.is_available():
+        return []
+    devices = []
+    for index in range(torch.cuda.device_count()):
+        stats = torch.cuda.memory_stats(index)
+        devices.append({
+            "device": f"cuda:{index}",
+            "allocated_bytes": torch.cuda.memory_allocated(index),
+            "reserved_bytes": torch.cuda.memory_reserved(index),
+            "max_allocated_bytes": torch.cuda.max_memory_allocated(index),
+            "total_bytes": torch.cuda.get_device_properties(index).total_memory,
+            "alloc_retries": stats.get("num_alloc_retries", 0),
+            "ooms": stats.get("num_ooms", 0),
+        })
+    return devices
+
+
+def type_census():
+    """按类型统计 Python 堆中由 gc 跟踪的对象个数"""
+    return Counter(type(obj).__qualname__ for obj in gc.get_objects())
+
+
+class MemoryMonitor:
+    """定期采样进程内存，超过水位线时清理缓存"""
+
+    def __init__(self, interval=None, rss_watermark_mb=None, gpu_watermark=None):
+        self.interval = interval or float(os.environ.get("MODEL_SERVICE_MEMORY_SAMPLE_INTERVAL", "30"))
+        rss_watermark_mb = rss_watermark_mb or (
+            float(os.environ["MODEL_SERVICE_MEMORY_WATERMARK_MB"]) if os.environ.get("MODEL_SERVICE_MEMORY_WATERMARK_MB") else None
+        )
+        self.rss_watermark_bytes = int(rss_watermark_mb * 1024**2) if rss_watermark_mb else None
+        self.gpu_watermark = gpu_watermark or (
+            float(os.environ["MODEL_SERVICE_GPU_MEMORY_WATERMARK"]) if os.environ.get("MODEL_SERVICE_GPU_MEMORY_WATERMARK") else None
+        )
+        # [(name, fn)]，按注册顺序执行
+        self._trimmers = []
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._latest = None
+        self._baseline_types = None
+        self._latest_types = None
+        self._samples = 0
+        self._last_trim = None
+        self._last_trim_at = 0.0
+        self.trims = 0
+        self._last_leak_warning = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register_trimmer(self, name, fn):
+        """注册超过水位线时执行的缓存清理函数"""
+        self._trimmers.append((name, fn))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="memory-monitor", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"内存监控已启动，采样间隔 {self.interval}s，RSS 水位线 "
+            f"{self.rss_watermark_bytes // 1024**2 if self.rss_watermark_bytes else '-'} MB，"
+            f"显存水位线 {self.gpu_watermark or '-'}"
+        )
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                sample = self.sample()
+                reason = self._over_watermark(sample)
+                if reason and time.monotonic() - self._last_trim_at >= TRIM_COOLDOWN_SECONDS:
+                    self.trim(reason)
+            except Exception as e:
+                logger.error(f"内存采样失败: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def sample(self):
+        """采样一次并记录到历史中"""
+        status = _read_proc_status()
+        rss = status.get("rss_bytes")
+        if rss is None and PSUTIL_AVAILABLE:
+            rss = psutil.Process().memory_info().rss
+        sample = {
+            "timestamp": time.time(),
+            "rss_bytes": rss,
+            "python_threads": threading.active_count(),
+            "os_threads": status.get("os_threads"),
+            "open_fds": _count_fds(),
+            "torch": torch_memory_stats(),
+        }
+        if self._samples % TYPE_CENSUS_EVERY == 0:
+            census = type_census()
+            with self._lock:
+                if self._baseline_types is None:
+                    self._baseline_types = census
+                self._latest_types = census
+        with self._lock:
+            self._samples += 1
+            self._latest = sample
+            if rss is not None:
+                self._history.append((time.monotonic(), rss))
+        self._check_leak()
+        return sample
+
+    def _over_watermark(self, sample):
+        if self.rss_watermark_bytes and sample["rss_bytes"] and sample["rss_bytes"] > self.rss_watermark_bytes:
+            return f"RSS {sample['rss_bytes'] / 1024**2:.0f} MB 超过水位线 {self.rss_watermark_bytes / 1024**2:.0f} MB"
+        if self.gpu_watermark:
+            for device in sample["torch"]:
+                used = device["reserved_bytes"] / device["total_bytes"]
+                if used > self.gpu_watermark:
+                    return f"{device['device']} 显存占用 {used:.1%} 超过水位线 {self.gpu_watermark:.0%}"
+        return None
+
+    def trim(self, reason="手动触发"):
+        """执行注册的缓存清理，然后回收 Python 垃圾、malloc 空闲内存和 torch 缓存的显存"""
+        logger.warning(f"内存清理: {reason}")
+        before = _read_proc_status().get("rss_bytes")
+        steps = []
+        for name, fn in self._trimmers:
+            try:
+                fn()
+                steps.append(name)
+            except Exception as e:
+                logger.error(f"清理 {name} 失败: {e}")
+        collected = gc.collect()
+        steps.append(f"gc({collected})")
+        if _malloc_trim():
+            steps.append("malloc_trim")
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            steps.append("cuda_empty_cache")
+        after = _read_proc_status().get("rss_bytes")
+        self._last_trim_at = time.monotonic()
+        self.trims += 1
+        self._last_trim = {
+            "timestamp": time.time(),
+            "reason": reason,
+            "steps": steps,
+            "rss_before_bytes": before,
+            "rss_after_bytes": after,
+        }
+        if before and after:
+            logger.info(f"内存清理完成: {', '.join(steps)}，RSS {before / 1024**2:.0f} MB -> {after / 1024**2:.0f} MB")
+        else:
+            logger.info(f"内存清理完成: {', '.join(steps)}")
+        return self._last_trim
+
+    def rss_growth_mb_per_hour(self):
+        """用最小二乘拟合最近样本的 RSS 增长速率，样本不足时返回 None"""
+        with self._lock:
+            points = list(self._history)
+        if len(points) < MIN_TREND_SAMPLES or points[-1][0] - points[0][0] < MIN_TREND_SECONDS:
+            return None
+        t0 = points[0][0]
+        xs = [(t - t0) / 3600 for t, _ in points]
+        ys = [rss / 1024**2 for _, rss in points]
+        mean_x = sum(xs) / len(xs)
+        mean_y = sum(ys) / len(ys)
+        var = sum((x - mean_x) ** 2 for x in xs)
+        if var == 0:
+            return None
+        return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var
+
+    def _check_leak(self):
+        growth = self.rss_growth_mb_per_hour()
+        if growth is None or growth < LEAK_WARNING_MB_PER_HOUR:
+            return
+        if time.monotonic() - self._last_leak_warning < 3600:
+            return
+        self._last_leak_warning = time.monotonic()
+        growing = ", ".join(f"{name} +{count}" for name, count in self.type_growth()[:5])
+        logger.warning(f"RSS 持续增长 {growth:.0f} MB/小时，疑似内存泄漏；对象增长最多的类型: {growing or '-'}")
+
+    def type_growth(self):
+        """与第一次统计相比对象个数增长最多的类型"""
+        with self._lock:
+            baseline, latest = self._baseline_types, self._latest_types
+        if baseline is None or latest is None:
+            return []
+        growth = Counter(latest)
+        growth.subtract(baseline)
+        return [(name, count) for name, count in growth.most_common(TOP_TYPES) if count > 0]
+
+    def get_stats(self):
+        with self._lock:
+            latest = dict(self._latest) if self._latest is not None else None
+            latest_types = self._latest_types
+        growth = self.rss_growth_mb_per_hour()
+        return {
+            "interval_seconds": self.interval,
+            "samples": self._samples,
+            "latest": latest,
+            "rss_growth_mb_per_hour": round(growth, 2) if growth is not None else None,
+            "gc_objects": sum(latest_types.values()) if latest_types is not None else None,
+            "top_types": latest_types.most_common(TOP_TYPES) if latest_types is not None else [],
+            "type_growth": self.type_growth(),
+            "watermarks": {
+                "rss_bytes": self.rss_watermark_bytes,
+                "gpu_reserved_fraction": self.gpu_watermark,
+            },
+            "trims": self.trims,
+            "last_trim": self._last_trim,
+        }
+
+
+# 全局内存监控实例
+memory_monitor = MemoryMonitor()
@@ -6,12 +6,29 @@ Qwen3 模型管理器
 
 import os
 import sys
+import time
 import torch
+import asyncio
+import functools
+import itertools
 import threading
 import contextlib
+import contextvars
 from pathlib import Path
 from modelscope import AutoModelForCausalLM, AutoTokenizer
-from transformers import TextIteratorStreamer
+from .session_manager import session_manager
+from .model_slot import ModelSlot
+from .history_compactor import HistoryCompactor
+from .constrained_decoding import GrammarCompiler
+from .engine import GenerationEngine, IncrementalDecoder, Sequence, to_legacy_cache, to_model_cache
+from .engine_worker import EngineWorker
+from .sampler import SamplingParams
+from .scheduler import estimate_cost
+from .tracing import tracer
+from .response_cache import response_cache, is_deterministic
+from .request_coalescer import request_coalescer
+from .serving_format import SERVING_DIR_NAME, is_serving_artifact, load_serving_model
+from utils.model_manifest import validate_manifest
 from utils.log_util import default_logger as logger
 
 try:
@@ -94,30 +111,193 @@ def capture_model_logs():
         sys.stderr = old_stderr
 
 
+async def _run_in_thread(fn, *args):
+    """在默认线程池中执行 fn 并带上当前上下文（请求的租户和 span），不阻塞事件循环"""
+    # asyncio.to_thread 需要 Python 3.9
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(context.run, fn, *args))
+
+
 class ModelManager:
-    """模型管理器，负责加载和管理 Qwen3 模型"""
-    
-    def __init__(self, model_name="Qwen/Qwen3-8B"):
-        self.model_name = model_name
-        self.model = None
-        self.tokenizer = None
-        self.device = None
-        self.is_loaded = False
+    """模型管理器，负责加载和管理 Qwen3 模型，支持不停服热切换"""
+    
+    def __init__(self, model_name="Qwen/Qwen3-8B", max_prompt_tokens=None, enable_summary=None,
+                 prefill_chunk_size=None, max_step_tokens=None, target_step_ms=None):
+        # 尚未加载任何模型时使用的默认模型名称
+        self.default_model_name = model_name
+        # prompt token 预算，为空时使用 history_compactor 中该模型的默认值
+        self.max_prompt_tokens = max_prompt_tokens or (
+            int(os.environ["MODEL_SERVICE_MAX_PROMPT_TOKENS"]) if os.environ.get("MODEL_SERVICE_MAX_PROMPT_TOKENS") else None
+        )
+        # 是否对超出预算的旧对话生成摘要
+        self.enable_summary = (
+            enable_summary if enable_summary is not None else os.environ.get("MODEL_SERVICE_HISTORY_SUMMARY") == "1"
+        )
+        # 当前处理新请求的槽位
+        self._slot = None
+        # 切换后保留在内存中的上一个槽位，用于立即回滚
+        self._standby = None
+        # 上一个模型的名称，备用槽位已释放时回滚需要重新加载
+        self._previous_name = None
+        self._versions = itertools.count(1)
         self._load_lock = threading.Lock()
+        # 保护 _slot 的读取和替换，使请求取得槽位与切换互斥
+        self._slot_lock = threading.Lock()
+        # 同一时间只允许一次切换
+        self._swap_lock = threading.Lock()
+        # 旧模型排空的最长等待时间（秒），超时后不再等待客户端已断开但未关闭的流
+        self.drain_timeout = 600
+        # 批量引擎同时运行的最大序列数
+        self.max_batch_size = 32
+        # 长 prompt 分块预填充的块大小，块之间穿插其他请求的解码
+        self.prefill_chunk_size = prefill_chunk_size or int(os.environ.get("MODEL_SERVICE_PREFILL_CHUNK", "512"))
+        # 批量引擎每一步处理的 token 上限（解码 + 预填充）
+        self.max_step_tokens = max_step_tokens or int(os.environ.get("MODEL_SERVICE_MAX_STEP_TOKENS", "2048"))
+        # 目标单步耗时（毫秒），设置后按实测耗时收紧每步 token 预算
+        self.target_step_ms = target_step_ms or (
+            float(os.environ["MODEL_SERVICE_TARGET_STEP_MS"]) if os.environ.get("MODEL_SERVICE_TARGET_STEP_MS") else None
+        )
+        self.swap_status = {"state": "idle"}
+    
+    @property
+    def model_name(self):
+        return self._slot.model_name if self._slot is not None else self.default_model_name
+    
+    @property
+    def is_loaded(self):
+        return self._slot is not None
+    
+    @property
+    def model(self):
+        return self._slot.model if self._slot is not None else None
+    
+    @property
+    def tokenizer(self):
+        return self._slot.tokenizer if self._slot is not None else None
+    
+    @property
+    def device(self):
+        return self._slot.device if self._slot is not None else None
+    
+    @property
+    def load_seconds(self):
+        return self._slot.load_seconds if self._slot is not None else None
+    
+    @contextlib.contextmanager
+    def use_slot(self):
+        """
+        取得当前槽位并在使用期间计数，切换模型后旧槽位会等到计数归零再释放
+
+        一个请求从开始到结束都使用同一个槽位，不会中途换到新模型。
+        """
+        with self._slot_lock:
+            slot = self._slot
+            if slot is None:
+                raise RuntimeError("模型未加载，请先调用 load_model()")
+            slot.acquire()
+        try:
+            yield slot
+        finally:
+            slot.release()
         
-    def _get_model_path(self):
+    def _get_model_path(self, model_name):
         """获取模型路径，优先使用项目本地 models 目录"""
         # 获取项目根目录
         project_root = Path(__file__).parent.parent.parent.parent
-        local_model_path = project_root / "models" / self.model_name
+        local_model_path = project_root / "models" / model_name
+        
+        # 优先使用 prepare.convert_model 生成的服务格式
+        serving_path = local_model_path / SERVING_DIR_NAME
+        if is_serving_artifact(serving_path):
+            problems = validate_manifest(serving_path)
+            if problems:
+                raise RuntimeError(
+                    f"服务格式模型校验失败 ({serving_path}): {'; '.join(problems)}，请重新转换"
+                )
+            logger.info(f"使用服务格式模型: {serving_path}")
+            return str(serving_path)
         
         # 检查本地模型是否存在
         if local_model_path.exists() and (local_model_path / "config.json").exists():
+            # 由 prepare.model_downloader 下载的模型带有清单，只比较大小和修改时间，无需读取权重
+            problems = validate_manifest(local_model_path)
+            if problems:
+                raise RuntimeError(
+                    f"本地模型文件校验失败 ({local_model_path}): {'; '.join(problems)}，请重新运行下载"
+                )
             logger.info(f"使用本地模型: {local_model_path}")
             return str(local_model_path)
         else:
-            logger.info(f"本地模型不存在 ({local_model_path})，将从 ModelScope 下载: {self.model_name}")
-            return self.model_name
+            logger.info(f"本地模型不存在 ({local_model_path})，将从 ModelScope 下载: {model_name}")
+            return model_name
+
+    def _load_slot(self, model_name):
+        """加载模型到新的槽位，不影响当前正在服务的槽位"""
+        slot = ModelSlot(model_name, next(self._versions))
+        logger.info(f"开始加载模型: {model_name} (版本 {slot.version})")
+        
+        # 获取模型路径
+        model_path = self._get_model_path(model_name)
+        
+        # 配置模型参数
+        model_kwargs = {
+            "trust_remote_code": True,
+        }
+        
+        # 自动选择内存最多的 GPU
+        best_gpu = get_best_gpu()
+        if best_gpu is not None:
+            model_kwargs.update({
+                "torch_dtype": torch.float16,
+                "device_map": {"": best_gpu},
+            })
+            slot.device = f"cuda:{best_gpu}"
+        else:
+            logger.warning("未检测到 CUDA 设备，使用 CPU")
+            model_kwargs.update({"torch_dtype": torch.float32})
+            slot.device = "cpu"
+        
+        # 加载 tokenizer 和模型
+        logger.info(f"加载 tokenizer: {model_path}")
+        with capture_model_logs():
+            slot.tokenizer = AutoTokenizer.from_pretrained(
+                model_path, 
+                trust_remote_code=True
+            )
+        
+        slot.compactor = HistoryCompactor.for_model(
+            model_name,
+            slot.tokenizer,
+            max_prompt_tokens=self.max_prompt_tokens,
+            summarizer=(lambda messages: self._summarize_history(slot, messages)) if self.enable_summary else None,
+        )
+        
+        logger.info(f"加载模型: {model_path}")
+        if is_serving_artifact(model_path):
+            # 预转换格式：meta 设备构造结构 + 内存映射权重，精度以转换时为准
+            slot.model, slot.load_seconds = load_serving_model(model_path, device=slot.device)
+        else:
+            start = time.perf_counter()
+            with capture_model_logs():
+                slot.model = AutoModelForCausalLM.from_pretrained(
+                    model_path, 
+                    **model_kwargs
+                )
+            slot.load_seconds = time.perf_counter() - start
+        
+        # 结束符：批量引擎据此结束序列，约束解码在语法匹配完成时才允许生成
+        eos_token_ids = slot.model.generation_config.eos_token_id
+        if not isinstance(eos_token_ids, (list, tuple)):
+            eos_token_ids = [eos_token_ids]
+        slot.eos_token_ids = [t for t in eos_token_ids if t is not None]
+        if slot.tokenizer.eos_token_id is not None and slot.tokenizer.eos_token_id not in slot.eos_token_ids:
+            slot.eos_token_ids.append(slot.tokenizer.eos_token_id)
+        slot.grammars = GrammarCompiler(slot.tokenizer, slot.eos_token_ids)
+        slot.worker = EngineWorker(slot, self._new_engine(slot))
+        
+        slot.loaded_at = time.time()
+        logger.info(f"模型加载完成，设备: {slot.device}")
+        return slot
 
     def load_model(self):
         """加载模型"""
@@ -125,117 +305,382 @@ class ModelManager:
             if self.is_loaded:
                 return
             
-            logger.info(f"开始加载模型: {self.model_name}")
-            
-            # 获取模型路径
-            model_path = self._get_model_path()
+            slot = self._load_slot(self.default_model_name)
+            slot.state = "active"
+            with self._slot_lock:
+                self._slot = slot
+    
+    def swap_model(self, model_name, keep_previous=False):
+        """
+        热切换模型
+
+        新模型在后台加载，期间旧模型继续服务；加载完成后原子地把新请求切到新模型，
+        旧模型等待进行中的请求结束后释放，keep_previous 为 True 时保留在内存中用于立即回滚。
+        加载期间两个模型同时占用内存。
+
+        Returns:
+            dict: 切换结果，包含加载耗时、切换延迟和排空耗时
+        """
+        if not self._swap_lock.acquire(blocking=False):
+            raise RuntimeError("已有模型切换在进行中")
+        try:
+            self.swap_status = {"state": "loading", "target": model_name, "started_at": time.time()}
+            try:
+                slot = self._load_slot(model_name)
+            except Exception as e:
+                logger.error(f"新模型加载失败，继续使用当前模型: {e}")
+                self.swap_status = {"state": "failed", "target": model_name, "error": str(e)}
+                raise
+            return self._activate(slot, keep_previous)
+        finally:
+            self._swap_lock.release()
+    
+    def rollback(self):
+        """回滚到上一个模型：有备用槽位时立即切换，否则重新加载上一个模型"""
+        with self._swap_lock:
+            standby = self._standby
+            if standby is not None:
+                self._standby = None
+                # 回滚后当前模型保留为备用，便于再次切回
+                return self._activate(standby, keep_previous=True)
+            previous_name = self._previous_name
+        
+        if previous_name is None:
+            raise RuntimeError("没有可回滚的模型")
+        return self.swap_model(previous_name)
+    
+    def _activate(self, slot, keep_previous):
+        """切换到 slot，排空并处理旧槽位，调用方持有 _swap_lock"""
+        switch_start = time.perf_counter()
+        with self._slot_lock:
+            old = self._slot
+            self._slot = slot
+            slot.state = "active"
+        switch_latency_ms = (time.perf_counter() - switch_start) * 1000
+        logger.info(f"已切换到模型 {slot.model_name} (版本 {slot.version})，切换延迟 {switch_latency_ms:.3f}ms")
+        
+        result = {
+            "current": slot.to_dict(),
+            "previous": old.to_dict() if old is not None else None,
+            "switch_latency_ms": round(switch_latency_ms, 3),
+        }
+        self.swap_status = {"state": "draining", "target": slot.model_name, **result}
+        
+        if old is not None:
+            # 同名模型的新版本输出可能不同，旧版本的缓存结果不再适用
+            if old.model_name == slot.model_name:
+                response_cache.clear()
             
-            # 配置模型参数
-            model_kwargs = {
-                "trust_remote_code": True,
-            }
+            old.state = "draining"
+            drain_start = time.perf_counter()
+            if not old.wait_drained(self.drain_timeout):
+                logger.warning(f"旧模型排空超时，仍有 {old.active_requests} 个请求在使用")
+            result["drain_seconds"] = round(time.perf_counter() - drain_start, 3)
             
-            # 自动选择内存最多的 GPU
-            best_gpu = get_best_gpu()
-            if best_gpu is not None:
-                model_kwargs.update({
-                    "torch_dtype": torch.float16,
-                    "device_map": {"": best_gpu},
-                })
-                self.device = f"cuda:{best_gpu}"
+            # 之前保留的备用槽位不再需要
+            if self._standby is not None:
+                self._standby.unload()
+                self._standby = None
+            if keep_previous:
+                old.state = "standby"
+                self._standby = old
             else:
-                logger.warning("未检测到 CUDA 设备，使用 CPU")
-                model_kwargs.update({"torch_dtype": torch.float32})
-                self.device = "cpu"
-            
-            # 加载 tokenizer 和模型
-            logger.info(f"加载 tokenizer: {model_path}")
-            with capture_model_logs():
-                self.tokenizer = AutoTokenizer.from_pretrained(
-                    model_path, 
-                    trust_remote_code=True
-                )
-            
-            logger.info(f"加载模型: {model_path}")
-            with capture_model_logs():
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    model_path, 
-                    **model_kwargs
-                )
+                old.unload()
+            self._previous_name = old.model_name
+            result["previous"] = old.to_dict()
+            logger.info(f"旧模型 {old.model_name} (版本 {old.version}) 已排空，耗时 {result['drain_seconds']}s")
+        
+        self.swap_status = {"state": "idle", "last_swap": result}
+        return result
+    
+    def _tokenize(self, slot, messages):
+        """压缩历史并将消息转换为 prompt token id"""
+        with tracer.span("tokenize", messages=len(messages)) as span:
+            text = slot.tokenizer.apply_chat_template(
+                slot.compactor.compact(messages),
+                tokenize=False,
+                add_generation_prompt=True
+            )
             
-            self.is_loaded = True
-            logger.info(f"模型加载完成，设备: {self.device}")
+            input_ids = slot.tokenizer(text)["input_ids"]
+            if span is not None:
+                span.set(prompt_tokens=len(input_ids))
+            return input_ids
     
-    def generate_response(self, user_input, history=None):
+    def generate_response(self, user_input, history=None, sampling=None):
         """生成普通响应"""
-        if not self.is_loaded:
-            raise RuntimeError("模型未加载，请先调用 load_model()")
-        
+        return "".join(self.generate_response_stream(user_input, history, sampling))
+    
+    def generate_response_stream(self, user_input, history=None, sampling=None):
+        """生成流式响应（同步调用，确定性请求只查询和写入响应缓存，请求合并见 generate_response_astream）"""
         if history is None:
             history = []
         
         messages = history + [{"role": "user", "content": user_input}]
         
-        text = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True
-        )
+        with self.use_slot() as slot:
+            if not is_deterministic(sampling):
+                yield from self._stream_generate(slot, messages, sampling)
+                return
+            
+            # 命中缓存时按流式格式回放，未命中时生成后写入缓存
+            cache_key = response_cache.make_key(slot.model_name, messages, sampling)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                logger.info("命中响应缓存，流式回放")
+                tracer.event("response_cache.hit")
+                yield from response_cache.replay(cached)
+                return
+            response = ""
+            for new_text in self._stream_generate(slot, messages, sampling):
+                response += new_text
+                yield new_text
+            response_cache.put(cache_key, response)
+    
+    async def generate_response_astream(self, user_input, history=None, sampling=None):
+        """
+        在事件循环中生成流式响应，等待引擎线程推送 token 时不占用线程池线程
         
-        inputs = self.tokenizer(text, return_tensors="pt")
-        inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+        确定性请求优先查询响应缓存，未命中时与相同的进行中请求合并。
+        """
+        messages = (history or []) + [{"role": "user", "content": user_input}]
+        with self.use_slot() as slot:
+            if not is_deterministic(sampling):
+                async for new_text in self._agenerate_stream(slot, messages, sampling):
+                    yield new_text
+                return
+            
+            cache_key = response_cache.make_key(slot.model_name, messages, sampling)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                logger.info("命中响应缓存，流式回放")
+                tracer.event("response_cache.hit")
+                for new_text in response_cache.replay(cached):
+                    yield new_text
+                return
+            async for new_text in self._coalesced_astream(cache_key, messages, sampling):
+                yield new_text
+    
+    async def agenerate_response(self, user_input, history=None, sampling=None):
+        """在事件循环中生成普通响应"""
+        return "".join([new_text async for new_text in self.generate_response_astream(user_input, history, sampling)])
+    
+    def _coalesced_astream(self, cache_key, messages, sampling):
+        """合并相同的确定性请求，生成完成后写入响应缓存"""
         
-        with torch.no_grad():
-            result = self.model.generate(**inputs, max_new_tokens=32768)
-            response_ids = result[0][len(inputs["input_ids"][0]):].tolist()
-            response = self.tokenizer.decode(response_ids, skip_special_tokens=True)
+        async def source():
+            # 合并后的生成是事件循环中的任务，复制了发起者的上下文，按发起者的租户和优先级调度，
+            # 生成的 span 记在发起者的请求下；单独持有槽位直到生成结束
+            with self.use_slot() as slot:
+                response = ""
+                async for new_text in self._agenerate_stream(slot, messages, sampling):
+                    response += new_text
+                    yield new_text
+                response_cache.put(cache_key, response)
         
-        return response
+        return request_coalescer.subscribe(cache_key, source)
     
-    def generate_response_stream(self, user_input, history=None):
-        """生成流式响应"""
-        if not self.is_loaded:
-            raise RuntimeError("模型未加载，请先调用 load_model()")
+    async def _agenerate_stream(self, slot, messages, sampling=None):
+        """提交给引擎线程生成，在事件循环中逐块产生文本，调用方停止读取时取消生成"""
+        # 历史压缩和分词较耗 CPU（压缩还可能调用模型生成摘要），在线程中执行
+        seq = await _run_in_thread(self._make_sequence, slot, messages, sampling)
+        with tracer.span("generate", prompt_tokens=len(seq.prompt_ids)) as span:
+            job = self._submit(slot, seq, sampling, loop=asyncio.get_running_loop())
+            decoder = IncrementalDecoder(slot.tokenizer)
+            try:
+                async for token_id in job.stream():
+                    new_text = decoder.push(token_id)
+                    if new_text:
+                        yield new_text
+            finally:
+                slot.worker.cancel(job)
+            self._trace_phases(span, job)
+    
+    def _stream_generate(self, slot, messages, sampling=None):
+        """提交给引擎线程生成，逐块产生文本"""
+        seq = self._make_sequence(slot, messages, sampling)
+        with tracer.span("generate", prompt_tokens=len(seq.prompt_ids)) as span:
+            job = self._submit(slot, seq, sampling)
+            yield from self._read_stream(slot, job, span)
+    
+    def _read_stream(self, slot, job, span=None):
+        """增量解码 job 的输出，调用方停止读取时取消生成"""
+        decoder = IncrementalDecoder(slot.tokenizer)
+        try:
+            for token_id in job.stream():
+                new_text = decoder.push(token_id)
+                if new_text:
+                    yield new_text
+        finally:
+            slot.worker.cancel(job)
+        self._trace_phases(span, job)
+    
+    def _submit(self, slot, seq, sampling=None, loop=None):
+        """把序列提交给槽位的引擎线程，按当前请求的租户和优先级申请运行名额"""
+        max_new_tokens = (sampling or {}).get("max_new_tokens")
+        return slot.worker.submit([seq], estimate_cost(len(seq.prompt_ids), max_new_tokens), loop=loop)
+    
+    def _trace_phases(self, span, job):
+        """生成结束后补记 prefill（被调度到首个 token）和 decode（首个 token 到结束）两个子 span"""
+        if span is None:
+            return
+        end_ns = time.time_ns()
+        tokens = job.output_tokens
+        span.set(output_tokens=tokens)
+        start_ns = job.admitted_ns or job.submitted_ns
+        tracer.add_span("prefill", start_ns, job.first_token_ns or end_ns, parent=span)
+        if job.first_token_ns is not None:
+            tracer.add_span("decode", job.first_token_ns, end_ns, parent=span, tokens=tokens)
+    
+    def _new_engine(self, slot):
+        return GenerationEngine(
+            slot,
+            max_batch_size=self.max_batch_size,
+            prefill_chunk_size=self.prefill_chunk_size,
+            max_step_tokens=self.max_step_tokens,
+            target_step_ms=self.target_step_ms,
+        )
+    
+    def _make_sequence(self, slot, messages, sampling=None):
+        """把消息和采样参数转换为批量引擎中的序列"""
+        return Sequence(
+            self._tokenize(slot, messages),
+            SamplingParams.from_request(sampling, slot.model.generation_config),
+            slot.eos_token_ids,
+            logits_processor=slot.grammars.logits_processor((sampling or {}).get("response_format")),
+        )
+    
+    def generate_batch(self, requests):
+        """
+        在一个批次中生成多个请求，每个请求使用各自的采样参数
         
-        if history is None:
-            history = []
+        Args:
+            requests: [(user_input, history, sampling)]
         
-        messages = history + [{"role": "user", "content": user_input}]
+        Returns:
+            与 requests 顺序一致的响应文本列表
+        """
+        with self.use_slot() as slot:
+            seqs = [
+                self._make_sequence(slot, (history or []) + [{"role": "user", "content": user_input}], sampling)
+                for user_input, history, sampling in requests
+            ]
+            cost = sum(
+                estimate_cost(len(seq.prompt_ids), sampling and sampling.get("max_new_tokens"))
+                for seq, (_, _, sampling) in zip(seqs, requests)
+            )
+            # 整个批次作为一个请求调度，与其他请求的序列在同一个运行批次中生成
+            with tracer.span("generate", sequences=len(seqs)) as span:
+                job = slot.worker.submit(seqs, cost)
+                try:
+                    job.wait()
+                finally:
+                    slot.worker.cancel(job)
+                self._trace_phases(span, job)
+            return [slot.tokenizer.decode(seq.output_ids, skip_special_tokens=True) for seq in seqs]
+    
+    def _summarize_history(self, slot, messages):
+        """用槽位中的模型为被裁掉的旧对话生成摘要"""
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        prompt = [{"role": "user", "content": f"请用简洁的中文概括以下对话的要点，保留关键事实和结论：\n{transcript} /no_think"}]
         
-        text = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True
+        text = slot.tokenizer.apply_chat_template(prompt, tokenize=False, add_generation_prompt=True)
+        sampling = {"max_new_tokens": 512}
+        seq = Sequence(
+            slot.tokenizer(text)["input_ids"],
+            SamplingParams.from_request(sampling, slot.model.generation_config),
+            slot.eos_token_ids,
         )
+        job = self._submit(slot, seq, sampling)
+        job.wait()
+        return slot.tokenizer.decode(seq.output_ids, skip_special_tokens=True).strip()
+    
+    def _make_session_sequence(self, slot, session, messages):
+        """为会话构造序列，带上与上一轮共同前缀对应的 KV cache"""
+        input_ids = self._tokenize(slot, messages)
         
-        inputs = self.tokenizer(text, return_tensors="pt")
-        inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+        cache, cache_len = None, 0
+        past = session.past_key_values
+        if session.model_version != slot.version:
+            # 上一轮由切换前的模型生成，token 序列和 KV cache 都不能复用
+            past = None
+        if past is not None and hasattr(past, "crop"):
+            # 计算新 prompt 与上一轮 token 序列的最长公共前缀
+            prefix_len = 0
+            for old_id, new_id in zip(session.token_ids, input_ids):
+                if old_id != new_id:
+                    break
+                prefix_len += 1
+            # 至少保留一个新 token 参与 prefill
+            prefix_len = min(prefix_len, past.get_seq_length(), len(input_ids) - 1)
+            if prefix_len > 0:
+                past.crop(prefix_len)
+                cache, cache_len = to_legacy_cache(past), prefix_len
+                logger.info(f"会话 {session.session_id} 复用 KV cache: {prefix_len}/{len(input_ids)} tokens")
         
-        # 使用流式生成
-        streamer = TextIteratorStreamer(
-            self.tokenizer, 
-            skip_prompt=True, 
-            skip_special_tokens=True
+        return Sequence(
+            input_ids,
+            SamplingParams.from_request(None, slot.model.generation_config),
+            slot.eos_token_ids,
+            cache=cache,
+            cache_len=cache_len,
+            keep_cache=session_manager.store_kv_cache,
         )
-        generation_kwargs = dict(inputs, streamer=streamer, max_new_tokens=32768)
-        
-        thread = threading.Thread(target=self.model.generate, kwargs=generation_kwargs)
-        thread.start()
-        
-        for new_text in streamer:
-            yield new_text
-        
-        thread.join()
+    
+    def _update_session(self, slot, session, messages, response, seq):
+        """将本轮结果写回会话"""
+        session.messages = messages + [{"role": "assistant", "content": response}]
+        session.token_ids = seq.prompt_ids + seq.output_ids
+        session.past_key_values = to_model_cache(seq.cache) if seq.keep_cache and seq.cache is not None else None
+        session.model_version = slot.version
+        session_manager.update_session(session)
+    
+    def generate_session_response(self, session, user_input):
+        """基于服务端会话生成普通响应"""
+        return "".join(self.generate_session_response_stream(session, user_input))
+    
+    def generate_session_response_stream(self, session, user_input):
+        """基于服务端会话生成流式响应"""
+        with self.use_slot() as slot, session.lock:
+            messages = session.messages + [{"role": "user", "content": user_input}]
+            seq = self._make_session_sequence(slot, session, messages)
+            
+            with tracer.span("generate", prompt_tokens=len(seq.prompt_ids), session=session.session_id) as span:
+                job = self._submit(slot, seq)
+                response = ""
+                for new_text in self._read_stream(slot, job, span):
+                    response += new_text
+                    yield new_text
+            self._update_session(slot, session, messages, response, seq)
     
     def get_model_info(self):
         """获取模型信息"""
+        slot = self._slot
+        standby = self._standby
         return {
             "model_name": self.model_name,
             "device": self.device,
             "is_loaded": self.is_loaded,
-            "model_size": self.model.num_parameters() if self.is_loaded else None,
+            "model_size": slot.model.num_parameters() if slot is not None else None,
+            "load_seconds": self.load_seconds,
+            "version": slot.version if slot is not None else None,
+            "active_requests": slot.active_requests if slot is not None else 0,
+            "standby": standby.to_dict() if standby is not None else None,
+            "swap": self.swap_status,
+            "grammar_cache": slot.grammars.get_stats() if slot is not None else None,
         }
     
+    def get_engine_stats(self):
+        """当前槽位引擎线程的统计"""
+        slot = self._slot
+        return slot.worker.get_stats() if slot is not None and slot.worker is not None else None
+    
+    def trim_caches(self):
+        """内存紧张时丢弃各槽位已编译的约束语法，进行中的请求仍持有自己用到的语法"""
+        for slot in (self._slot, self._standby):
+            if slot is not None and slot.grammars is not None:
+                slot.grammars.clear()
+    
     def health_check(self):
         """健康检查"""
         if not self.is_loaded:
@@ -251,4 +696,4 @@ class ModelManager:
 
 
 # 全局模型管理器实例
-model_manager = ModelManager()
\ No newline at end of file
+model_manager = ModelManager()
@@ -0,0 +1,80 @@
+"""
+模型槽位
+
+每个已加载的模型版本占用一个槽位，记录正在使用它的请求数。
+热切换时新请求转到新槽位，旧槽位等待进行中的请求结束（排空）后再释放显存，
+或者保留为备用槽位以便立即回滚。
+"""
+
+import gc
+import threading
+import torch
+
+
+class ModelSlot:
+    """一个已加载的模型版本"""
+
+    def __init__(self, model_name, version):
+        self.model_name = model_name
+        self.version = version
+        self.model = None
+        self.tokenizer = None
+        self.compactor = None
+        # 生成结束符，与模型的 generation_config 一致
+        self.eos_token_ids = []
+        # 约束解码语法缓存，与 tokenizer 绑定
+        self.grammars = None
+        # 独占模型的引擎线程，所有生成都提交给它
+        self.worker = None
+        self.device = None
+        self.load_seconds = None
+        self.loaded_at = None
+        # loading -> active -> draining -> standby / released
+        self.state = "loading"
+        self._active_requests = 0
+        self._cond = threading.Condition()
+
+    @property
+    def active_requests(self):
+        return self._active_requests
+
+    def acquire(self):
+        with self._cond:
+            self._active_requests += 1
+
+    def release(self):
+        with self._cond:
+            self._active_requests -= 1
+            if self._active_requests == 0:
+                self._cond.notify_all()
+
+    def wait_drained(self, timeout=None):
+        """等待所有使用该槽位的请求结束，超时返回 False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._active_requests == 0, timeout)
+
+    def unload(self):
+        """停止引擎线程，释放模型占用的内存和显存"""
+        if self.worker is not None:
+            self.worker.shutdown()
+            self.worker = None
+        self.model = None
+        self.tokenizer = None
+        self.compactor = None
+        self.grammars = None
+        self.state = "released"
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def to_dict(self):
+        return {
+            "model_name": self.model_name,
+            "version": self.version,
+            "state": self.state,
+            "device": self.device,
+            "active_requests": self._active_requests,
+            "engine": self.worker.get_stats() if self.worker is not None else None,
+            "load_seconds": self.load_seconds,
+            "loaded_at": self.loaded_at,
+        }
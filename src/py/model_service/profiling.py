@@ -0,0 +1,334 @@
+"""
+运行时性能分析
+
+供管理接口（server.py，需要 X-Admin-Token）调用，不重启服务即可分析生产实例：
+- CPU 采样：后台线程按固定间隔采样所有线程的调用栈（类似 py-spy，开销只取决于采样间隔），
+  输出折叠栈格式（可用 flamegraph.pl 或 speedscope 打开）和按函数汇总的文本报告
+- torch.profiler：记录接下来 N 次模型前向（一次前向即一个生成步），导出 Chrome trace
+  （chrome://tracing 或 Perfetto 打开）和按算子汇总的文本报告。profiler 只记录启动它的线程上的算子，
+  因此在执行前向的引擎线程上启动和停止
+- tracemalloc：跟踪 Python 堆分配，每次快照与上一次比较，按代码位置列出增长最多的分配
+
+结果文件保存在 MODEL_SERVICE_PROFILE_DIR（默认项目根目录下的 profiles），通过管理接口下载。
+同一时间每种分析只能运行一个。
+"""
+
+import os
+import sys
+import time
+import torch
+import threading
+import tracemalloc
+from pathlib import Path
+from collections import Counter
+from torch.profiler import profile, ProfilerActivity
+from utils.log_util import default_logger as logger
+
+# 保留的结果文件个数，超出时删除最旧的
+MAX_ARTIFACTS = 50
+
+# 栈顶位于这些模块时认为线程处于等待（锁、队列、IO 多路复用），默认不计入采样
+IDLE_MODULES = {"threading.py", "queue.py", "selectors.py", "base_events.py"}
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """采样所有线程的 Python 调用栈，按折叠栈计数"""
+
+    def __init__(self, interval=0.01, max_seconds=60, include_idle=False, on_finish=None):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.include_idle = include_idle
+        self.on_finish = on_finish
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="cpu-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop.wait(self.interval):
+            self._sample()
+            if time.monotonic() >= deadline:
+                break
+        self.stopped_at = time.time()
+        if self.on_finish is not None:
+            self.on_finish(self)
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            if not self.include_idle and os.path.basename(frame.f_code.co_filename) in IDLE_MODULES:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def collapsed(self):
+        """折叠栈格式：每行一个调用栈（线程名;外层;...;内层）和采样次数"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def report(self, top=50):
+        """按函数汇总：self 为位于栈顶的采样数，total 为出现在栈中的采样数"""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        stacked = sum(self.stacks.values()) or 1
+        lines = [
+            f"采样次数: {self.samples}，间隔 {self.interval * 1000:.1f}ms，"
+            f"时长 {(self.stopped_at or time.time()) - self.started_at:.1f}s，"
+            f"{'包含' if self.include_idle else '不含'}等待中的线程",
+            "",
+            f"{'self':>8} {'self%':>7} {'total':>8} {'total%':>7}  函数",
+        ]
+        for frame, count in own.most_common(top):
+            lines.append(
+                f"{count:>8} {count / stacked:>7.1%} {total[frame]:>8} {total[frame] / stacked:>7.1%}  {frame}"
+            )
+        return "\n".join(lines) + "\n"
+
+
+class ProfilerManager:
+    """管理各类分析的运行状态和结果文件"""
+
+    def __init__(self, artifacts_dir=None):
+        if artifacts_dir is None:
+            artifacts_dir = os.environ.get("MODEL_SERVICE_PROFILE_DIR") or (
+                Path(__file__).parent.parent.parent.parent / "profiles"
+            )
+        self.artifacts_dir = Path(artifacts_dir)
+        self._lock = threading.Lock()
+        self._cpu = None
+        self._cpu_artifacts = []
+        self._torch_running = False
+        self._heap_snapshot = None
+        self._heap_started_at = None
+
+    # ---- 结果文件 ----
+
+    def _artifact_stem(self, prefix):
+        """一次分析的结果文件共用的路径前缀（不含扩展名）"""
+        self.artifacts_dir.mkdir(parents=True, exist_ok=True)
+        now = time.time()
+        return self.artifacts_dir / f"{prefix}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}"
+
+    def _write_artifact(self, stem, suffix, content):
+        path = stem.with_suffix(suffix)
+        path.write_text(content, encoding="utf-8")
+        self._prune()
+        return path.name
+
+    def _prune(self):
+        files = sorted((p for p in self.artifacts_dir.iterdir() if p.is_file()), key=lambda p: p.stat().st_mtime)
+        for path in files[:-MAX_ARTIFACTS]:
+            path.unlink(missing_ok=True)
+
+    def list_artifacts(self):
+        if not self.artifacts_dir.exists():
+            return []
+        return [
+            {"name": p.name, "size_bytes": p.stat().st_size, "created_at": p.stat().st_mtime}
+            for p in sorted(self.artifacts_dir.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)
+            if p.is_file()
+        ]
+
+    def artifact_path(self, name):
+        """结果文件路径，名称不合法或文件不存在时抛出 KeyError"""
+        path = self.artifacts_dir / name
+        if Path(name).name != name or not path.is_file():
+            raise KeyError(f"结果文件不存在: {name}")
+        return path
+
+    # ---- CPU 采样 ----
+
+    def start_cpu(self, interval_ms=10, max_seconds=60, include_idle=False):
+        """开始 CPU 采样，到达 max_seconds 后自动停止并保存结果"""
+        with self._lock:
+            if self._cpu is not None and self._cpu.running:
+                raise RuntimeError("CPU 采样已在运行")
+            self._cpu_artifacts = []
+            self._cpu = SamplingProfiler(interval_ms / 1000, max_seconds, include_idle, on_finish=self._save_cpu)
+            self._cpu.start()
+        logger.info(f"开始 CPU 采样，间隔 {interval_ms}ms，最长 {max_seconds}s")
+        return self.cpu_status()
+
+    def stop_cpu(self):
+        """停止 CPU 采样，返回结果文件名"""
+        cpu = self._cpu
+        if cpu is None:
+            raise RuntimeError("CPU 采样未启动")
+        cpu.stop()
+        return self.cpu_status()
+
+    def _save_cpu(self, cpu):
+        stem = self._artifact_stem("cpu")
+        self._cpu_artifacts = [
+            self._write_artifact(stem, ".collapsed", cpu.collapsed()),
+            self._write_artifact(stem, ".txt", cpu.report()),
+        ]
+        logger.info(f"CPU 采样结束: {cpu.samples} 次采样，结果 {self._cpu_artifacts}")
+
+    def cpu_status(self):
+        cpu = self._cpu
+        if cpu is None:
+            return {"state": "idle"}
+        return {
+            "state": "running" if cpu.running else "finished",
+            "samples": cpu.samples,
+            "started_at": cpu.started_at,
+            "stopped_at": cpu.stopped_at,
+            "artifacts": list(self._cpu_artifacts),
+        }
+
+    # ---- torch.profiler ----
+
+    def profile_torch(self, model, steps=20, timeout=120, run_on=None):
+        """
+        记录接下来 steps 次模型前向，超时后按已记录的部分导出（阻塞直到结束）
+
+        Args:
+            model: 被记录的模型，前向次数即生成步数
+            steps: 记录的生成步数
+            timeout: 最长等待秒数
+            run_on: 在执行前向的线程上调用函数的方法（如 EngineWorker.call），
+                profiler 在该线程上启动和停止；为 None 时在当前线程上启动
+
+        Returns:
+            dict: 实际记录的步数和结果文件名
+        """
+        with self._lock:
+            if self._torch_running:
+                raise RuntimeError("torch.profiler 已在运行")
+            self._torch_running = True
+        try:
+            done = threading.Event()
+            recorded = [0]
+
+            def count_step(module, args, output):
+                recorded[0] += 1
+                if recorded[0] >= steps:
+                    done.set()
+
+            activities = [ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(ProfilerActivity.CUDA)
+            logger.info(f"开始 torch.profiler，记录 {steps} 个生成步，最长 {timeout}s")
+            if run_on is None:
+                run_on = lambda fn: fn()
+            prof = profile(activities=activities, record_shapes=True)
+            run_on(prof.start)
+            handle = model.register_forward_hook(count_step)
+            try:
+                done.wait(timeout)
+            finally:
+                handle.remove()
+                run_on(prof.stop)
+
+            sort_by = "self_cuda_time_total" if torch.cuda.is_available() else "self_cpu_time_total"
+            stem = self._artifact_stem("torch")
+            trace_path = stem.with_suffix(".json")
+            prof.export_chrome_trace(str(trace_path))
+            artifacts = [
+                trace_path.name,
+                self._write_artifact(stem, ".txt", prof.key_averages().table(sort_by=sort_by, row_limit=50)),
+            ]
+            logger.info(f"torch.profiler 结束: 记录 {recorded[0]} 个生成步，结果 {artifacts}")
+            return {"steps": min(recorded[0], steps), "timed_out": not done.is_set(), "artifacts": artifacts}
+        finally:
+            self._torch_running = False
+
+    # ---- tracemalloc ----
+
+    def start_heap(self, frames=25):
+        """开始跟踪 Python 堆分配，frames 为每次分配记录的调用栈深度"""
+        with self._lock:
+            if tracemalloc.is_tracing():
+                raise RuntimeError("tracemalloc 已在运行")
+            tracemalloc.start(frames)
+            self._heap_snapshot = self._take_heap_snapshot()
+            self._heap_started_at = time.time()
+        logger.info(f"开始跟踪 Python 堆分配，调用栈深度 {frames}")
+        return self.heap_status()
+
+    def heap_snapshot(self, top=50):
+        """拍摄快照并与上一次快照比较，保存增长报告和原始快照（可用 tracemalloc.Snapshot.load 加载）"""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("tracemalloc 未启动")
+            snapshot = self._take_heap_snapshot()
+            previous, self._heap_snapshot = self._heap_snapshot, snapshot
+
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [
+            f"当前跟踪的分配: {current / 1024**2:.1f} MB，峰值 {peak / 1024**2:.1f} MB",
+            "",
+            f"与上一次快照相比增长最多的 {top} 个位置:",
+        ]
+        lines += [str(stat) for stat in snapshot.compare_to(previous, "lineno")[:top]]
+        lines += ["", f"当前占用最多的 {top} 个调用栈:"]
+        for stat in snapshot.statistics("traceback")[:top]:
+            lines.append(f"{stat.size / 1024:.1f} KiB，{stat.count} 个分配")
+            lines += [f"    {line}" for line in stat.traceback.format()]
+        stem = self._artifact_stem("heap")
+        report = self._write_artifact(stem, ".txt", "\n".join(lines) + "\n")
+        dump_path = stem.with_suffix(".tracemalloc")
+        snapshot.dump(str(dump_path))
+        self._prune()
+        return {**self.heap_status(), "traced_bytes": current, "peak_bytes": peak, "artifacts": [report, dump_path.name]}
+
+    @staticmethod
+    def _take_heap_snapshot():
+        # 不计入 tracemalloc 自身和导入机制的分配
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+    def stop_heap(self):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("tracemalloc 未启动")
+            tracemalloc.stop()
+            self._heap_snapshot = None
+            self._heap_started_at = None
+        logger.info("停止跟踪 Python 堆分配")
+        return self.heap_status()
+
+    def heap_status(self):
+        return {"tracing": tracemalloc.is_tracing(), "started_at": self._heap_started_at}
+
+
+# 全局分析管理器实例
+profiler_manager = ProfilerManager()
@@ -0,0 +1,110 @@
+"""
+请求合并（single-flight）
+
+相同的确定性请求在前一个仍在生成时到达，会挂到同一次生成上，
+而不是各自提交一次生成。生成作为事件循环中的任务运行（不额外创建线程），
+已产生的文本块会缓存在本次生成中，后加入的订阅者先回放已有文本块再继续接收新的文本块，
+普通和流式请求都以订阅者身份消费同一份输出。
+"""
+
+import asyncio
+import threading
+from utils.log_util import default_logger as logger
+
+
+class _Flight:
+    """一次正在进行的生成"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        """唤醒等待新文本块的订阅者"""
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self):
+        await self._changed.wait()
+
+
+class RequestCoalescer:
+    """按请求键合并正在进行的相同生成，需在事件循环中使用"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.num_flights = 0
+        self.num_coalesced = 0
+
+    def subscribe(self, key, source_fn):
+        """
+        订阅键为 key 的生成，不存在时启动新的生成
+
+        Args:
+            key: 请求键，相同键的请求共享生成结果
+            source_fn: 无参函数，返回产生文本块的异步迭代器，仅由发起者调用一次；
+                生成任务复制发起者的上下文（租户、优先级和 span）
+
+        Returns:
+            异步迭代器，依次产生本次生成的全部文本块
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.num_flights += 1
+                flight.task = loop.create_task(self._run(key, flight, source_fn))
+            else:
+                self.num_coalesced += 1
+                logger.info(f"合并相同的进行中请求: {key[:12]}")
+        return self._iter_flight(flight)
+
+    async def _run(self, key, flight, source_fn):
+        """驱动生成，订阅者断开不会中断生成"""
+        try:
+            async for chunk in source_fn():
+                flight.chunks.append(chunk)
+                flight.notify()
+        except Exception as e:
+            logger.error(f"合并请求生成失败: {e}")
+            flight.error = e
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done = True
+            flight.notify()
+
+    async def _iter_flight(self, flight):
+        index = 0
+        while True:
+            if index >= len(flight.chunks) and not flight.done:
+                await flight.wait()
+                continue
+            new_chunks = flight.chunks[index:]
+            index = len(flight.chunks)
+            done = flight.done
+            for chunk in new_chunks:
+                yield chunk
+            if done:
+                if flight.error is not None:
+                    raise RuntimeError(f"生成失败: {flight.error}")
+                return
+
+    def get_stats(self):
+        """获取请求合并统计信息"""
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "flights": self.num_flights,
+                "coalesced": self.num_coalesced,
+            }
+
+
+# 全局请求合并实例
+request_coalescer = RequestCoalescer()
@@ -0,0 +1,155 @@
+"""
+响应缓存
+
+对确定性（贪心解码）的请求按 (模型, 消息, 采样参数) 精确匹配缓存生成结果，
+内存占用有上限并按 LRU 淘汰，可选持久化到磁盘。
+
+环境变量:
+    MODEL_SERVICE_RESPONSE_CACHE_PATH: 持久化文件路径，设置时启动时加载、退出时保存，未设置时不持久化
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from utils.log_util import default_logger as logger
+
+# 流式回放缓存结果时每个文本块的字符数
+REPLAY_CHUNK_SIZE = 16
+
+
+def is_deterministic(sampling):
+    """只有贪心解码的请求结果可复现，才允许缓存"""
+    return bool(sampling) and sampling.get("temperature") == 0
+
+
+def _normalize_messages(messages):
+    return [
+        {"role": m["role"].strip().lower(), "content": " ".join(m["content"].split())}
+        for m in messages
+    ]
+
+
+class ResponseCache:
+    """基于 LRU 的精确匹配响应缓存"""
+
+    def __init__(self, max_entries=10000, max_bytes=256 * 1024**2, persist_path=None):
+        """
+        Args:
+            max_entries: 最大缓存条目数
+            max_bytes: 缓存响应文本的总字节数上限
+            persist_path: 持久化文件路径，为空时不持久化
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.persist_path = persist_path
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if self.persist_path:
+            self.load()
+
+    @staticmethod
+    def make_key(model_name, messages, sampling):
+        """根据归一化后的模型名、消息和采样参数生成缓存键"""
+        payload = {
+            "model": model_name,
+            "messages": _normalize_messages(messages),
+            "sampling": {k: v for k, v in sorted((sampling or {}).items()) if v is not None},
+        }
+        return hashlib.sha256(
+            json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key):
+        """查找缓存，未命中返回 None"""
+        with self._lock:
+            response = self._entries.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return response
+
+    def put(self, key, response):
+        """写入缓存并按 LRU 淘汰超出上限的条目"""
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= len(old.encode("utf-8"))
+            self._entries[key] = response
+            self._total_bytes += size
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted.encode("utf-8"))
+
+    def replay(self, response):
+        """将缓存的完整响应拆分为文本块，供流式接口回放"""
+        for i in range(0, len(response), REPLAY_CHUNK_SIZE):
+            yield response[i:i + REPLAY_CHUNK_SIZE]
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def trim(self, fraction=0.5):
+        """淘汰最久未使用的条目，直到占用不超过当前的 fraction，用于内存紧张时释放内存"""
+        with self._lock:
+            target = self._total_bytes * fraction
+            while self._entries and self._total_bytes > target:
+                _, response = self._entries.popitem(last=False)
+                self._total_bytes -= len(response.encode("utf-8"))
+    
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "total_bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def load(self):
+        """从磁盘加载缓存"""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            for key, response in entries:
+                self.put(key, response)
+            logger.info(f"从 {self.persist_path} 加载响应缓存 {len(self._entries)} 条")
+        except Exception as e:
+            logger.error(f"加载响应缓存失败: {e}")
+
+    def save(self):
+        """将缓存写入磁盘（先写临时文件再替换，避免写入中断损坏文件）"""
+        if not self.persist_path:
+            return
+        with self._lock:
+            entries = list(self._entries.items())
+        tmp_path = f"{self.persist_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+            logger.info(f"响应缓存已保存到 {self.persist_path}，共 {len(entries)} 条")
+        except Exception as e:
+            logger.error(f"保存响应缓存失败: {e}")
+
+
+# 全局响应缓存实例
+response_cache = ResponseCache(persist_path=os.environ.get("MODEL_SERVICE_RESPONSE_CACHE_PATH") or None)
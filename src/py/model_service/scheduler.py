@@ -0,0 +1,435 @@
+"""
+请求调度
+
+生成请求提交给引擎线程时向调度器申请运行名额，名额数限制批量引擎中同时生成的请求数，
+其余请求排队。调度器不阻塞调用方：请求被调度（包括暂停后恢复）时回调 on_admit，
+引擎线程每步生成或预填充一块 prompt 后调用 try_checkpoint，需要暂停时把请求移出批次：
+- 优先级分为 interactive（交互）和 batch（批处理），空闲名额优先分配给 interactive
+- 同一优先级内按 API Key 加权公平排队（自计时公平排队）：每个请求按估算的 token 数除以
+  租户权重得到虚拟完成时间，虚拟完成时间最小的先运行，大量提交的租户不会饿死其他租户
+- 名额已满时新到达的 interactive 请求会抢占运行中的 batch 请求：被抢占的请求在下一个
+  token 处暂停并让出名额（KV cache 保留在内存中），之后按原来的虚拟完成时间恢复
+- 租户可以配置 token 速率配额（令牌桶），prompt 和生成的 token 都计入配额，
+  配额用完时请求在下一个 token 或预填充块处暂停，令牌恢复后继续
+- 按优先级统计排队时间、首 token 延迟、总延迟以及抢占和限流次数
+
+租户配置文件（MODEL_SERVICE_TENANTS 指定路径）示例:
+    {
+      "default": {"weight": 1},
+      "tenants": {
+        "<API Key>": {"name": "offline-jobs", "weight": 1, "priority": "batch",
+                      "tokens_per_second": 200, "burst": 4000},
+        "<API Key>": {"name": "web", "weight": 4}
+      }
+    }
+租户的 priority 既是默认优先级也是上限，batch 租户的请求不能提升为 interactive。
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import contextvars
+from collections import deque, OrderedDict
+from .tracing import tracer
+from utils.log_util import default_logger as logger
+
+PRIORITIES = ("interactive", "batch")
+DEFAULT_PRIORITY = "interactive"
+
+# 估算请求开销时计入的生成 token 数上限
+EXPECTED_OUTPUT_TOKENS = 256
+
+# 延迟统计保留的最近样本数
+LATENCY_WINDOW = 1000
+
+# 未在配置文件中的 API Key 按默认配置自动创建租户，最多保留的个数
+MAX_DYNAMIC_TENANTS = 1024
+
+_current_request = contextvars.ContextVar("model_service_request", default=None)
+
+
+def estimate_cost(prompt_tokens, max_new_tokens=None):
+    """请求开销估算：prompt token 数加上预计生成的 token 数"""
+    expected = EXPECTED_OUTPUT_TOKENS if max_new_tokens is None else min(max_new_tokens, EXPECTED_OUTPUT_TOKENS)
+    return prompt_tokens + expected
+
+
+class TokenBucket:
+    """令牌桶，允许透支，余额不为正时不能再运行"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, tokens):
+        self.level -= tokens
+
+    def seconds_until_available(self, now):
+        self.refill(now)
+        return 0.0 if self.level > 0 else (1 - self.level) / self.rate
+
+
+class Tenant:
+    """一个 API Key 对应的租户"""
+
+    def __init__(self, name, weight=1.0, priority=DEFAULT_PRIORITY, tokens_per_second=None, burst=None):
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的优先级: {priority}")
+        self.name = name
+        self.weight = float(weight)
+        self.priority = priority
+        self.bucket = None
+        if tokens_per_second:
+            self.bucket = TokenBucket(float(tokens_per_second), float(burst or tokens_per_second * 10))
+        # 该租户最近一个请求的虚拟完成时间
+        self.last_finish = 0.0
+        self.requests = 0
+        self.tokens = 0
+
+    def to_dict(self):
+        return {
+            "weight": self.weight,
+            "priority": self.priority,
+            "requests": self.requests,
+            "tokens": self.tokens,
+            "quota_tokens_per_second": self.bucket.rate if self.bucket else None,
+            "quota_remaining": round(self.bucket.level, 1) if self.bucket else None,
+        }
+
+
+class RequestInfo:
+    """当前请求的租户和优先级，由路由设置，生成时读取"""
+
+    def __init__(self, tenant, priority):
+        self.tenant = tenant
+        self.priority = priority
+
+
+class Ticket:
+    """一个请求的运行名额"""
+
+    def __init__(self, request, cost, start_tag, finish_tag, order, on_admit=None):
+        self.tenant = request.tenant
+        self.priority = request.priority
+        self.cost = cost
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.order = order
+        # waiting -> running -> (waiting -> running)* -> done
+        self.state = "waiting"
+        self.preempt_requested = False
+        self.enqueued_at = time.perf_counter()
+        self.admitted_at = None
+        self.first_token_at = None
+        self.tokens = 0
+        self.preemptions = 0
+        self.throttles = 0
+        # 被调度时在持有调度器锁的情况下调用，不能再调用调度器
+        self.on_admit = on_admit
+        # 申请名额时的 span，补记排队和暂停区间时作为父 span
+        self.span = None
+        self.queued_ns = time.time_ns()
+        self.suspend_reason = None
+        self.suspended_ns = None
+
+
+class LatencyStats:
+    """最近若干次的延迟样本"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+
+    def summary(self):
+        if not self._samples:
+            return {"count": 0}
+        samples = sorted(self._samples)
+
+        def percentile(q):
+            return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 1)
+
+        return {
+            "count": len(samples),
+            "avg_ms": round(sum(samples) / len(samples) * 1000, 1),
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "max_ms": round(samples[-1] * 1000, 1),
+        }
+
+
+class RequestScheduler:
+    """优先级 + 加权公平排队 + 抢占 + 配额的请求调度器"""
+
+    def __init__(self, max_running=16):
+        self.max_running = max_running
+        self._lock = threading.Lock()
+        self._waiting = []
+        self._running = []
+        self._virtual_time = 0.0
+        self._order = 0
+        self._tenants = {}
+        self._dynamic_tenants = OrderedDict()
+        self._default_tenant = Tenant("anonymous")
+        self._class_stats = {
+            priority: {
+                "queue_wait": LatencyStats(),
+                "time_to_first_token": LatencyStats(),
+                "latency": LatencyStats(),
+                "completed": 0,
+                "preemptions": 0,
+                "throttles": 0,
+            }
+            for priority in PRIORITIES
+        }
+
+    def load_tenants(self, path):
+        """从 JSON 文件加载租户配置"""
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        tenants = {}
+        for api_key, options in config.get("tenants", {}).items():
+            options = dict(options)
+            name = options.pop("name", None) or self._anonymize(api_key)
+            tenants[api_key] = Tenant(name, **options)
+        with self._lock:
+            self._default_tenant = Tenant("anonymous", **config.get("default", {}))
+            self._tenants = tenants
+            self._dynamic_tenants.clear()
+        logger.info(f"已加载 {len(tenants)} 个租户配置: {path}")
+
+    @staticmethod
+    def _anonymize(api_key):
+        return "key-" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+    def _tenant_for(self, api_key):
+        if not api_key:
+            return self._default_tenant
+        tenant = self._tenants.get(api_key)
+        if tenant is not None:
+            return tenant
+        # 未配置的 API Key 使用默认配置，各自独立排队
+        with self._lock:
+            tenant = self._dynamic_tenants.get(api_key)
+            if tenant is None:
+                default = self._default_tenant
+                tenant = Tenant(
+                    self._anonymize(api_key), default.weight, default.priority,
+                    default.bucket.rate if default.bucket else None,
+                    default.bucket.capacity if default.bucket else None,
+                )
+                self._dynamic_tenants[api_key] = tenant
+                while len(self._dynamic_tenants) > MAX_DYNAMIC_TENANTS:
+                    self._dynamic_tenants.popitem(last=False)
+            else:
+                self._dynamic_tenants.move_to_end(api_key)
+        return tenant
+
+    def bind(self, api_key=None, priority=None):
+        """在当前上下文中记录请求的租户和优先级（由路由在处理请求时调用）"""
+        tenant = self._tenant_for(api_key)
+        if priority is not None and priority not in PRIORITIES:
+            raise ValueError(f"未知的优先级: {priority}")
+        priority = priority or tenant.priority
+        # 租户的优先级同时是上限
+        if PRIORITIES.index(priority) < PRIORITIES.index(tenant.priority):
+            priority = tenant.priority
+        request = RequestInfo(tenant, priority)
+        _current_request.set(request)
+        tracer.set_attributes(tenant=tenant.name, priority=priority)
+        return request
+
+    def current_request(self):
+        return _current_request.get() or RequestInfo(self._default_tenant, DEFAULT_PRIORITY)
+
+    def use_request(self, request):
+        """在其他线程中恢复请求的上下文"""
+        _current_request.set(request)
+
+    def submit(self, cost, on_admit, request=None):
+        """
+        申请运行名额，立即返回 Ticket
+
+        请求被调度时调用 on_admit(ticket)（可能在本次调用中就被调用）；被 try_checkpoint 暂停后
+        重新调度时会再次调用。生成结束或取消后需要调用 release() 归还名额。
+        """
+        request = request or self.current_request()
+        with self._lock:
+            return self._enqueue(request, cost, on_admit, tracer.current_span())
+
+    def try_checkpoint(self, ticket, tokens=1, prefill_tokens=0):
+        """
+        每步生成或预填充后调用：记录用量，被抢占或配额用完时把请求放回等待队列
+
+        Args:
+            tokens: 本步生成的 token 数，为 0 表示预填充块之间的检查点
+            prefill_tokens: 本步写入 KV cache 的 prompt token 数，与生成的 token 一起计入租户用量和配额
+
+        Returns:
+            bool: 可以继续生成时为 True；为 False 时调用方应暂停该请求，等待 on_admit 再次被调用
+        """
+        with self._lock:
+            now = time.perf_counter()
+            if tokens and ticket.first_token_at is None:
+                ticket.first_token_at = now
+                self._class_stats[ticket.priority]["time_to_first_token"].add(now - ticket.enqueued_at)
+            ticket.tokens += tokens
+            ticket.tenant.tokens += tokens + prefill_tokens
+            bucket = ticket.tenant.bucket
+            if bucket is not None:
+                bucket.refill(time.monotonic())
+                bucket.consume(tokens + prefill_tokens)
+
+            if ticket.preempt_requested:
+                ticket.preemptions += 1
+                self._class_stats[ticket.priority]["preemptions"] += 1
+                reason = "preempted"
+            elif bucket is not None and bucket.level <= 0:
+                ticket.throttles += 1
+                self._class_stats[ticket.priority]["throttles"] += 1
+                reason = "throttled"
+            else:
+                return True
+
+            ticket.preempt_requested = False
+            self._running.remove(ticket)
+            ticket.state = "waiting"
+            ticket.suspend_reason = reason
+            ticket.suspended_ns = time.time_ns()
+            self._waiting.append(ticket)
+            self._dispatch()
+            return False
+
+    def release(self, ticket):
+        """生成结束或取消时归还名额，等待中的请求直接移出队列"""
+        with self._lock:
+            self._finish(ticket)
+
+    def _enqueue(self, request, cost, on_admit, span):
+        tenant = request.tenant
+        start_tag = max(self._virtual_time, tenant.last_finish)
+        finish_tag = start_tag + cost / tenant.weight
+        tenant.last_finish = finish_tag
+        tenant.requests += 1
+        self._order += 1
+        ticket = Ticket(request, cost, start_tag, finish_tag, self._order, on_admit)
+        ticket.span = span
+        self._waiting.append(ticket)
+        self._dispatch()
+        return ticket
+
+    def poll(self):
+        """
+        重新调度因配额等待的请求（令牌桶恢复不会触发调度，由引擎线程空闲时定期调用）
+
+        Returns:
+            下次需要调用的间隔（秒），没有因配额等待的请求时为 None
+        """
+        with self._lock:
+            self._dispatch()
+            return self._next_refill_delay()
+
+    def _next_refill_delay(self):
+        """有租户因配额等待时，按最近一个令牌桶恢复的时间唤醒重新调度"""
+        now = time.monotonic()
+        delays = [
+            t.tenant.bucket.seconds_until_available(now)
+            for t in self._waiting if t.tenant.bucket is not None
+        ]
+        delays = [d for d in delays if d > 0]
+        return min(delays) if delays else None
+
+    def _eligible(self, ticket, now):
+        bucket = ticket.tenant.bucket
+        return bucket is None or bucket.seconds_until_available(now) == 0
+
+    def _dispatch(self):
+        """在持有锁时调用：把空闲名额分配给等待中的请求，必要时发起抢占"""
+        now = time.monotonic()
+        while len(self._running) < self.max_running:
+            candidates = [t for t in self._waiting if self._eligible(t, now)]
+            if not candidates:
+                break
+            ticket = min(candidates, key=lambda t: (PRIORITIES.index(t.priority), t.finish_tag, t.order))
+            self._waiting.remove(ticket)
+            self._running.append(ticket)
+            ticket.state = "running"
+            self._virtual_time = max(self._virtual_time, ticket.start_tag)
+            if ticket.admitted_at is None:
+                ticket.admitted_at = time.perf_counter()
+                self._class_stats[ticket.priority]["queue_wait"].add(ticket.admitted_at - ticket.enqueued_at)
+                if ticket.span is not None:
+                    tracer.add_span(
+                        "scheduler.queue", ticket.queued_ns, parent=ticket.span,
+                        tenant=ticket.tenant.name, priority=ticket.priority, cost=ticket.cost,
+                    )
+            elif ticket.suspend_reason is not None and ticket.span is not None:
+                tracer.add_span(
+                    f"scheduler.{ticket.suspend_reason}", ticket.suspended_ns, parent=ticket.span, tokens=ticket.tokens,
+                )
+            ticket.suspend_reason = None
+            if ticket.on_admit is not None:
+                ticket.on_admit(ticket)
+
+        self._preempt(now)
+
+    def _preempt(self, now):
+        """名额已满且有 interactive 请求等待时，让最近开始的 batch 请求在下一个 token 处让出名额"""
+        if len(self._running) < self.max_running:
+            return
+        urgent = sum(1 for t in self._waiting if t.priority == "interactive" and self._eligible(t, now))
+        pending = sum(1 for t in self._running if t.preempt_requested)
+        victims = sorted(
+            (t for t in self._running if t.priority == "batch" and not t.preempt_requested),
+            key=lambda t: t.admitted_at, reverse=True,
+        )
+        for ticket in victims[:max(0, urgent - pending)]:
+            ticket.preempt_requested = True
+            logger.info(f"抢占批处理请求 (租户 {ticket.tenant.name})，让出名额给交互请求")
+
+    def _finish(self, ticket):
+        if ticket in self._running:
+            self._running.remove(ticket)
+        if ticket in self._waiting:
+            self._waiting.remove(ticket)
+        if ticket.state != "done" and ticket.admitted_at is not None:
+            stats = self._class_stats[ticket.priority]
+            stats["completed"] += 1
+            stats["latency"].add(time.perf_counter() - ticket.enqueued_at)
+        ticket.state = "done"
+        self._dispatch()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "max_running": self.max_running,
+                "running": len(self._running),
+                "waiting": {p: sum(1 for t in self._waiting if t.priority == p) for p in PRIORITIES},
+                "classes": {
+                    priority: {
+                        key: value.summary() if isinstance(value, LatencyStats) else value
+                        for key, value in stats.items()
+                    }
+                    for priority, stats in self._class_stats.items()
+                },
+                "tenants": {
+                    tenant.name: tenant.to_dict()
+                    for tenant in [self._default_tenant] + list(self._tenants.values())
+                },
+                "dynamic_tenants": len(self._dynamic_tenants),
+            }
+
+
+# 全局调度器实例，名额数由 MODEL_SERVICE_MAX_RUNNING 配置
+request_scheduler = RequestScheduler(max_running=int(os.environ.get("MODEL_SERVICE_MAX_RUNNING", "16")))
+if os.environ.get("MODEL_SERVICE_TENANTS"):
+    request_scheduler.load_tenants(os.environ["MODEL_SERVICE_TENANTS"])
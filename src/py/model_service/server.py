@@ -2,12 +2,27 @@
 FastAPI 服务器主程序
 """
 
+import os
+import hmac
 import uvicorn
-from fastapi import FastAPI
+from typing import Optional
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel
 from contextlib import asynccontextmanager
 from .api_routes import router
+from .vl_routes import router as vl_router
+from .transcribe_routes import router as transcribe_router
+from .vl_manager import vl_model_manager
 from .model_manager import model_manager
+from .response_cache import response_cache
+from .transcribe_jobs import transcription_job_manager
+from .tracing import tracer, TracingMiddleware
+from .profiling import profiler_manager
+from .session_manager import session_manager
+from .memory_monitor import memory_monitor
 from utils.log_util import default_logger as logger
 
 @asynccontextmanager
@@ -22,10 +37,24 @@ async def lifespan(app: FastAPI):
         logger.error(f"模型加载失败: {e}")
         raise
     
+    # 视觉语言模型默认在首次请求时加载，设置 MODEL_SERVICE_PRELOAD_VL=1 时随服务启动加载
+    if os.environ.get("MODEL_SERVICE_PRELOAD_VL") == "1":
+        vl_model_manager.load_model()
+    
+    # 内存超过水位线时按顺序清理的缓存
+    memory_monitor.register_trimmer("response_cache", response_cache.trim)
+    memory_monitor.register_trimmer("session_kv_cache", session_manager.trim)
+    memory_monitor.register_trimmer("grammar_cache", model_manager.trim_caches)
+    memory_monitor.start()
+    
     yield
     
     # 关闭时的清理工作
     logger.info("服务正在关闭...")
+    response_cache.save()
+    transcription_job_manager.shutdown()
+    tracer.shutdown()
+    memory_monitor.shutdown()
 
 # 创建 FastAPI 应用
 app = FastAPI(
@@ -42,10 +71,111 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
+# 请求 ID 和请求追踪（最外层，覆盖包括 CORS 在内的整个请求处理）
+app.add_middleware(TracingMiddleware, tracer=tracer)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """管理接口鉴权：MODEL_SERVICE_ADMIN_TOKEN 未设置时管理接口不可用"""
+    token = os.environ.get("MODEL_SERVICE_ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="管理接口未启用")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), token.encode()):
+        raise HTTPException(status_code=403, detail="管理令牌无效")
+
+# 管理接口，请求头需要带 X-Admin-Token
+admin_router = APIRouter(dependencies=[Depends(require_admin)])
+
+class CpuProfileRequest(BaseModel):
+    # 采样间隔（毫秒）
+    interval_ms: float = 10
+    # 最长采样时间（秒），到时自动停止并保存结果
+    max_seconds: float = 60
+    # 是否计入等待锁、队列或 IO 的线程
+    include_idle: bool = False
+
+class TorchProfileRequest(BaseModel):
+    # 记录的生成步数（模型前向次数）
+    steps: int = 20
+    # 等待生成步的最长时间（秒），超时后导出已记录的部分
+    timeout: float = 120
+
+class HeapTraceRequest(BaseModel):
+    # 每次分配记录的调用栈深度
+    frames: int = 25
+
+def _profile_call(fn, *args):
+    try:
+        return fn(*args)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@admin_router.post("/profile/cpu/start")
+async def start_cpu_profile(request: CpuProfileRequest):
+    """开始 CPU 采样（所有线程的 Python 调用栈）"""
+    return _profile_call(profiler_manager.start_cpu, request.interval_ms, request.max_seconds, request.include_idle)
+
+@admin_router.post("/profile/cpu/stop")
+async def stop_cpu_profile():
+    """停止 CPU 采样，返回折叠栈和汇总报告的文件名"""
+    return await run_in_threadpool(_profile_call, profiler_manager.stop_cpu)
+
+@admin_router.get("/profile/cpu")
+async def get_cpu_profile():
+    """查询 CPU 采样状态"""
+    return profiler_manager.cpu_status()
+
+@admin_router.post("/profile/torch")
+async def torch_profile(request: TorchProfileRequest):
+    """用 torch.profiler 记录接下来的若干个生成步，结束后返回 Chrome trace 的文件名"""
+    def run():
+        with model_manager.use_slot() as slot:
+            return profiler_manager.profile_torch(
+                slot.model, request.steps, request.timeout, run_on=slot.worker.call,
+            )
+    return await run_in_threadpool(_profile_call, run)
+
+@admin_router.post("/profile/heap/start")
+async def start_heap_trace(request: HeapTraceRequest):
+    """开始用 tracemalloc 跟踪 Python 堆分配"""
+    return _profile_call(profiler_manager.start_heap, request.frames)
+
+@admin_router.post("/profile/heap/snapshot")
+async def heap_snapshot(top: int = 50):
+    """拍摄堆快照，与上一次快照比较增长"""
+    return await run_in_threadpool(_profile_call, profiler_manager.heap_snapshot, top)
+
+@admin_router.post("/profile/heap/stop")
+async def stop_heap_trace():
+    """停止跟踪 Python 堆分配"""
+    return _profile_call(profiler_manager.stop_heap)
+
+@admin_router.post("/memory/trim")
+async def trim_memory():
+    """立即执行一次内存清理（与超过水位线时相同），返回清理前后的 RSS"""
+    return await run_in_threadpool(memory_monitor.trim)
+
+@admin_router.get("/profile/artifacts")
+async def list_profile_artifacts():
+    """列出分析结果文件"""
+    return {"artifacts": profiler_manager.list_artifacts()}
+
+@admin_router.get("/profile/artifacts/{name}")
+async def download_profile_artifact(name: str):
+    """下载分析结果文件"""
+    try:
+        path = profiler_manager.artifact_path(name)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return FileResponse(path, filename=name, media_type="application/octet-stream")
+
 # 挂载路由
 app.include_router(router, prefix="/api/v1")
+app.include_router(vl_router, prefix="/api/v1/vl")
+app.include_router(transcribe_router, prefix="/api/v1")
+app.include_router(admin_router, prefix="/api/v1/admin")
 
 # 根路径
 @app.get("/")
@@ -0,0 +1,139 @@
+"""
+服务端预转换模型格式
+
+prepare.convert_model 将模型目录一次性转换为适合服务加载的格式：
+- 所有权重按目标精度保存在单个 safetensors 文件中，加载时内存映射，不再做精度转换
+- 绑定的输入/输出词嵌入只保存一份
+- 非持久化 buffer（如 RoPE 的 inv_freq）按原精度一并保存，加载时无需重新计算
+- tokenizer 以 fast tokenizer 的 tokenizer.json 形式保存，加载时跳过 slow -> fast 转换
+
+加载时先在 meta 设备上构造模型结构（不分配内存、不初始化权重），
+再把内存映射的张量直接挂到对应模块上，跳过 from_pretrained 的分片解析、精度转换和初始化。
+"""
+
+import json
+import time
+from pathlib import Path
+import torch
+from utils.log_util import default_logger as logger
+
+# 转换结果所在的子目录：models/<模型名称>/serving
+SERVING_DIR_NAME = "serving"
+SERVING_MANIFEST = "serving.json"
+WEIGHTS_NAME = "model.safetensors"
+FORMAT_VERSION = 1
+
+DTYPES = {
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+    "float32": torch.float32,
+}
+
+
+def is_serving_artifact(path):
+    return (Path(path) / SERVING_MANIFEST).exists()
+
+
+def save_serving_artifact(model, tokenizer, output_dir, dtype="float16", source=None):
+    """
+    将已加载的模型和 tokenizer 保存为服务格式
+
+    Args:
+        model: transformers 模型（CPU 上）
+        tokenizer: tokenizer
+        output_dir: 输出目录
+        dtype: 浮点参数的目标精度，buffer 保持原精度
+        source: 源模型目录，记录在 serving.json 中
+
+    Returns:
+        dict: serving.json 的内容
+    """
+    from safetensors.torch import save_file
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    target_dtype = DTYPES[dtype]
+
+    tensors = {}
+    # remove_duplicate 使绑定的词嵌入只保存一份，加载后由 tie_weights 恢复
+    for name, param in model.named_parameters(remove_duplicate=True):
+        tensor = param.detach()
+        if tensor.is_floating_point():
+            tensor = tensor.to(target_dtype)
+        tensors[name] = tensor.contiguous()
+
+    buffers = []
+    for name, buffer in model.named_buffers(remove_duplicate=True):
+        tensors[name] = buffer.detach().contiguous()
+        buffers.append(name)
+
+    save_file(tensors, str(output_dir / WEIGHTS_NAME), metadata={"format": "pt"})
+    model.config.save_pretrained(output_dir)
+    if getattr(model, "generation_config", None) is not None:
+        model.generation_config.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "dtype": dtype,
+        "source": str(source) if source else None,
+        "num_tensors": len(tensors),
+        "buffers": buffers,
+        "tie_word_embeddings": bool(getattr(model.config, "tie_word_embeddings", False)),
+    }
+    with open(output_dir / SERVING_MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+
+def _assign_tensor(model, name, tensor, is_buffer):
+    """把张量直接挂到模块上，替换 meta 设备上的占位参数"""
+    module_name, _, leaf = name.rpartition(".")
+    module = model.get_submodule(module_name) if module_name else model
+    if is_buffer:
+        persistent = leaf not in module._non_persistent_buffers_set
+        module.register_buffer(leaf, tensor, persistent=persistent)
+    else:
+        module._parameters[leaf] = torch.nn.Parameter(tensor, requires_grad=False)
+
+
+def load_serving_model(path, device="cpu"):
+    """
+    加载服务格式的模型
+
+    CPU 上权重直接使用 safetensors 的内存映射；GPU 上由 safetensors 直接拷贝到显存。
+
+    Returns:
+        (model, seconds)
+    """
+    from safetensors.torch import load_file
+    from transformers import AutoConfig, AutoModelForCausalLM
+
+    start = time.perf_counter()
+    path = Path(path)
+    with open(path / SERVING_MANIFEST, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"不支持的服务格式版本: {manifest.get('format_version')}")
+
+    config = AutoConfig.from_pretrained(path, trust_remote_code=True)
+    with torch.device("meta"):
+        model = AutoModelForCausalLM.from_config(
+            config, torch_dtype=DTYPES[manifest["dtype"]], trust_remote_code=True
+        )
+
+    buffers = set(manifest["buffers"])
+    tensors = load_file(str(path / WEIGHTS_NAME), device=str(device))
+    for name, tensor in tensors.items():
+        _assign_tensor(model, name, tensor, name in buffers)
+
+    model.tie_weights()
+    missing = [name for name, p in model.named_parameters() if p.is_meta]
+    missing += [name for name, b in model.named_buffers() if b.is_meta]
+    if missing:
+        raise ValueError(f"服务格式缺少张量: {missing[:5]}")
+
+    model.eval()
+    seconds = time.perf_counter() - start
+    logger.info(f"服务格式模型加载完成: {path}，精度 {manifest['dtype']}，耗时 {seconds:.2f}s")
+    return model, seconds
@@ -0,0 +1,188 @@
+"""
+会话管理器
+
+在服务端保存多轮对话状态（消息、token ID、可选的 KV cache），
+客户端每轮只需发送新消息和会话 ID，避免重复上传和重复 prefill 历史记录。
+会话带有过期时间（TTL），并按 LRU 策略在数量或内存超限时淘汰。
+
+环境变量:
+    MODEL_SERVICE_SESSION_KV_CACHE: 为 1 时保存每个会话的 KV cache，下一轮只预填充新增的 token
+    MODEL_SERVICE_SESSION_MAX_MEMORY_MB: 会话占用内存上限（MB，默认 2048），KV cache 计入其中
+"""
+
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from utils.log_util import default_logger as logger
+
+
+def estimate_kv_cache_bytes(past_key_values):
+    """估算 KV cache 占用的字节数，兼容新旧版本 transformers 的缓存结构"""
+    if past_key_values is None:
+        return 0
+
+    tensors = []
+    if hasattr(past_key_values, "layers"):
+        for layer in past_key_values.layers:
+            tensors.extend([getattr(layer, "keys", None), getattr(layer, "values", None)])
+    elif hasattr(past_key_values, "key_cache"):
+        tensors.extend(past_key_values.key_cache)
+        tensors.extend(past_key_values.value_cache)
+    else:
+        for layer in past_key_values:
+            tensors.extend(layer)
+
+    return sum(t.numel() * t.element_size() for t in tensors if t is not None and hasattr(t, "numel"))
+
+
+class ChatSession:
+    """单个对话会话的状态"""
+
+    def __init__(self, session_id, system_prompt=None):
+        self.session_id = session_id
+        self.messages = []
+        if system_prompt:
+            self.messages.append({"role": "system", "content": system_prompt})
+        # 上一轮模型实际看到的完整 token 序列（prompt + 生成结果）
+        self.token_ids = []
+        # 与 token_ids 对应的 KV cache，仅在开启 store_kv_cache 时保存
+        self.past_key_values = None
+        # 生成 token_ids 和 KV cache 的模型版本，热切换后旧版本的缓存不可复用
+        self.model_version = None
+        self.created_at = time.time()
+        self.last_access = self.created_at
+        # 同一会话的多轮请求必须串行执行
+        self.lock = threading.Lock()
+
+    def estimate_size(self):
+        """估算会话占用的内存字节数"""
+        message_bytes = sum(len(m["content"].encode("utf-8")) for m in self.messages)
+        return message_bytes + len(self.token_ids) * 8 + estimate_kv_cache_bytes(self.past_key_values)
+
+    def touch(self):
+        self.last_access = time.time()
+
+    def to_dict(self, ttl_seconds):
+        return {
+            "session_id": self.session_id,
+            "turns": sum(1 for m in self.messages if m["role"] == "user"),
+            "num_tokens": len(self.token_ids),
+            "has_kv_cache": self.past_key_values is not None,
+            "size_bytes": self.estimate_size(),
+            "created_at": self.created_at,
+            "expires_at": self.last_access + ttl_seconds,
+        }
+
+
+class SessionManager:
+    """会话管理器，负责会话的创建、查找、过期和 LRU 淘汰"""
+
+    def __init__(self, ttl_seconds=1800, max_sessions=1000,
+                 max_memory_bytes=2 * 1024**3, store_kv_cache=False):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_memory_bytes = max_memory_bytes
+        self.store_kv_cache = store_kv_cache
+        self._sessions = OrderedDict()
+        self._sizes = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def create_session(self, system_prompt=None):
+        """创建新会话"""
+        session = ChatSession(uuid.uuid4().hex, system_prompt)
+        with self._lock:
+            self._evict_expired()
+            self._sessions[session.session_id] = session
+            self._set_size(session)
+            self._evict_lru()
+        logger.info(f"创建会话: {session.session_id}")
+        return session
+
+    def get_session(self, session_id):
+        """获取会话，不存在或已过期时抛出 KeyError"""
+        with self._lock:
+            self._evict_expired()
+            session = self._sessions.get(session_id)
+            if session is None:
+                raise KeyError(f"会话不存在或已过期: {session_id}")
+            session.touch()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def update_session(self, session):
+        """会话内容变化后重新计算内存占用，并在超限时淘汰最久未使用的会话"""
+        with self._lock:
+            if session.session_id not in self._sessions:
+                return
+            session.touch()
+            self._sessions.move_to_end(session.session_id)
+            self._set_size(session)
+            self._evict_lru(keep=session.session_id)
+
+    def delete_session(self, session_id):
+        """删除会话，返回是否存在"""
+        with self._lock:
+            return self._remove(session_id)
+
+    def trim(self):
+        """丢弃所有会话的 KV cache，仅保留 token ID 和消息，用于内存紧张时释放显存"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.past_key_values = None
+                self._set_size(session)
+
+    def get_stats(self):
+        """获取会话统计信息"""
+        with self._lock:
+            return {
+                "num_sessions": len(self._sessions),
+                "total_bytes": self._total_bytes,
+                "max_sessions": self.max_sessions,
+                "max_memory_bytes": self.max_memory_bytes,
+                "store_kv_cache": self.store_kv_cache,
+            }
+
+    def _set_size(self, session):
+        size = session.estimate_size()
+        self._total_bytes += size - self._sizes.get(session.session_id, 0)
+        self._sizes[session.session_id] = size
+
+    def _remove(self, session_id):
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._total_bytes -= self._sizes.pop(session_id, 0)
+        session.past_key_values = None
+        return True
+
+    def _evict_expired(self):
+        deadline = time.time() - self.ttl_seconds
+        expired = [sid for sid, s in self._sessions.items() if s.last_access < deadline]
+        for sid in expired:
+            self._remove(sid)
+        if expired:
+            logger.info(f"清理过期会话 {len(expired)} 个")
+
+    def _evict_lru(self, keep=None):
+        while len(self._sessions) > self.max_sessions or self._total_bytes > self.max_memory_bytes:
+            victim = next((sid for sid in self._sessions if sid != keep), None)
+            if victim is None:
+                # 只剩当前会话仍超出内存上限时，丢弃它的 KV cache
+                session = self._sessions.get(keep)
+                if session is not None and session.past_key_values is not None:
+                    session.past_key_values = None
+                    self._set_size(session)
+                break
+            logger.info(f"会话超出容量限制，淘汰最久未使用的会话: {victim}")
+            self._remove(victim)
+
+
+# 全局会话管理器实例；KV cache 按层、KV 头数和上下文长度占用显存（Qwen3-8B 半精度约 144 KB/token），
+# 开启时需相应设置内存上限
+session_manager = SessionManager(
+    max_memory_bytes=int(float(os.environ.get("MODEL_SERVICE_SESSION_MAX_MEMORY_MB", "2048")) * 1024**2),
+    store_kv_cache=os.environ.get("MODEL_SERVICE_SESSION_KV_CACHE") == "1",
+)
@@ -21,6 +21,28 @@ def main():
     parser.add_argument("--log-level", default="info", 
                        choices=["critical", "error", "warning", "info", "debug"],
                        help="日志级别 (默认: info)")
+    parser.add_argument("--vl-model", default=None,
+                       help="视觉语言模型名称或路径 (默认: Qwen/Qwen3-VL-2B-Instruct)")
+    parser.add_argument("--preload-vl", action="store_true", help="启动时加载视觉语言模型 (默认首次请求时加载)")
+    parser.add_argument("--whisper-model", default=None, help="语音识别模型大小或路径 (默认: medium)")
+    parser.add_argument("--whisper-compute-type", default=None,
+                       help="语音识别模型计算精度，如 float16、int8_float16、int8 (默认: GPU float16，CPU int8)")
+    parser.add_argument("--decode-workers", type=int, default=None, help="转写任务的音频解码进程数 (默认: 2)")
+    parser.add_argument("--max-running", type=int, default=None, help="引擎中同时生成的请求数，其余排队调度 (默认: 16)")
+    parser.add_argument("--tenants", default=None, help="租户配置文件（按 API Key 配置权重、优先级和 token 配额）")
+    parser.add_argument("--prefill-chunk", type=int, default=None, help="长 prompt 分块预填充的块大小 (默认: 512)")
+    parser.add_argument("--max-step-tokens", type=int, default=None, help="批量引擎每一步的 token 预算 (默认: 2048)")
+    parser.add_argument("--target-step-ms", type=float, default=None, help="目标单步耗时（毫秒），按实测耗时收紧 token 预算")
+    parser.add_argument("--trace-export", default=None, help="请求追踪导出目标：文件路径或 OTLP/HTTP 地址（未设置时不追踪）")
+    parser.add_argument("--trace-sample-rate", type=float, default=None, help="请求追踪采样率 (默认: 0.1)")
+    parser.add_argument("--memory-watermark-mb", type=float, default=None, help="RSS 水位线（MB），超过时清理缓存")
+    parser.add_argument("--gpu-memory-watermark", type=float, default=None, help="显存水位线（已预留占总显存的比例，如 0.9），超过时清理缓存")
+    parser.add_argument("--response-cache-path", default=None, help="响应缓存持久化文件，启动时加载、退出时保存（未设置时不持久化）")
+    parser.add_argument("--max-prompt-tokens", type=int, default=None, help="对话历史压缩的 prompt token 预算 (默认: 按模型，Qwen3 为 16384)")
+    parser.add_argument("--history-summary", action="store_true", help="用模型为超出预算被丢弃的旧对话生成摘要")
+    parser.add_argument("--session-kv-cache", action="store_true", help="保存会话的 KV cache，下一轮只预填充新增 token（占用显存）")
+    parser.add_argument("--session-max-memory-mb", type=float, default=None, help="会话占用内存上限（MB），含 KV cache (默认: 2048)")
+    parser.add_argument("--admin-token", default=None, help="管理接口（性能分析等）的访问令牌，未设置时管理接口不可用")
     
     args = parser.parse_args()
     
@@ -41,6 +63,49 @@ def main():
     
     # 设置环境变量
     os.environ["PYTHONPATH"] = str(project_root / "src" / "py")
+    if args.vl_model:
+        os.environ["MODEL_SERVICE_VL_MODEL"] = args.vl_model
+    if args.preload_vl:
+        os.environ["MODEL_SERVICE_PRELOAD_VL"] = "1"
+    if args.whisper_model:
+        os.environ["MODEL_SERVICE_WHISPER_MODEL"] = args.whisper_model
+    if args.whisper_compute_type:
+        os.environ["MODEL_SERVICE_WHISPER_COMPUTE_TYPE"] = args.whisper_compute_type
+    if args.decode_workers:
+        os.environ["MODEL_SERVICE_TRANSCRIBE_DECODE_WORKERS"] = str(args.decode_workers)
+    if args.max_running:
+        os.environ["MODEL_SERVICE_MAX_RUNNING"] = str(args.max_running)
+    if args.tenants:
+        os.environ["MODEL_SERVICE_TENANTS"] = str(Path(args.tenants).resolve())
+    if args.prefill_chunk:
+        os.environ["MODEL_SERVICE_PREFILL_CHUNK"] = str(args.prefill_chunk)
+    if args.max_step_tokens:
+        os.environ["MODEL_SERVICE_MAX_STEP_TOKENS"] = str(args.max_step_tokens)
+    if args.target_step_ms:
+        os.environ["MODEL_SERVICE_TARGET_STEP_MS"] = str(args.target_step_ms)
+    if args.trace_export:
+        os.environ["MODEL_SERVICE_TRACE_EXPORT"] = (
+            args.trace_export if args.trace_export.startswith(("http://", "https://"))
+            else str(Path(args.trace_export).resolve())
+        )
+    if args.trace_sample_rate is not None:
+        os.environ["MODEL_SERVICE_TRACE_SAMPLE_RATE"] = str(args.trace_sample_rate)
+    if args.memory_watermark_mb:
+        os.environ["MODEL_SERVICE_MEMORY_WATERMARK_MB"] = str(args.memory_watermark_mb)
+    if args.gpu_memory_watermark:
+        os.environ["MODEL_SERVICE_GPU_MEMORY_WATERMARK"] = str(args.gpu_memory_watermark)
+    if args.response_cache_path:
+        os.environ["MODEL_SERVICE_RESPONSE_CACHE_PATH"] = str(Path(args.response_cache_path).resolve())
+    if args.max_prompt_tokens:
+        os.environ["MODEL_SERVICE_MAX_PROMPT_TOKENS"] = str(args.max_prompt_tokens)
+    if args.history_summary:
+        os.environ["MODEL_SERVICE_HISTORY_SUMMARY"] = "1"
+    if args.session_kv_cache:
+        os.environ["MODEL_SERVICE_SESSION_KV_CACHE"] = "1"
+    if args.session_max_memory_mb:
+        os.environ["MODEL_SERVICE_SESSION_MAX_MEMORY_MB"] = str(args.session_max_memory_mb)
+    if args.admin_token:
+        os.environ["MODEL_SERVICE_ADMIN_TOKEN"] = args.admin_token
     
     try:
         uvicorn.run(
@@ -0,0 +1,45 @@
+"""
+字幕格式化
+
+将转写段落格式化为 SRT / VTT 字幕条目，供流式字幕接口逐条输出。
+"""
+
+SUBTITLE_FORMATS = ("srt", "vtt")
+
+SUBTITLE_MEDIA_TYPES = {
+    "srt": "application/x-subrip",
+    "vtt": "text/vtt",
+}
+
+
+def format_timestamp(seconds, fmt="srt"):
+    """格式化时间戳，SRT 为 HH:MM:SS,mmm，VTT 为 HH:MM:SS.mmm"""
+    milliseconds = max(0, int(round(seconds * 1000)))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    secs, milliseconds = divmod(milliseconds, 1000)
+    separator = "," if fmt == "srt" else "."
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{milliseconds:03d}"
+
+
+def subtitle_header(fmt="srt"):
+    return "WEBVTT\n\n" if fmt == "vtt" else ""
+
+
+def format_cue(index, start, end, text, fmt="srt"):
+    """格式化一条字幕，SRT 条目从 1 开始编号，VTT 不需要编号"""
+    timing = f"{format_timestamp(start, fmt)} --> {format_timestamp(end, fmt)}"
+    if fmt == "srt":
+        return f"{index}\n{timing}\n{text.strip()}\n\n"
+    return f"{timing}\n{text.strip()}\n\n"
+
+
+def iter_subtitles(segments, fmt="srt"):
+    """将段落生成器转换为字幕文本生成器，跳过空白段落"""
+    yield subtitle_header(fmt)
+    index = 0
+    for segment in segments:
+        if not segment["text"].strip():
+            continue
+        index += 1
+        yield format_cue(index, segment["start"], segment["end"], segment["text"], fmt)
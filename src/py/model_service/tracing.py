@@ -0,0 +1,424 @@
+"""
+请求追踪
+
+按请求记录各阶段的耗时（span），用于定位慢请求耗在排队、分词、预填充、解码还是 SSE 写出：
+- TracingMiddleware 为每个 HTTP 请求确定请求 ID 并创建根 span。请求 ID 取自 X-Request-ID 请求头，
+  没有时生成，并在响应头中返回；带 W3C traceparent 请求头时沿用上游的 trace ID 和采样决定
+- 请求 ID 写入每条日志（utils.log_util），被采样的请求中日志同时记录为 span 事件
+- 调度器和 ModelManager 在当前 span 下创建子 span
+- 按采样率采样，未采样的请求只传递请求 ID，不创建 span
+- span 结束后放入队列，由后台线程按批导出为 OTLP/JSON：写入文件（每批一行）或 POST 到本地的
+  OTLP/HTTP 接收端（如 http://localhost:4318/v1/traces）；队列满时丢弃，不阻塞请求
+
+MODEL_SERVICE_TRACE_EXPORT 指定导出目标（文件路径或 http(s) URL），未设置时不追踪；
+MODEL_SERVICE_TRACE_SAMPLE_RATE 指定采样率（默认 0.1）。
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import random
+import logging
+import threading
+import contextlib
+import contextvars
+import urllib.request
+from pathlib import Path
+from utils.log_util import default_logger as logger, request_id_var
+
+SERVICE_NAME = "qwen3-model-service"
+
+# 日志作为 span 事件记录时保留的最大长度
+MAX_LOG_EVENT_LENGTH = 512
+
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:\-]{1,128}$")
+_TRACEPARENT_PATTERN = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current_span = contextvars.ContextVar("model_service_span", default=None)
+
+
+def _random_id(num_bytes):
+    return f"{random.getrandbits(num_bytes * 8):0{num_bytes * 2}x}"
+
+
+def parse_traceparent(value):
+    """
+    解析 W3C traceparent 请求头
+
+    Returns:
+        (trace_id, parent_span_id, sampled)，请求头缺失或格式错误时为 (None, None, None)
+    """
+    match = _TRACEPARENT_PATTERN.match((value or "").strip().lower())
+    if match is None:
+        return None, None, None
+    trace_id, parent_id, flags = match.groups()
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None, None, None
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class Span:
+    """一个计时区间，结束时交给 Tracer 导出"""
+
+    def __init__(self, tracer, name, trace_id, parent_id=None, start_ns=None, attributes=None, kind="internal"):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _random_id(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def event(self, name, timestamp_ns=None, **attributes):
+        self.events.append((timestamp_ns or time.time_ns(), name, attributes))
+
+    def child(self, name, start_ns=None, **attributes):
+        return Span(self.tracer, name, self.trace_id, self.span_id, start_ns, attributes)
+
+    def end(self, end_ns=None, error=None):
+        """结束 span，重复调用时忽略"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.tracer._export(self)
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            # 1: internal，2: server
+            "kind": 2 if self.kind == "server" else 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [
+                {"timeUnixNano": str(ts), "name": name, "attributes": _otlp_attributes(attrs)}
+                for ts, name, attrs in self.events
+            ],
+            "status": {"code": 2, "message": self.error} if self.error else {},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class BatchSpanExporter:
+    """后台线程按批导出已结束的 span，满 batch_size 个或距上次导出 flush_interval 秒时写出一批"""
+
+    def __init__(self, target, service_name=SERVICE_NAME, max_queue_size=4096, batch_size=256, flush_interval=2.0):
+        self.target = target
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    @property
+    def is_http(self):
+        return self.target.startswith(("http://", "https://"))
+
+    def submit(self, span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def shutdown(self, timeout=5.0):
+        """导出队列中剩余的 span 后停止"""
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch = []
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    span = self._queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+                except queue.Empty:
+                    break
+                if span is None:
+                    stop = True
+                    break
+                batch.append(span)
+            if batch:
+                self._write(batch)
+            if stop:
+                return
+
+    def _payload(self, batch):
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes({"service.name": self.service_name})},
+                "scopeSpans": [{
+                    "scope": {"name": "model_service"},
+                    "spans": [span.to_otlp() for span in batch],
+                }],
+            }]
+        }
+
+    def _write(self, batch):
+        data = json.dumps(self._payload(batch), ensure_ascii=False)
+        try:
+            if self.is_http:
+                request = urllib.request.Request(
+                    self.target, data=data.encode("utf-8"),
+                    headers={"Content-Type": "application/json"}, method="POST",
+                )
+                with urllib.request.urlopen(request, timeout=5) as response:
+                    response.read()
+            else:
+                path = Path(self.target)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(data + "\n")
+            self.exported += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.warning(f"导出追踪数据失败 ({self.target}): {e}")
+
+    def get_stats(self):
+        return {
+            "target": self.target,
+            "queued": self._queue.qsize(),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+class SpanLogFilter(logging.Filter):
+    """把日志记录为当前 span 的事件，未采样的请求不做任何事"""
+
+    def filter(self, record):
+        span = _current_span.get()
+        if span is not None:
+            span.event(
+                "log",
+                timestamp_ns=int(record.created * 1e9),
+                level=record.levelname,
+                message=record.getMessage()[:MAX_LOG_EVENT_LENGTH],
+            )
+        return True
+
+
+class Tracer:
+    """创建和传递 span，当前 span 保存在 contextvar 中，随 run_in_threadpool 传入工作线程"""
+
+    def __init__(self, export_target=None, sample_rate=None):
+        self.export_target = export_target or os.environ.get("MODEL_SERVICE_TRACE_EXPORT") or None
+        if sample_rate is None:
+            sample_rate = float(os.environ.get("MODEL_SERVICE_TRACE_SAMPLE_RATE", "0.1"))
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.requests = 0
+        self.sampled = 0
+        self.exporter = None
+        if self.export_target:
+            self.exporter = BatchSpanExporter(self.export_target)
+            logger.addFilter(SpanLogFilter())
+            logger.info(f"请求追踪已启用，采样率 {self.sample_rate}，导出到 {self.export_target}")
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def start_trace(self, name, request_id, traceparent=None, **attributes):
+        """
+        为一个请求创建根 span
+
+        带 traceparent 时沿用上游的 trace ID 和采样决定，否则按采样率采样。
+
+        Returns:
+            Span，未启用或未采样时返回 None
+        """
+        self.requests += 1
+        if not self.enabled:
+            return None
+        trace_id, parent_id, sampled = parse_traceparent(traceparent)
+        if sampled is None:
+            sampled = random.random() < self.sample_rate
+        if not sampled:
+            return None
+        self.sampled += 1
+        span = Span(self, name, trace_id or _random_id(16), parent_id, attributes=attributes, kind="server")
+        span.set(request_id=request_id)
+        return span
+
+    def current_span(self):
+        return _current_span.get()
+
+    def use_span(self, span):
+        """在其他线程中继续使用请求的 span（如合并请求的生成线程）"""
+        _current_span.set(span)
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """
+        在当前 span 下创建子 span，请求未被采样时返回 None
+
+        退出时恢复为父 span（而不是 ContextVar.reset），在流式生成器中每次迭代运行在
+        不同的 context 副本里也能正常退出。
+        """
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        span = parent.child(name, **attributes)
+        _current_span.set(span)
+        try:
+            yield span
+        except GeneratorExit:
+            # 客户端断开，流式生成被关闭
+            span.set(cancelled=True)
+            raise
+        except Exception as e:
+            span.end(error=e)
+            raise
+        finally:
+            span.end()
+            _current_span.set(parent)
+
+    def add_span(self, name, start_ns, end_ns=None, parent=None, **attributes):
+        """补记一个已经结束的子 span（如根据首 token 时间拆分出的预填充和解码阶段）"""
+        parent = parent or _current_span.get()
+        if parent is None:
+            return
+        parent.child(name, start_ns, **attributes).end(end_ns)
+
+    def event(self, name, **attributes):
+        span = _current_span.get()
+        if span is not None:
+            span.event(name, **attributes)
+
+    def set_attributes(self, **attributes):
+        span = _current_span.get()
+        if span is not None:
+            span.set(**attributes)
+
+    def _export(self, span):
+        if self.exporter is not None:
+            self.exporter.submit(span)
+
+    def shutdown(self):
+        if self.exporter is not None:
+            self.exporter.shutdown()
+
+    def get_stats(self):
+        stats = {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "requests": self.requests,
+            "sampled": self.sampled,
+        }
+        if self.exporter is not None:
+            stats["export"] = self.exporter.get_stats()
+        return stats
+
+
+class TracingMiddleware:
+    """
+    ASGI 中间件：确定请求 ID、创建根 span，并在响应头中返回 X-Request-ID
+
+    根 span 在响应体发送完毕后结束，流式响应的 SSE 写出记录为 http.response_body 子 span
+    （首个数据块到结束），包含块数、字节数和等待发送的累计耗时。
+    """
+
+    def __init__(self, app, tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        tracer = self.tracer
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1").strip()
+        if not _REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        request_id_var.set(request_id)
+
+        span = tracer.start_trace(
+            f"{scope['method']} {scope['path']}",
+            request_id,
+            headers.get(b"traceparent", b"").decode("latin-1"),
+            **{"http.method": scope["method"], "http.target": scope["path"]},
+        )
+        _current_span.set(span)
+
+        body = {"status": None, "first_ns": None, "chunks": 0, "bytes": 0, "send_ns": 0}
+
+        async def traced_send(message):
+            if message["type"] == "http.response.start":
+                body["status"] = message.get("status")
+                message = {
+                    **message,
+                    "headers": list(message.get("headers") or []) + [(b"x-request-id", request_id.encode("latin-1"))],
+                }
+            if span is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            start = time.time_ns()
+            await send(message)
+            if body["first_ns"] is None:
+                body["first_ns"] = start
+            body["chunks"] += 1
+            body["bytes"] += len(message.get("body", b""))
+            body["send_ns"] += time.time_ns() - start
+
+        error = None
+        try:
+            await self.app(scope, receive, traced_send)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if span is not None:
+                end_ns = time.time_ns()
+                if body["first_ns"] is not None:
+                    tracer.add_span(
+                        "http.response_body", body["first_ns"], end_ns, parent=span,
+                        chunks=body["chunks"], bytes=body["bytes"], send_ms=round(body["send_ns"] / 1e6, 3),
+                    )
+                span.set(**{"http.status_code": body["status"]})
+                span.end(end_ns, error=error)
+
+
+# 全局追踪器实例
+tracer = Tracer()
@@ -0,0 +1,231 @@
+"""
+语音转写任务队列
+
+转写请求作为任务进入异步队列，立即返回任务 ID，客户端轮询状态或流式获取段落。
+处理分为两个阶段：
+- 解码：ffmpeg 音频解码在进程池中执行，多个任务可以同时解码，不排在推理之后
+- 推理：解码完成的任务按顺序交给单个推理线程，由常驻的 faster-whisper 模型逐段转写
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from .whisper_manager import whisper_model_manager
+from utils.log_util import default_logger as logger
+
+SAMPLING_RATE = 16000
+
+JOB_STATES = ("queued", "decoding", "pending", "transcribing", "completed", "failed")
+
+
+def decode_audio_file(path):
+    """
+    在解码进程中将音频解码为 16kHz 单声道 float32，写入 .npy 文件并返回其路径
+
+    解码结果通过文件而非进程间管道返回，长音频不需要整体序列化，
+    推理线程以内存映射方式读取。
+    """
+    import numpy as np
+    from faster_whisper.audio import decode_audio
+
+    audio = decode_audio(path, sampling_rate=SAMPLING_RATE)
+    npy_path = path + ".npy"
+    np.save(npy_path, audio)
+    return npy_path, len(audio) / SAMPLING_RATE
+
+
+class TranscriptionJob:
+    """单个转写任务的状态"""
+
+    def __init__(self, audio_path, language=None, beam_size=5):
+        self.job_id = uuid.uuid4().hex
+        self.audio_path = audio_path
+        self.decoded_path = None
+        self.language = language
+        self.beam_size = beam_size
+        self.status = "queued"
+        self.segments = []
+        self.duration = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # 段落或状态更新时由推理线程通过事件循环置位，供流式接口等待
+        self._updated = asyncio.Event()
+
+    @property
+    def done(self):
+        return self.status in ("completed", "failed")
+
+    async def wait_updated(self, known_segments):
+        """等待出现新的段落或任务结束"""
+        self._updated.clear()
+        if len(self.segments) > known_segments or self.done:
+            return
+        await self._updated.wait()
+
+    def to_dict(self, include_segments=True):
+        data = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "language": self.language,
+            "duration": self.duration,
+            "num_segments": len(self.segments),
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.finished_at and self.started_at and self.duration:
+            # 实时率：转写耗时 / 音频时长
+            data["rtf"] = round((self.finished_at - self.started_at) / self.duration, 4)
+        if include_segments:
+            data["segments"] = list(self.segments)
+        return data
+
+
+class TranscriptionJobManager:
+    """转写任务管理器"""
+
+    def __init__(self, decode_workers=None, max_jobs=1000):
+        """
+        Args:
+            decode_workers: 音频解码进程数，为空时读取环境变量 MODEL_SERVICE_TRANSCRIBE_DECODE_WORKERS（默认 2）
+            max_jobs: 保留的任务数上限，超出时淘汰最早完成的任务
+        """
+        self.decode_workers = decode_workers or int(os.environ.get("MODEL_SERVICE_TRANSCRIBE_DECODE_WORKERS", "2"))
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        self._decode_pool = None
+        # 常驻模型同一时间只转写一个任务
+        self._inference_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+        # 两个执行器中未完成的 future，关闭时取消尚未开始的
+        self._pending = set()
+
+    def _ensure_started(self):
+        """在首次提交任务时绑定当前事件循环并启动推理任务"""
+        if self._worker is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._decode_pool = ProcessPoolExecutor(max_workers=self.decode_workers)
+        self._worker = self._loop.create_task(self._inference_loop())
+
+    def submit(self, audio_path, language=None, beam_size=5):
+        """提交转写任务，必须在事件循环中调用；任务结束后音频文件会被删除"""
+        self._ensure_started()
+        job = TranscriptionJob(audio_path, language, beam_size)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._evict()
+        self._loop.create_task(self._decode(job))
+        return job
+
+    def get_job(self, job_id):
+        """获取任务，不存在时抛出 KeyError"""
+        with self._lock:
+            return self._jobs[job_id]
+
+    def _evict(self):
+        """超出上限时淘汰最早结束的任务，未结束的任务不淘汰"""
+        excess = len(self._jobs) - self.max_jobs
+        if excess <= 0:
+            return
+        for job_id in [j.job_id for j in self._jobs.values() if j.done][:excess]:
+            del self._jobs[job_id]
+
+    def _notify(self, job):
+        """从推理线程通知等待中的流式请求"""
+        self._loop.call_soon_threadsafe(job._updated.set)
+
+    async def _decode(self, job):
+        job.status = "decoding"
+        job._updated.set()
+        try:
+            job.decoded_path, job.duration = await self._run_in_pool(
+                self._decode_pool, decode_audio_file, job.audio_path
+            )
+        except Exception as e:
+            logger.error(f"音频解码失败 {job.job_id}: {e}")
+            self._finish(job, error=f"音频解码失败: {e}")
+            return
+        job.status = "pending"
+        job._updated.set()
+        await self._queue.put(job)
+
+    async def _inference_loop(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run_in_pool(self._inference_pool, self._transcribe, job)
+            except Exception as e:
+                logger.error(f"转写任务失败 {job.job_id}: {e}")
+                self._finish(job, error=str(e))
+            else:
+                self._finish(job)
+
+    def _run_in_pool(self, pool, fn, *args):
+        """在执行器中运行并记录 future（Executor.shutdown 的 cancel_futures 需要 Python 3.9）"""
+        future = pool.submit(fn, *args)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        return asyncio.wrap_future(future, loop=self._loop)
+
+    def _transcribe(self, job):
+        """在推理线程中逐段转写，每段完成后通知流式请求"""
+        import numpy as np
+
+        job.status = "transcribing"
+        job.started_at = time.time()
+        self._notify(job)
+
+        audio = np.load(job.decoded_path, mmap_mode="r")
+        for segment in whisper_model_manager.transcribe_stream(
+            audio, language=job.language, beam_size=job.beam_size
+        ):
+            job.segments.append(segment)
+            self._notify(job)
+
+    def _finish(self, job, error=None):
+        job.status = "failed" if error else "completed"
+        job.error = error
+        job.finished_at = time.time()
+        for path in (job.audio_path, job.decoded_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+        job._updated.set()
+        logger.info(f"转写任务结束 {job.job_id}: {job.status}，{len(job.segments)} 段")
+
+    def get_stats(self):
+        """获取任务统计"""
+        with self._lock:
+            counts = {state: 0 for state in JOB_STATES}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return {
+            "jobs": counts,
+            "queue_size": self._queue.qsize() if self._queue is not None else 0,
+            "decode_workers": self.decode_workers,
+        }
+
+    def shutdown(self):
+        """停止解码进程和推理线程"""
+        if self._worker is not None:
+            self._worker.cancel()
+        for future in list(self._pending):
+            future.cancel()
+        if self._decode_pool is not None:
+            self._decode_pool.shutdown()
+        self._inference_pool.shutdown(wait=False)
+
+
+# 全局转写任务管理器实例
+transcription_job_manager = TranscriptionJobManager()
@@ -0,0 +1,165 @@
+"""
+语音转写 API 路由
+
+音频以二进制请求体上传，服务端边接收边写入临时文件，由常驻的 faster-whisper 模型转写。
+- /subtitles/stream：在同一个请求中转写，字幕在每段识别完成时立即推送给客户端
+- /transcribe：提交异步转写任务，之后轮询任务状态或以 SSE 流式获取段落
+"""
+
+import os
+import json
+import tempfile
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse, Response
+from .whisper_manager import whisper_model_manager
+from .transcribe_jobs import transcription_job_manager
+from .subtitle_format import SUBTITLE_FORMATS, SUBTITLE_MEDIA_TYPES, iter_subtitles
+from utils.log_util import default_logger as logger
+
+router = APIRouter()
+
+# 音频上传的最大字节数
+MAX_AUDIO_BYTES = 2 * 1024**3
+
+
+async def _save_upload(request):
+    """将请求体流式写入临时文件，返回文件路径，调用方负责删除"""
+    fd, path = tempfile.mkstemp(prefix="transcribe-")
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > MAX_AUDIO_BYTES:
+                    raise HTTPException(status_code=413, detail=f"音频超过 {MAX_AUDIO_BYTES} 字节")
+                f.write(chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="请求体为空")
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+@router.post("/subtitles/stream")
+async def stream_subtitles(
+    request: Request,
+    format: str = "srt",
+    language: Optional[str] = None,
+    beam_size: int = 5,
+):
+    """
+    流式字幕接口
+
+    请求体为音频或视频文件的原始字节，响应为 SRT 或 VTT 文本，
+    每识别完一段立即输出一条字幕，无需等待整个文件转写完成。
+    """
+    if format not in SUBTITLE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的字幕格式: {format}")
+
+    path = await _save_upload(request)
+
+    def generate():
+        # 同步生成器由 StreamingResponse 放到线程池中迭代，不阻塞事件循环
+        try:
+            segments = whisper_model_manager.transcribe_stream(path, language=language, beam_size=beam_size)
+            yield from iter_subtitles(segments, format)
+        except Exception as e:
+            logger.error(f"流式字幕生成失败: {e}")
+            raise
+        finally:
+            os.remove(path)
+
+    return StreamingResponse(
+        generate(),
+        media_type=SUBTITLE_MEDIA_TYPES[format],
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # 禁用 nginx 缓冲
+        }
+    )
+
+
+@router.post("/transcribe", status_code=202)
+async def submit_transcription(
+    request: Request,
+    language: Optional[str] = None,
+    beam_size: int = 5,
+):
+    """
+    提交转写任务
+
+    请求体为音频或视频文件的原始字节，立即返回任务 ID。
+    音频解码在进程池中进行，解码完成后按顺序进入推理队列。
+    """
+    path = await _save_upload(request)
+    job = transcription_job_manager.submit(path, language=language, beam_size=beam_size)
+    return {"job_id": job.job_id, "status": job.status}
+
+
+def _get_job_or_404(job_id):
+    try:
+        return transcription_job_manager.get_job(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+
+@router.get("/transcribe/{job_id}")
+async def get_transcription(job_id: str, format: Optional[str] = None):
+    """
+    查询转写任务
+
+    默认返回任务状态和已识别的段落；任务完成后可指定 format=srt 或 format=vtt 获取字幕文件。
+    """
+    job = _get_job_or_404(job_id)
+    if format is None:
+        return job.to_dict()
+
+    if format not in SUBTITLE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的字幕格式: {format}")
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"任务尚未完成，当前状态: {job.status}")
+    return Response(
+        content="".join(iter_subtitles(job.segments, format)),
+        media_type=SUBTITLE_MEDIA_TYPES[format],
+    )
+
+
+@router.get("/transcribe/{job_id}/stream")
+async def stream_transcription(job_id: str):
+    """以 SSE 流式获取任务的段落，已识别的段落先全部推送，之后实时推送新段落"""
+    job = _get_job_or_404(job_id)
+
+    async def generate():
+        yield f"data: {json.dumps({'type': 'start', 'job_id': job.job_id, 'status': job.status})}\n\n"
+        sent = 0
+        while True:
+            await job.wait_updated(sent)
+            while sent < len(job.segments):
+                event = {"type": "segment", "index": sent, **job.segments[sent]}
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+                sent += 1
+            if job.done:
+                break
+
+        if job.status == "failed":
+            yield f"data: {json.dumps({'type': 'error', 'content': job.error}, ensure_ascii=False)}\n\n"
+        else:
+            yield f"data: {json.dumps({'type': 'end', **job.to_dict(include_segments=False)})}\n\n"
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/plain",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"  # 禁用 nginx 缓冲
+        }
+    )
+
+
+@router.get("/whisper/model/info")
+async def get_whisper_model_info():
+    """获取语音识别模型信息"""
+    return whisper_model_manager.get_model_info()
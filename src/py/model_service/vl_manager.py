@@ -0,0 +1,258 @@
+"""
+视觉语言模型管理器
+
+常驻加载 Qwen-VL 模型，避免每张图片重新加载模型。
+请求先进入队列，由后台批处理线程在短时间窗口内收集，
+将分辨率相近、生成参数相同的请求合并为一次 generate 调用。
+图片预处理结果和视觉编码器输出按内容哈希缓存（见 vl_preprocess）。
+"""
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import torch
+from .model_manager import get_best_gpu, capture_model_logs
+from .vl_preprocess import ImagePreprocessor, CachedVisionEncoder
+from utils.log_util import default_logger as logger
+
+
+class VLRequest:
+    """一次图文请求"""
+
+    def __init__(self, prepared, prompt, max_new_tokens=256, temperature=0.0):
+        self.prepared = prepared
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.future = Future()
+
+    def batch_key(self):
+        """可以合并到同一 batch 的请求具有相同的键，同一分辨率分桶的图片视觉 token 数相同"""
+        return (self.prepared.bucket, self.max_new_tokens, self.temperature)
+
+
+class VLModelManager:
+    """视觉语言模型管理器，负责模型常驻和请求微批处理"""
+
+    def __init__(self, model_name=None, max_batch_size=8, max_wait_ms=20, max_pixels=896 * 896):
+        """
+        Args:
+            model_name: 模型名称或路径，为空时读取环境变量 MODEL_SERVICE_VL_MODEL
+            max_batch_size: 单次 generate 的最大图片数
+            max_wait_ms: 收集同一批请求的最长等待时间（毫秒）
+            max_pixels: 预处理后单张图片的最大像素数
+        """
+        self.model_name = model_name or os.environ.get("MODEL_SERVICE_VL_MODEL", "Qwen/Qwen3-VL-2B-Instruct")
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.model = None
+        self.processor = None
+        self.device = None
+        self.is_loaded = False
+        self._load_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self.preprocessor = ImagePreprocessor(max_pixels=max_pixels)
+        self.vision_cache = CachedVisionEncoder()
+
+    def load_model(self):
+        """加载模型并启动批处理线程"""
+        with self._load_lock:
+            if self.is_loaded:
+                return
+
+            from transformers import AutoProcessor
+            try:
+                from transformers import AutoModelForImageTextToText as AutoVLModel
+            except ImportError:
+                from transformers import AutoModelForVision2Seq as AutoVLModel
+
+            logger.info(f"开始加载视觉语言模型: {self.model_name}")
+
+            model_kwargs = {"trust_remote_code": True}
+            best_gpu = get_best_gpu()
+            if best_gpu is not None:
+                model_kwargs.update({
+                    "torch_dtype": torch.bfloat16,
+                    "device_map": {"": best_gpu},
+                })
+                self.device = f"cuda:{best_gpu}"
+            else:
+                logger.warning("未检测到 CUDA 设备，视觉语言模型使用 CPU")
+                model_kwargs.update({"torch_dtype": torch.float32})
+                self.device = "cpu"
+
+            with capture_model_logs():
+                self.processor = AutoProcessor.from_pretrained(self.model_name, trust_remote_code=True)
+                self.model = AutoVLModel.from_pretrained(self.model_name, **model_kwargs).eval()
+            # batch 生成需要左侧 padding
+            self.processor.tokenizer.padding_side = "left"
+            self.vision_cache.install(self.model)
+
+            self._worker = threading.Thread(target=self._batch_loop, name="vl-batcher", daemon=True)
+            self._worker.start()
+
+            self.is_loaded = True
+            logger.info(f"视觉语言模型加载完成，设备: {self.device}")
+
+    def submit(self, image, prompt, max_new_tokens=256, temperature=0.0, digest=None):
+        """
+        提交图文请求
+
+        Args:
+            image: PIL.Image 图片
+            prompt: 文本提示
+            max_new_tokens: 最大生成 token 数
+            temperature: 采样温度，0 表示贪心解码
+            digest: 图片原始字节的内容哈希，用于缓存，为空时根据像素计算
+
+        Returns:
+            concurrent.futures.Future，结果为生成的文本
+        """
+        if not self.is_loaded:
+            self.load_model()
+        prepared = self.preprocessor.prepare(image, digest)
+        request = VLRequest(prepared, prompt, max_new_tokens, temperature)
+        self._queue.put(request)
+        return request.future
+
+    def submit_many(self, image, prompts, max_new_tokens=256, temperature=0.0, digest=None):
+        """
+        对同一张图片提交多个问题
+
+        图片只预处理一次；所有问题同时入队，落在同一个 batch 中，
+        视觉编码器只对第一次出现的图片运行，其余问题命中视觉编码缓存。
+
+        Returns:
+            list: 与 prompts 顺序一致的 Future 列表
+        """
+        if not self.is_loaded:
+            self.load_model()
+        prepared = self.preprocessor.prepare(image, digest)
+        requests = [VLRequest(prepared, prompt, max_new_tokens, temperature) for prompt in prompts]
+        for request in requests:
+            self._queue.put(request)
+        return [request.future for request in requests]
+
+    def generate(self, image, prompt, max_new_tokens=256, temperature=0.0, digest=None):
+        """同步生成"""
+        return self.submit(image, prompt, max_new_tokens, temperature, digest).result()
+
+    def _collect_batch(self):
+        """阻塞等待第一个请求，然后在等待窗口内继续收集"""
+        pending = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(pending) < self.max_batch_size * 4:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return pending
+
+    def _batch_loop(self):
+        while True:
+            pending = self._collect_batch()
+
+            groups = {}
+            for request in pending:
+                groups.setdefault(request.batch_key(), []).append(request)
+
+            for group in groups.values():
+                for i in range(0, len(group), self.max_batch_size):
+                    self._run_batch(group[i:i + self.max_batch_size])
+
+    def _chat_text(self, prompt):
+        messages = [{
+            "role": "user",
+            "content": [
+                {"type": "image"},
+                {"type": "text", "text": prompt},
+            ],
+        }]
+        return self.processor.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True
+        )
+
+    def _build_inputs(self, batch):
+        """用缓存的像素张量构造模型输入，跳过重复的图片处理"""
+        texts = [self._chat_text(request.prompt) for request in batch]
+
+        image_token = getattr(self.processor, "image_token", None)
+        merge_size = getattr(self.processor.image_processor, "merge_size", None)
+        if image_token is None or merge_size is None:
+            # 非 Qwen-VL 结构的处理器，交给处理器完整处理
+            return self.processor(
+                text=texts,
+                images=[request.prepared.image for request in batch],
+                padding=True,
+                return_tensors="pt",
+            )
+
+        pixel_values = []
+        grids = []
+        for i, request in enumerate(batch):
+            values, grid = self.preprocessor.pixel_inputs(request.prepared, self.processor.image_processor)
+            pixel_values.append(values)
+            grids.append(grid)
+            # 与处理器一致：每个图片占位符展开为对应数量的视觉 token
+            num_tokens = int(grid.prod()) // merge_size**2
+            texts[i] = texts[i].replace(image_token, image_token * num_tokens, 1)
+
+        inputs = dict(self.processor.tokenizer(texts, padding=True, return_tensors="pt"))
+        inputs["pixel_values"] = torch.cat(pixel_values, dim=0)
+        inputs["image_grid_thw"] = torch.cat(grids, dim=0)
+        return inputs
+
+    def _run_batch(self, batch):
+        """对一组分辨率相同的请求执行一次 generate"""
+        try:
+            inputs = self._build_inputs(batch)
+            inputs = {k: v.to(self.model.device) if torch.is_tensor(v) else v for k, v in inputs.items()}
+
+            generation_kwargs = {"max_new_tokens": batch[0].max_new_tokens}
+            if batch[0].temperature > 0:
+                generation_kwargs.update({"do_sample": True, "temperature": batch[0].temperature})
+            else:
+                generation_kwargs["do_sample"] = False
+
+            self.vision_cache.set_keys([request.prepared.cache_key for request in batch])
+            try:
+                with torch.no_grad():
+                    output_ids = self.model.generate(**inputs, **generation_kwargs)
+            finally:
+                self.vision_cache.set_keys(None)
+
+            prompt_len = inputs["input_ids"].shape[1]
+            outputs = self.processor.batch_decode(
+                output_ids[:, prompt_len:], skip_special_tokens=True
+            )
+            for request, output in zip(batch, outputs):
+                request.future.set_result(output.strip())
+
+            logger.info(f"视觉语言模型批处理完成: {len(batch)} 张图片")
+
+        except Exception as e:
+            logger.error(f"视觉语言模型批处理失败: {e}")
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+
+    def get_model_info(self):
+        """获取模型信息"""
+        return {
+            "model_name": self.model_name,
+            "device": self.device,
+            "is_loaded": self.is_loaded,
+            "queue_size": self._queue.qsize(),
+            "pixel_cache": self.preprocessor.pixel_cache.get_stats(),
+            "vision_cache": self.vision_cache.cache.get_stats(),
+        }
+
+
+# 全局视觉语言模型管理器实例，首次请求时加载
+vl_model_manager = VLModelManager()
@@ -0,0 +1,257 @@
+"""
+视觉语言模型图片预处理
+
+- 按像素预算缩小图片，并缩放到最接近原始宽高比的标准分辨率（分桶），
+  同一分桶的图片产生相同数量的视觉 token，可以无 padding 地合并 batch
+- 处理后的像素张量按内容哈希缓存，同一张图片的后续请求跳过图片处理
+- 视觉编码器的输出按内容哈希缓存，同一张图片的后续问题跳过视觉编码器
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+import torch
+from utils.log_util import default_logger as logger
+
+# 标准分辨率（宽, 高），均为 28 的倍数，与 Qwen-VL 的 patch 合并粒度对齐
+STANDARD_RESOLUTIONS = [
+    (448, 448), (560, 420), (420, 560), (672, 448), (448, 672),
+    (672, 672), (784, 588), (588, 784), (896, 504), (504, 896),
+    (896, 672), (672, 896), (896, 896), (1120, 840), (840, 1120),
+    (1260, 700), (700, 1260), (1120, 1120), (1344, 756), (756, 1344),
+]
+
+
+# 流式计算哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(data):
+    """计算图片原始字节的内容哈希"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(fileobj):
+    """分块读取文件对象计算内容哈希，读取后将位置重置到开头"""
+    hasher = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b""):
+        hasher.update(chunk)
+    fileobj.seek(0)
+    return hasher.hexdigest()
+
+
+class LRUCache:
+    """线程安全的 LRU 缓存"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+class PreparedImage:
+    """缩放到标准分辨率后的图片"""
+
+    def __init__(self, image, digest, bucket):
+        self.image = image
+        self.digest = digest
+        self.bucket = bucket
+
+    @property
+    def cache_key(self):
+        return f"{self.digest}:{self.bucket[0]}x{self.bucket[1]}"
+
+
+class ImagePreprocessor:
+    """图片预处理：像素预算、分辨率分桶和像素张量缓存"""
+
+    def __init__(self, max_pixels=896 * 896, resolutions=STANDARD_RESOLUTIONS, cache_size=512):
+        """
+        Args:
+            max_pixels: 单张图片的最大像素数
+            resolutions: 可选的标准分辨率列表
+            cache_size: 像素张量缓存条目数上限
+        """
+        self.max_pixels = max_pixels
+        self.resolutions = [r for r in resolutions if r[0] * r[1] <= max_pixels] or [min(resolutions, key=lambda r: r[0] * r[1])]
+        self.pixel_cache = LRUCache(cache_size)
+
+    def select_bucket(self, width, height):
+        """选择宽高比最接近、且不超过原图面积（优先）的标准分辨率"""
+        aspect = width / height
+        area = width * height
+
+        def score(resolution):
+            ratio = resolution[0] / resolution[1]
+            # 宽高比差异优先，其次避免放大，最后保留尽可能多的像素
+            upscale = max(resolution[0] * resolution[1] - area, 0)
+            return (round(abs(ratio - aspect), 2), upscale, -resolution[0] * resolution[1])
+
+        return min(self.resolutions, key=score)
+
+    def prepare(self, image, digest=None):
+        """
+        将图片转换为 RGB 并缩放到标准分辨率
+
+        Args:
+            image: PIL.Image 图片
+            digest: 图片原始字节的内容哈希，为空时根据像素计算
+
+        Returns:
+            PreparedImage
+        """
+        from PIL import Image
+
+        if digest is None:
+            digest = content_hash(image.tobytes())
+        image = image.convert("RGB")
+        bucket = self.select_bucket(*image.size)
+        if image.size != bucket:
+            image = image.resize(bucket, Image.BICUBIC)
+        return PreparedImage(image, digest, bucket)
+
+    def pixel_inputs(self, prepared, image_processor):
+        """获取图片的像素张量和 grid_thw，按内容哈希缓存"""
+        cached = self.pixel_cache.get(prepared.cache_key)
+        if cached is not None:
+            return cached
+
+        outputs = image_processor(images=[prepared.image], return_tensors="pt")
+        cached = (outputs["pixel_values"], outputs["image_grid_thw"])
+        self.pixel_cache.put(prepared.cache_key, cached)
+        return cached
+
+
+def _concat_outputs(outputs):
+    """
+    拼接逐张图片的视觉编码器输出，第 0 维为视觉 token
+
+    输出可以是张量、张量的嵌套 tuple/list（旧版 transformers），
+    或 ModelOutput（transformers 5 的 Qwen3-VL 返回 BaseModelOutputWithDeepstackFeatures），后者逐字段拼接。
+    """
+    first = outputs[0]
+    if torch.is_tensor(first):
+        return torch.cat(outputs, dim=0)
+    if isinstance(first, dict):
+        return type(first)(**{key: _concat_outputs([o[key] for o in outputs]) for key in first.keys()})
+    return type(first)(_concat_outputs([o[i] for o in outputs]) for i in range(len(first)))
+
+
+class _CachedOutput:
+    """ModelOutput 的缓存形式：类型和各字段，命中时重建新对象"""
+
+    def __init__(self, output_type, fields):
+        self.output_type = output_type
+        self.fields = fields
+
+
+def _snapshot(output):
+    """
+    视觉编码器输出的缓存副本：张量 detach，容器和 ModelOutput 拆开保存
+
+    调用方可能原地修改返回的对象（如 transformers 5 的 get_image_features 会把 pooler_output
+    替换为按图片切分的 tuple），缓存中不能保存返回给调用方的同一个对象。
+    """
+    if torch.is_tensor(output):
+        return output.detach()
+    if isinstance(output, dict):
+        return _CachedOutput(type(output), {key: _snapshot(value) for key, value in output.items()})
+    if isinstance(output, (tuple, list)):
+        return type(output)(_snapshot(value) for value in output)
+    return output
+
+
+def _restore(cached):
+    """由缓存副本重建一个新的输出对象"""
+    if isinstance(cached, _CachedOutput):
+        return cached.output_type(**{key: _restore(value) for key, value in cached.fields.items()})
+    if isinstance(cached, (tuple, list)):
+        return type(cached)(_restore(value) for value in cached)
+    return cached
+
+
+class CachedVisionEncoder:
+    """
+    包装模型的视觉编码器，按图片内容哈希缓存编码结果
+
+    调用 generate 前通过 set_keys 设置本批图片的缓存键（顺序与 pixel_values 中的图片一致），
+    未设置或数量不匹配时直接调用原始编码器。
+    """
+
+    def __init__(self, cache_size=128):
+        self.cache = LRUCache(cache_size)
+        self._forward = None
+        self._keys = None
+
+    def install(self, model):
+        """在模型上安装缓存包装，未找到视觉编码器时返回 False"""
+        visual = getattr(model, "visual", None)
+        if visual is None and hasattr(model, "model"):
+            visual = getattr(model.model, "visual", None)
+        if visual is None:
+            logger.warning("未找到视觉编码器，跳过视觉编码缓存")
+            return False
+
+        self._forward = visual.forward
+        visual.forward = self._cached_forward
+        return True
+
+    def set_keys(self, keys):
+        self._keys = keys
+
+    def _cached_forward(self, hidden_states, grid_thw=None, **kwargs):
+        keys = self._keys
+        if keys is None or grid_thw is None or len(keys) != grid_thw.shape[0]:
+            return self._forward(hidden_states, grid_thw=grid_thw, **kwargs)
+
+        patch_counts = grid_thw.prod(-1).tolist()
+
+        outputs = []
+        offset = 0
+        for key, patches, grid in zip(keys, patch_counts, grid_thw):
+            cached = self.cache.get(key)
+            if cached is None:
+                cached = _snapshot(self._forward(
+                    hidden_states[offset:offset + patches], grid_thw=grid.unsqueeze(0), **kwargs
+                ))
+                self.cache.put(key, cached)
+            # 同一批中同一张图片出现多次（对一张图片的多个问题）时每次都重建，各行互不影响
+            outputs.append(_restore(cached))
+            offset += patches
+
+        if len(outputs) == 1:
+            return outputs[0]
+        return _concat_outputs(outputs)
@@ -0,0 +1,287 @@
+"""
+视觉语言模型 API 路由
+
+提供与 OpenAI / vLLM 兼容的 chat/completions 接口，
+vl/src/py/client.py 中的 Qwen3VLClient 可直接以 http://host:port/api/v1/vl 作为 base_url 使用。
+
+图片可以通过三种方式传入：
+- data URL（base64，与 vLLM 兼容）
+- file:// 本地路径，供同机部署的客户端使用，路径必须位于 MODEL_SERVICE_VL_LOCAL_ROOTS 允许的目录中
+- /upload 接口的二进制请求体，服务端边接收边计算哈希并写入临时文件，不在内存中保留 base64 字符串
+"""
+
+import os
+import json
+import time
+import uuid
+import base64
+import asyncio
+import hashlib
+import tempfile
+from io import BytesIO
+from typing import List, Dict, Any, Optional, Union
+from fastapi import APIRouter, HTTPException, Request, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from .vl_manager import vl_model_manager
+from .vl_preprocess import content_hash, file_hash
+from utils.log_util import default_logger as logger
+
+router = APIRouter()
+
+# 二进制上传的最大字节数
+MAX_UPLOAD_BYTES = 64 * 1024**2
+# 上传内容超过该大小时由内存转存到磁盘临时文件
+SPOOL_MEMORY_BYTES = 4 * 1024**2
+
+class VLMessage(BaseModel):
+    role: str
+    content: Union[str, List[Dict[str, Any]]]
+
+class VLChatRequest(BaseModel):
+    model: Optional[str] = None
+    messages: List[VLMessage]
+    temperature: float = 0.0
+    max_tokens: int = 256
+
+class VLAnalyzeRequest(BaseModel):
+    # data URL 形式的图片，只上传一次
+    image: str
+    questions: List[str]
+    temperature: float = 0.0
+    max_tokens: int = 256
+    stream: bool = False
+
+def _local_roots():
+    """允许通过 file:// 引用的本地目录，未配置时禁用本地路径"""
+    roots = os.environ.get("MODEL_SERVICE_VL_LOCAL_ROOTS", "")
+    return [os.path.realpath(root) for root in roots.split(os.pathsep) if root]
+
+def _open_local_image(path):
+    """打开允许目录中的本地图片，返回 (图片, 内容哈希)"""
+    from PIL import Image
+
+    real_path = os.path.realpath(path)
+    roots = _local_roots()
+    if not any(os.path.commonpath([real_path, root]) == root for root in roots):
+        raise ValueError(f"不允许访问的本地路径: {path}")
+
+    with open(real_path, "rb") as f:
+        digest = file_hash(f)
+        image = Image.open(f)
+        image.load()
+    return image, digest
+
+def _decode_image(url):
+    """解析 data URL 或 file:// 形式的图片，返回 (图片, 原始字节的内容哈希)"""
+    from PIL import Image
+
+    if url.startswith("file://"):
+        return _open_local_image(url[len("file://"):])
+    if not url.startswith("data:"):
+        raise ValueError("仅支持 data URL 或 file:// 形式的图片")
+    _, b64 = url.split(",", 1)
+    data = base64.b64decode(b64)
+    return Image.open(BytesIO(data)), content_hash(data)
+
+async def _read_upload(request):
+    """边接收边计算哈希，将请求体写入临时文件，返回 (图片, 内容哈希)"""
+    from PIL import Image
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    hasher = hashlib.sha256()
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            spool.close()
+            raise HTTPException(status_code=413, detail=f"图片超过 {MAX_UPLOAD_BYTES} 字节")
+        hasher.update(chunk)
+        spool.write(chunk)
+
+    if size == 0:
+        spool.close()
+        raise HTTPException(status_code=400, detail="请求体为空")
+
+    def open_image():
+        try:
+            spool.seek(0)
+            image = Image.open(spool)
+            image.load()
+            return image
+        finally:
+            spool.close()
+
+    try:
+        image = await run_in_threadpool(open_image)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"无法解析图片: {e}")
+    return image, hasher.hexdigest()
+
+def _parse_messages(messages):
+    """从最后一条用户消息中提取图片和文本"""
+    user_messages = [m for m in messages if m.role == "user"]
+    if not user_messages:
+        raise ValueError("缺少用户消息")
+
+    content = user_messages[-1].content
+    if isinstance(content, str):
+        raise ValueError("请求中缺少图片")
+
+    image = None
+    digest = None
+    texts = []
+    for item in content:
+        if item.get("type") == "image_url":
+            if image is not None:
+                raise ValueError("每个请求仅支持一张图片")
+            image, digest = _decode_image(item["image_url"]["url"])
+        elif item.get("type") == "text":
+            texts.append(item["text"])
+
+    if image is None:
+        raise ValueError("请求中缺少图片")
+    return image, digest, "\n".join(texts)
+
+@router.post("/v1/chat/completions")
+async def chat_completions(request: VLChatRequest):
+    """图文对话接口（OpenAI 兼容格式）"""
+    try:
+        image, digest, prompt = await run_in_threadpool(_parse_messages, request.messages)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        if not vl_model_manager.is_loaded:
+            await run_in_threadpool(vl_model_manager.load_model)
+
+        future = await run_in_threadpool(
+            vl_model_manager.submit, image, prompt, request.max_tokens, request.temperature, digest
+        )
+        content = await asyncio.wrap_future(future)
+
+    except Exception as e:
+        logger.error(f"图文请求处理失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": vl_model_manager.model_name,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+    }
+
+@router.post("/analyze")
+async def analyze(request: VLAnalyzeRequest):
+    """对同一张图片提出多个问题，图片只上传、预处理和编码一次"""
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="问题列表不能为空")
+    try:
+        image, digest = await run_in_threadpool(_decode_image, request.image)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return await _answer_questions(
+        image, digest, request.questions, request.max_tokens, request.temperature, request.stream
+    )
+
+@router.post("/upload")
+async def upload(
+    request: Request,
+    question: List[str] = Query(...),
+    max_tokens: int = 256,
+    temperature: float = 0.0,
+    stream: bool = False,
+):
+    """
+    二进制图片上传接口
+
+    请求体为图片原始字节（Content-Type 为 image/* 或 application/octet-stream），
+    问题通过可重复的 question 查询参数传入，响应格式同 /analyze。
+    """
+    image, digest = await _read_upload(request)
+    return await _answer_questions(image, digest, question, max_tokens, temperature, stream)
+
+async def _answer_questions(image, digest, questions, max_tokens, temperature, stream):
+    """提交同一张图片的多个问题，返回完整结果或 SSE 流"""
+    try:
+        if not vl_model_manager.is_loaded:
+            await run_in_threadpool(vl_model_manager.load_model)
+
+        futures = await run_in_threadpool(
+            vl_model_manager.submit_many, image, questions, max_tokens, temperature, digest
+        )
+    except Exception as e:
+        logger.error(f"多问题图文请求处理失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if not stream:
+        try:
+            answers = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+        except Exception as e:
+            logger.error(f"多问题图文请求处理失败: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        return {
+            "model": vl_model_manager.model_name,
+            "answers": [
+                {"question": question, "answer": answer}
+                for question, answer in zip(questions, answers)
+            ],
+        }
+
+    async def generate():
+        yield f"data: {json.dumps({'type': 'start', 'content': ''})}\n\n"
+        try:
+            # 按完成顺序推送每个问题的答案
+            async def indexed(index, future):
+                return index, await asyncio.wrap_future(future)
+
+            for done in asyncio.as_completed([indexed(i, f) for i, f in enumerate(futures)]):
+                index, answer = await done
+                event = {
+                    "type": "answer",
+                    "index": index,
+                    "question": questions[index],
+                    "content": answer,
+                }
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            logger.error(f"多问题图文流式请求失败: {e}")
+            yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
+            return
+        yield f"data: {json.dumps({'type': 'end', 'content': ''})}\n\n"
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/plain",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"  # 禁用 nginx 缓冲
+        }
+    )
+
+@router.get("/model/info")
+async def get_vl_model_info():
+    """获取视觉语言模型信息"""
+    return vl_model_manager.get_model_info()
+
+@router.post("/model/load")
+async def load_vl_model():
+    """加载视觉语言模型"""
+    try:
+        if vl_model_manager.is_loaded:
+            return {"status": "already_loaded", "message": "模型已加载"}
+
+        await run_in_threadpool(vl_model_manager.load_model)
+        return {"status": "loaded", "message": "模型加载完成"}
+
+    except Exception as e:
+        logger.error(f"加载视觉语言模型失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,99 @@
+"""
+语音识别模型管理器
+
+常驻加载 faster-whisper 模型，避免每次转写重新加载。
+转写结果以生成器形式逐段返回，调用方可以边识别边输出字幕。
+"""
+
+import os
+import threading
+from .model_manager import get_best_gpu
+from utils.log_util import default_logger as logger
+
+
+class WhisperModelManager:
+    """faster-whisper 模型管理器"""
+
+    def __init__(self, model_size=None, compute_type=None, cpu_threads=0):
+        """
+        Args:
+            model_size: 模型大小或路径，为空时读取环境变量 MODEL_SERVICE_WHISPER_MODEL（默认 medium）
+            compute_type: CTranslate2 计算精度，为空时读取 MODEL_SERVICE_WHISPER_COMPUTE_TYPE，
+                          未配置时 GPU 使用 float16，CPU 使用 int8
+            cpu_threads: CPU 推理线程数，0 表示使用默认值
+        """
+        self.model_size = model_size or os.environ.get("MODEL_SERVICE_WHISPER_MODEL", "medium")
+        self.compute_type = compute_type or os.environ.get("MODEL_SERVICE_WHISPER_COMPUTE_TYPE")
+        self.cpu_threads = cpu_threads
+        self.model = None
+        self.device = None
+        self.is_loaded = False
+        self._load_lock = threading.Lock()
+
+    def load_model(self):
+        """加载模型"""
+        with self._load_lock:
+            if self.is_loaded:
+                return
+
+            from faster_whisper import WhisperModel
+
+            logger.info(f"开始加载语音识别模型: {self.model_size}")
+
+            best_gpu = get_best_gpu()
+            if best_gpu is not None:
+                device, device_index = "cuda", best_gpu
+                compute_type = self.compute_type or "float16"
+                self.device = f"cuda:{best_gpu}"
+            else:
+                logger.warning("未检测到 CUDA 设备，语音识别模型使用 CPU int8 推理")
+                device, device_index = "cpu", 0
+                compute_type = self.compute_type or "int8"
+                self.device = "cpu"
+
+            self.model = WhisperModel(
+                self.model_size,
+                device=device,
+                device_index=device_index,
+                compute_type=compute_type,
+                cpu_threads=self.cpu_threads,
+            )
+            self.compute_type = compute_type
+            self.is_loaded = True
+            logger.info(f"语音识别模型加载完成，设备: {self.device}，精度: {compute_type}")
+
+    def transcribe_stream(self, audio, language=None, beam_size=5, vad_filter=True):
+        """
+        逐段转写音频
+
+        Args:
+            audio: 音频文件路径、文件对象或 16kHz 单声道 float32 数组
+            language: 语言代码，为空时自动检测
+            beam_size: 束搜索宽度
+            vad_filter: 是否先用 VAD 跳过静音
+
+        Yields:
+            dict: {"start": 秒, "end": 秒, "text": 文本}，在每段识别完成时产出
+        """
+        if not self.is_loaded:
+            self.load_model()
+
+        segments, info = self.model.transcribe(
+            audio, language=language, beam_size=beam_size, vad_filter=vad_filter
+        )
+        logger.info(f"开始转写: 语言 {info.language}，时长 {info.duration:.1f}s")
+        for segment in segments:
+            yield {"start": segment.start, "end": segment.end, "text": segment.text.strip()}
+
+    def get_model_info(self):
+        """获取模型信息"""
+        return {
+            "model_size": self.model_size,
+            "compute_type": self.compute_type,
+            "device": self.device,
+            "is_loaded": self.is_loaded,
+        }
+
+
+# 全局语音识别模型管理器实例，首次请求时加载
+whisper_model_manager = WhisperModelManager()
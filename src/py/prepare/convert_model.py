@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+模型预转换工具
+
+将模型目录一次性转换为服务格式（见 model_service.serving_format），
+默认输出到 models/<模型名称>/serving，ModelManager 启动时优先加载该目录。
+转换后会写入文件清单，服务启动时按大小和修改时间快速校验。
+
+用法:
+    cd src/py
+    python -m prepare.convert_model Qwen/Qwen3-8B --dtype float16
+    # 对比转换前后的加载耗时
+    python -m prepare.convert_model Qwen/Qwen3-8B --benchmark-only --repeat 3
+"""
+
+import gc
+import json
+import time
+import argparse
+import logging
+from pathlib import Path
+
+import torch
+
+from model_service.serving_format import (
+    DTYPES, SERVING_DIR_NAME, SERVING_MANIFEST, load_serving_model, save_serving_artifact,
+)
+from utils.model_manifest import MANIFEST_NAME, sha256_file, file_entry, write_manifest
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def resolve_source(model):
+    """模型名称解析为 models/<模型名称>，也可以直接传入目录"""
+    path = Path(model)
+    if path.is_dir():
+        return path
+    from utils.constants import MODELS_DIR
+    return MODELS_DIR / model
+
+
+def convert(source_dir, output_dir, dtype="float16"):
+    """加载源模型（CPU 上一次性转换精度），保存为服务格式并写入文件清单"""
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    logger.info(f"加载源模型: {source_dir}")
+    start = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(source_dir, trust_remote_code=True)
+    model = AutoModelForCausalLM.from_pretrained(
+        source_dir, torch_dtype=DTYPES[dtype], low_cpu_mem_usage=True, trust_remote_code=True
+    )
+
+    logger.info(f"写入服务格式: {output_dir}")
+    manifest = save_serving_artifact(model, tokenizer, output_dir, dtype=dtype, source=source_dir)
+
+    files = {}
+    for path in sorted(Path(output_dir).iterdir()):
+        if path.is_file() and path.name != MANIFEST_NAME:
+            files[path.name] = file_entry(path, sha256_file(path).hexdigest())
+    write_manifest(output_dir, {"source": "convert_model", "files": files})
+
+    logger.info(f"转换完成，{manifest['num_tensors']} 个张量，耗时 {time.perf_counter() - start:.1f}s")
+
+
+def _release(model):
+    del model
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def benchmark(source_dir, output_dir, device, repeat=3):
+    """
+    对比 from_pretrained 与服务格式的模型加载耗时
+
+    每种方式先预热一次，使两者都从页缓存读取文件，比较的是解析、转换和放置的开销。
+    """
+    from transformers import AutoModelForCausalLM
+
+    # 两种方式使用相同精度，from_pretrained 需要在加载时完成精度转换
+    with open(Path(output_dir) / SERVING_MANIFEST, "r", encoding="utf-8") as f:
+        dtype = DTYPES[json.load(f)["dtype"]]
+
+    def load_pretrained():
+        start = time.perf_counter()
+        model = AutoModelForCausalLM.from_pretrained(
+            source_dir, torch_dtype=dtype, device_map={"": device}, trust_remote_code=True
+        )
+        seconds = time.perf_counter() - start
+        _release(model)
+        return seconds
+
+    def load_serving():
+        model, seconds = load_serving_model(output_dir, device=device)
+        _release(model)
+        return seconds
+
+    results = {}
+    for name, loader in (("from_pretrained", load_pretrained), ("serving", load_serving)):
+        loader()
+        results[name] = [loader() for _ in range(repeat)]
+
+    print("-" * 60)
+    print(f"设备: {device}，重复 {repeat} 次")
+    print(f"{'方式':<16} {'最短(s)':>10} {'平均(s)':>10}")
+    for name, times in results.items():
+        print(f"{name:<16} {min(times):>10.2f} {sum(times) / len(times):>10.2f}")
+    speedup = min(results["from_pretrained"]) / min(results["serving"])
+    print(f"加速比: {speedup:.1f}x")
+    print("-" * 60)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="将模型转换为服务格式")
+    parser.add_argument("model", help="模型名称（对应 models/<模型名称>）或模型目录")
+    parser.add_argument("--output", default=None, help=f"输出目录 (默认: <模型目录>/{SERVING_DIR_NAME})")
+    parser.add_argument("--dtype", default="float16", choices=list(DTYPES), help="目标精度 (默认: float16)")
+    parser.add_argument("--benchmark", action="store_true", help="转换后对比加载耗时")
+    parser.add_argument("--benchmark-only", action="store_true", help="跳过转换，只对比加载耗时")
+    parser.add_argument("--device", default=None, help="基准测试设备 (默认: cuda:0 或 cpu)")
+    parser.add_argument("--repeat", type=int, default=3, help="基准测试重复次数 (默认: 3)")
+    args = parser.parse_args()
+
+    source_dir = resolve_source(args.model)
+    if not (source_dir / "config.json").exists():
+        parser.error(f"模型目录不存在或缺少 config.json: {source_dir}")
+    output_dir = Path(args.output) if args.output else source_dir / SERVING_DIR_NAME
+
+    if not args.benchmark_only:
+        convert(source_dir, output_dir, args.dtype)
+
+    if args.benchmark or args.benchmark_only:
+        device = args.device or ("cuda:0" if torch.cuda.is_available() else "cpu")
+        benchmark(source_dir, output_dir, device, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
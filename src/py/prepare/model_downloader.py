@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+模型文件并行下载
+
+按文件清单并行下载模型分片，不实例化模型、不把权重读入内存：
+- 每个文件先写入 .part 临时文件，中断后再次运行从已下载的位置继续
+- 下载过程中流式计算 SHA256，与镜像清单比对后才重命名为正式文件
+- 完成后在模型目录写入本地清单（utils.model_manifest），供服务启动时快速校验
+
+镜像源通过 ModelMirror 抽象，LocalMirror 读取本地目录，可作为离线镜像或测试用的假镜像。
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from fnmatch import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.model_manifest import (
+    HASH_CHUNK_SIZE, sha256_file, file_entry, load_manifest, write_manifest, validate_manifest,
+)
+
+logger = logging.getLogger(__name__)
+
+# 下载中的临时文件后缀
+PARTIAL_SUFFIX = ".part"
+
+
+class ChecksumError(Exception):
+    """下载文件的 SHA256 与清单不一致"""
+
+
+class RemoteFile:
+    """镜像中的单个文件"""
+
+    def __init__(self, path, size=None, sha256=None):
+        self.path = path
+        self.size = size
+        # 为空时无法校验内容（例如非 LFS 文件只提供 git blob 哈希），仅校验大小
+        self.sha256 = sha256
+
+
+class ModelMirror:
+    """模型镜像源"""
+
+    name = "mirror"
+
+    def list_files(self, model_name, revision="main"):
+        """返回模型的 RemoteFile 列表"""
+        raise NotImplementedError
+
+    def iter_content(self, model_name, path, offset=0, revision="main"):
+        """从 offset 开始逐块返回文件内容"""
+        raise NotImplementedError
+
+
+class LocalMirror(ModelMirror):
+    """
+    本地目录镜像，目录结构为 <root>/<model_name>/<文件>
+
+    如果模型目录中有 manifest.json（格式同本地清单），使用其中的 SHA256，
+    否则在列出文件时计算。
+    """
+
+    name = "local"
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def list_files(self, model_name, revision="main"):
+        model_dir = self.root / model_name
+        if not model_dir.is_dir():
+            raise FileNotFoundError(f"镜像中不存在模型: {model_dir}")
+
+        manifest = load_manifest(model_dir)
+        if manifest is not None:
+            return [
+                RemoteFile(name, entry["size"], entry.get("sha256"))
+                for name, entry in manifest["files"].items()
+            ]
+
+        files = []
+        for path in sorted(model_dir.rglob("*")):
+            if path.is_file() and path.name != "manifest.json":
+                files.append(RemoteFile(
+                    path.relative_to(model_dir).as_posix(),
+                    path.stat().st_size,
+                    sha256_file(path).hexdigest(),
+                ))
+        return files
+
+    def iter_content(self, model_name, path, offset=0, revision="main"):
+        with open(self.root / model_name / path, "rb") as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+
+class HuggingFaceMirror(ModelMirror):
+    """HuggingFace Hub 或兼容镜像（如 hf-mirror.com），地址默认读取环境变量 HF_ENDPOINT"""
+
+    name = "huggingface"
+
+    def __init__(self, endpoint=None, token=None, timeout=60):
+        self.endpoint = (endpoint or os.environ.get("HF_ENDPOINT", "https://huggingface.co")).rstrip("/")
+        self.token = token or os.environ.get("HF_TOKEN")
+        self.timeout = timeout
+
+    def _headers(self):
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+    def list_files(self, model_name, revision="main"):
+        from huggingface_hub import HfApi
+
+        info = HfApi(endpoint=self.endpoint, token=self.token).model_info(
+            model_name, revision=revision, files_metadata=True
+        )
+        return [
+            RemoteFile(s.rfilename, s.size, s.lfs.sha256 if s.lfs else None)
+            for s in info.siblings
+        ]
+
+    def iter_content(self, model_name, path, offset=0, revision="main"):
+        import requests
+
+        headers = self._headers()
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        url = f"{self.endpoint}/{model_name}/resolve/{revision}/{path}"
+        with requests.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            if offset and response.status_code != 206:
+                raise IOError(f"镜像不支持断点续传: {path}")
+            for chunk in response.iter_content(chunk_size=HASH_CHUNK_SIZE):
+                if chunk:
+                    yield chunk
+
+
+class ModelDownloader:
+    """按清单并行、可续传、带校验地下载模型文件"""
+
+    def __init__(self, mirror, max_workers=4):
+        self.mirror = mirror
+        self.max_workers = max_workers
+        self._progress_lock = threading.Lock()
+        self._downloaded_bytes = 0
+
+    def download(self, model_name, target_dir, revision="main", allow_patterns=None):
+        """
+        下载模型到 target_dir 并写入本地清单
+
+        Args:
+            model_name: 模型名称，如 Qwen/Qwen3-8B
+            target_dir: 本地模型目录
+            revision: 分支或提交
+            allow_patterns: 只下载匹配的文件（fnmatch 模式列表），为空时下载全部
+
+        Returns:
+            dict: 本地清单
+        """
+        target_dir = Path(target_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+
+        files = self.mirror.list_files(model_name, revision)
+        if allow_patterns:
+            files = [f for f in files if any(fnmatch(f.path, p) for p in allow_patterns)]
+        total = sum(f.size or 0 for f in files)
+        logger.info(f"开始下载 {model_name}: {len(files)} 个文件，共 {total / 1024**3:.2f} GB")
+
+        previous = (load_manifest(target_dir) or {}).get("files", {})
+        self._downloaded_bytes = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                f.path: executor.submit(self._download_file, model_name, revision, f, target_dir, previous.get(f.path))
+                for f in files
+            }
+            # 等待全部完成后再抛出第一个错误，已完成的文件不受影响，下次运行会跳过
+            entries = {}
+            errors = []
+            for path, future in futures.items():
+                try:
+                    entries[path] = future.result()
+                except Exception as e:
+                    errors.append(f"{path}: {e}")
+        if errors:
+            raise RuntimeError("部分文件下载失败: " + "; ".join(errors))
+
+        manifest = {
+            "model_name": model_name,
+            "revision": revision,
+            "source": self.mirror.name,
+            "files": entries,
+        }
+        write_manifest(target_dir, manifest)
+        logger.info(f"模型下载完成: {target_dir}，本次下载 {self._downloaded_bytes / 1024**2:.1f} MB")
+        return manifest
+
+    def _download_file(self, model_name, revision, remote, target_dir, previous_entry):
+        dest = target_dir / remote.path
+        partial = dest.with_name(dest.name + PARTIAL_SUFFIX)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+
+        # 已下载且与上次清单一致的文件直接跳过；镜像没有提供 SHA256 的文件（如 config.json）
+        # 清单中记录的是本地计算的哈希，只比较大小和修改时间
+        if dest.exists() and previous_entry is not None:
+            stat = dest.stat()
+            if (stat.st_size == previous_entry["size"] == remote.size
+                    and stat.st_mtime_ns == previous_entry.get("mtime_ns")
+                    and (remote.sha256 is None or previous_entry.get("sha256") == remote.sha256)):
+                return previous_entry
+
+        # 上次运行中断前已完成、但尚未写入清单的文件，校验内容（没有 SHA256 时只能校验大小）后跳过
+        if dest.exists() and remote.size is not None and dest.stat().st_size == remote.size:
+            digest = sha256_file(dest).hexdigest()
+            if remote.sha256 is None or digest == remote.sha256:
+                return file_entry(dest, digest)
+
+        # 续传：先把已下载部分计入哈希，再从断点继续
+        hasher = hashlib.sha256()
+        offset = 0
+        if partial.exists():
+            offset = partial.stat().st_size
+            if remote.size is not None and offset > remote.size:
+                partial.unlink()
+                offset = 0
+            else:
+                sha256_file(partial, hasher)
+                logger.info(f"继续下载 {remote.path}，已完成 {offset} 字节")
+
+        if remote.size is None or offset < remote.size:
+            with open(partial, "ab") as f:
+                for chunk in self.mirror.iter_content(model_name, remote.path, offset, revision):
+                    f.write(chunk)
+                    hasher.update(chunk)
+                    with self._progress_lock:
+                        self._downloaded_bytes += len(chunk)
+
+        digest = hasher.hexdigest()
+        size = partial.stat().st_size
+        if remote.size is not None and size != remote.size:
+            # 大小不符时保留 .part，下次运行继续下载
+            raise IOError(f"文件不完整: {size}/{remote.size} 字节")
+        if remote.sha256 is not None and digest != remote.sha256:
+            partial.unlink()
+            raise ChecksumError(f"SHA256 不一致: 期望 {remote.sha256}，实际 {digest}")
+
+        os.replace(partial, dest)
+        logger.info(f"下载完成: {remote.path}")
+        return file_entry(dest, digest)
+
+
+def verify_download(model_dir, deep=False):
+    """按本地清单校验模型目录，返回是否通过；没有清单时返回 None"""
+    problems = validate_manifest(model_dir, deep=deep)
+    if problems is None:
+        return None
+    for problem in problems:
+        logger.error(problem)
+    return not problems
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="并行下载模型文件")
+    parser.add_argument("model_name", help="模型名称，如 Qwen/Qwen3-8B")
+    parser.add_argument("--target-dir", default=None, help="本地模型目录 (默认: models/<模型名称>)")
+    parser.add_argument("--mirror-dir", default=None, help="使用本地目录作为镜像源")
+    parser.add_argument("--endpoint", default=None, help="HuggingFace 镜像地址 (默认: HF_ENDPOINT 或 huggingface.co)")
+    parser.add_argument("--revision", default="main", help="分支或提交 (默认: main)")
+    parser.add_argument("--workers", type=int, default=4, help="并行下载数 (默认: 4)")
+    parser.add_argument("--verify", action="store_true", help="只按本地清单完整校验，不下载")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.target_dir:
+        target_dir = Path(args.target_dir)
+    else:
+        from utils.constants import MODELS_DIR
+        target_dir = MODELS_DIR / args.model_name
+
+    if args.verify:
+        ok = verify_download(target_dir, deep=True)
+        print(json.dumps({"model_dir": str(target_dir), "valid": ok}, ensure_ascii=False))
+    else:
+        mirror = LocalMirror(args.mirror_dir) if args.mirror_dir else HuggingFaceMirror(args.endpoint)
+        ModelDownloader(mirror, max_workers=args.workers).download(args.model_name, target_dir, args.revision)
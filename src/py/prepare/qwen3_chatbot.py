@@ -2,6 +2,7 @@ import torch
 from modelscope import AutoModelForCausalLM, AutoTokenizer
 from transformers import TextIteratorStreamer
 from utils.log_util import default_logger as logger
+from model_service.history_compactor import HistoryCompactor
 
 try:
     import pynvml
@@ -47,7 +48,7 @@ def get_best_gpu():
     return 3
 
 class QwenChatbot:
-    def __init__(self, model_name="Qwen/Qwen3-8B"):
+    def __init__(self, model_name="Qwen/Qwen3-8B", max_prompt_tokens=None):
         model_kwargs = {
             "trust_remote_code": True,
         }
@@ -67,9 +68,11 @@ class QwenChatbot:
         self.tokenizer = AutoTokenizer.from_pretrained(model_name,trust_remote_code=True)
         self.model = AutoModelForCausalLM.from_pretrained(model_name,**model_kwargs)
         self.history = []
+        # 按 token 预算压缩历史，避免 history 无限增长
+        self.compactor = HistoryCompactor.for_model(model_name, self.tokenizer, max_prompt_tokens=max_prompt_tokens)
 
     def generate_response(self, user_input):
-        messages = self.history + [{"role": "user", "content": user_input}]
+        messages = self.compactor.compact(self.history + [{"role": "user", "content": user_input}])
 
         text = self.tokenizer.apply_chat_template(
             messages,
@@ -84,7 +87,8 @@ class QwenChatbot:
         response_ids = result[0][len(inputs["input_ids"][0]):].tolist()
         response = self.tokenizer.decode(response_ids, skip_special_tokens=True)
 
-        # Update history
+        # Update history，只保留压缩后的历史
+        self.history = messages[:-1]
         self.history.append({"role": "user", "content": user_input})
         self.history.append({"role": "assistant", "content": response})
 
@@ -92,7 +96,7 @@ class QwenChatbot:
 
     def generate_response_stream(self, user_input):
         """流式输出响应，可以实时看到模型的思考过程"""
-        messages = self.history + [{"role": "user", "content": user_input}]
+        messages = self.compactor.compact(self.history + [{"role": "user", "content": user_input}])
 
         text = self.tokenizer.apply_chat_template(
             messages,
@@ -118,7 +122,8 @@ class QwenChatbot:
         
         thread.join()
         
-        # Update history
+        # Update history，只保留压缩后的历史
+        self.history = messages[:-1]
         self.history.append({"role": "user", "content": user_input})
         self.history.append({"role": "assistant", "content": generated_text})
         
@@ -23,32 +23,32 @@ class QwenModelManager:
         self.model_dir.mkdir(exist_ok=True)
         self.config_file = self.model_dir / "model_config.json"
     
-    def download_model_from_huggingface(self, model_name: str = "Qwen/Qwen2.5-3B-Instruct"):
-        """从HuggingFace下载模型"""
+    def download_model_from_huggingface(self, model_name: str = "Qwen/Qwen2.5-3B-Instruct",
+                                        endpoint: str = None, max_workers: int = 4):
+        """从HuggingFace下载模型文件，并行、可续传、按SHA256校验，不加载模型"""
+        from prepare.model_downloader import HuggingFaceMirror
+        return self._download_with_mirror(HuggingFaceMirror(endpoint), model_name, max_workers)
+    
+    def download_model_from_mirror(self, mirror_dir: str, model_name: str = "Qwen/Qwen2.5-3B-Instruct",
+                                   max_workers: int = 4):
+        """从本地镜像目录（<mirror_dir>/<model_name>/...）下载模型文件"""
+        from prepare.model_downloader import LocalMirror
+        return self._download_with_mirror(LocalMirror(mirror_dir), model_name, max_workers)
+    
+    def _download_with_mirror(self, mirror, model_name, max_workers):
         try:
-            from transformers import AutoTokenizer, AutoModelForCausalLM
-            
-            logger.info(f"从HuggingFace下载模型: {model_name}")
+            from prepare.model_downloader import ModelDownloader
             
-            # 下载tokenizer
-            tokenizer = AutoTokenizer.from_pretrained(
-                model_name,
-                trust_remote_code=True,
-                cache_dir=str(self.model_dir)
-            )
+            logger.info(f"从{mirror.name}下载模型: {model_name}")
             
-            # 下载模型
-            model = AutoModelForCausalLM.from_pretrained(
-                model_name,
-                trust_remote_code=True,
-                cache_dir=str(self.model_dir)
-            )
+            model_path = self.model_dir / model_name
+            ModelDownloader(mirror, max_workers=max_workers).download(model_name, model_path)
             
             # 保存配置
             config = {
                 "model_name": model_name,
-                "model_path": str(self.model_dir),
-                "source": "huggingface",
+                "model_path": str(model_path),
+                "source": mirror.name,
                 "download_success": True
             }
             
@@ -59,7 +59,7 @@ class QwenModelManager:
             return True
             
         except Exception as e:
-            logger.error(f"HuggingFace下载失败: {e}")
+            logger.error(f"{mirror.name}下载失败: {e}")
             return False
     
     def download_model_from_modelscope(self, model_name: str = "qwen/Qwen2.5-3B-Instruct"):
@@ -102,8 +102,13 @@ class QwenModelManager:
             logger.error(f"ModelScope下载失败: {e}")
             return False
     
-    def verify_model(self):
-        """验证模型是否可用"""
+    def verify_model(self, deep: bool = False):
+        """
+        验证模型是否可用
+        
+        有本地清单时按清单校验文件（deep 为 True 时重新计算 SHA256），
+        否则（如 ModelScope 下载的模型）尝试加载 tokenizer
+        """
         if not self.config_file.exists():
             logger.error("模型配置文件不存在")
             return False
@@ -123,6 +128,16 @@ class QwenModelManager:
                 logger.error(f"模型路径不存在: {model_path}")
                 return False
             
+            from utils.model_manifest import validate_manifest
+            problems = validate_manifest(model_path, deep=deep)
+            if problems is not None:
+                for problem in problems:
+                    logger.error(problem)
+                if problems:
+                    return False
+                logger.info("模型验证成功！")
+                return True
+            
             # 尝试加载模型
             from transformers import AutoTokenizer
             tokenizer = AutoTokenizer.from_pretrained(
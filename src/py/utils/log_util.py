@@ -1,13 +1,26 @@
 import logging
 import sys
+import contextvars
 from datetime import datetime
 from pathlib import Path
 
+# 当前请求的 ID，由服务的请求追踪中间件设置，写入每条日志；请求之外为 "-"
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+
+class RequestIdFilter(logging.Filter):
+    """为日志记录加上当前请求的 ID"""
+    
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
 
 class LogUtil:
     """
     日志工具类，提供同时输出到控制台和文件的功能
     日志文件按天生成，存储在项目根目录的logs目录下
+    每条日志带有当前请求的 ID，便于按请求过滤
     """
     
     _loggers = {}
@@ -32,10 +45,11 @@ class LogUtil:
         
         # 清除已有的处理器
         logger.handlers.clear()
+        logger.addFilter(RequestIdFilter())
         
         # 创建格式化器
         formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] - %(message)s',
             datefmt='%Y-%m-%d %H:%M:%S'
         )
         
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模型文件清单
+
+下载完成后在模型目录中写入 manifest.json，记录每个文件的大小、SHA256 和修改时间。
+服务启动时只比较大小和修改时间即可快速确认文件完整，需要时再按 SHA256 完整校验。
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+from pathlib import Path
+
+MANIFEST_NAME = "manifest.json"
+
+# 流式计算哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 8 * 1024**2
+
+
+def sha256_file(path, hasher=None):
+    """流式计算文件的 SHA256，不把整个文件读入内存；传入 hasher 时在其基础上继续更新"""
+    hasher = hasher or hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher
+
+
+def file_entry(path, sha256):
+    """生成清单中单个文件的记录"""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "sha256": sha256, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_manifest(model_dir):
+    """读取模型目录中的清单，不存在时返回 None"""
+    path = Path(model_dir) / MANIFEST_NAME
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(model_dir, manifest):
+    """原子写入清单，避免中断时留下不完整的文件"""
+    model_dir = Path(model_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=model_dir, prefix=".manifest-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, model_dir / MANIFEST_NAME)
+
+
+def validate_manifest(model_dir, deep=False):
+    """
+    按清单校验模型目录
+
+    Args:
+        model_dir: 模型目录
+        deep: 为 False 时只比较大小和修改时间；为 True 时重新计算 SHA256
+
+    Returns:
+        list: 问题描述列表，为空表示校验通过；目录中没有清单时返回 None
+    """
+    manifest = load_manifest(model_dir)
+    if manifest is None:
+        return None
+
+    problems = []
+    for name, entry in manifest.get("files", {}).items():
+        path = Path(model_dir) / name
+        if not path.exists():
+            problems.append(f"缺少文件: {name}")
+            continue
+        stat = path.stat()
+        if stat.st_size != entry["size"]:
+            problems.append(f"文件大小不一致: {name}")
+            continue
+        if deep or stat.st_mtime_ns != entry.get("mtime_ns"):
+            # 修改时间变化时不一定损坏（例如复制目录），按内容再确认一次
+            if entry.get("sha256") and sha256_file(path).hexdigest() != entry["sha256"]:
+                problems.append(f"SHA256 不一致: {name}")
+    return problems
@@ -0,0 +1,115 @@
+"""constrained_decoding 的正则表达式 -> DFA、token 掩码和 JSON Schema 编译"""
+
+import json
+import re
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from model_service.constrained_decoding import (  # noqa: E402
+    DEAD_STATE, FINAL_STATE, RegexFSM, TokenGuide, TokenVocabulary, schema_to_regex,
+)
+
+EOS = 0
+
+
+class FakeTokenizer:
+    """按字符串列表定义词表的最小 tokenizer，id 0 为结束符"""
+
+    def __init__(self, tokens):
+        self.tokens = ["<eos>"] + list(tokens)
+        self.all_special_ids = [EOS]
+        self.added_tokens_decoder = {}
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def convert_ids_to_tokens(self, ids):
+        return [self.tokens[i] for i in ids]
+
+    def convert_tokens_to_string(self, tokens):
+        return "".join(tokens)
+
+
+TOKENS = ['{', '}', '"', '":', '"a', 'a', 'ab', 'b', '1', '12', '-', ',', ' ', 'name', 'age', '\\', 'x"', 'a"b']
+
+
+def _guide(pattern):
+    return TokenGuide(RegexFSM(pattern), TokenVocabulary(FakeTokenizer(TOKENS), [EOS]))
+
+
+def _allowed(guide, state):
+    return {guide.vocabulary.texts[t] or "<eos>" for t in range(guide.vocabulary.size) if guide.is_allowed(state, t)}
+
+
+def _walk(guide, texts):
+    ids = {text: i for i, text in enumerate(guide.vocabulary.texts)}
+    state = guide.initial_state
+    for text in texts:
+        state = guide.next_state(state, ids[text])
+    return state
+
+
+@pytest.mark.parametrize("pattern, accepted, rejected", [
+    ("a(b|c)*d", ["ad", "abcbd"], ["a", "abx", "bd"]),
+    ("[0-9]{2,3}", ["12", "123"], ["1", "1234", "1a"]),
+    (r"\d+\.\d?", ["1.", "12.5"], [".5", "1.55"]),
+    ("^[^a-c]x$", ["dx", "zx"], ["ax", "dxx"]),
+])
+def test_regex_fsm_matches_whole_string(pattern, accepted, rejected):
+    fsm = RegexFSM(pattern)
+    for text in accepted:
+        assert fsm.is_accepting(fsm.walk(fsm.initial_state, text)), text
+    for text in rejected:
+        assert not fsm.is_accepting(fsm.walk(fsm.initial_state, text)), text
+
+
+def test_regex_rejects_inner_anchor():
+    with pytest.raises(ValueError):
+        RegexFSM("a^b")
+
+
+def test_guide_masks_and_transitions():
+    guide = _guide("a+b")
+    assert _allowed(guide, guide.initial_state) == {"a", "ab"}
+
+    state = _walk(guide, ["a", "a"])
+    assert _allowed(guide, state) == {"a", "ab", "b"}
+    state = _walk(guide, ["a", "ab"])
+    assert _allowed(guide, state) == {"<eos>"}
+    assert guide.next_state(state, EOS) == FINAL_STATE
+    # 当前状态不允许的 token 进入死状态，之后只能结束
+    assert guide.next_state(guide.initial_state, guide.vocabulary.texts.index("b")) == DEAD_STATE
+
+    mask = guide.blocked_mask(state, "cpu", guide.vocabulary.size + 3)
+    assert mask.tolist() == [False] + [True] * (guide.vocabulary.size + 2)
+
+
+def test_schema_object_in_declared_order():
+    schema = {
+        "type": "object",
+        "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+        "required": ["name"],
+    }
+    pattern = re.compile(schema_to_regex(schema))
+    assert pattern.fullmatch(json.dumps({"name": "a"}, separators=(",", ":")))
+    assert pattern.fullmatch(json.dumps({"name": "a", "age": -12}))
+    assert not pattern.fullmatch(json.dumps({"age": 1}))
+    assert not pattern.fullmatch(json.dumps({"age": 1, "name": "a"}))
+
+
+def test_schema_pattern_cannot_leave_json_string():
+    schema = {"type": "object", "properties": {"name": {"type": "string", "pattern": "^.+$"}}, "required": ["name"]}
+    guide = _guide(schema_to_regex(schema))
+
+    # 字符串中只能用引号结束，不能生成反斜杠或在字符串中间输出引号
+    allowed = _allowed(guide, _walk(guide, ["{", '"', "name", '":', '"a']))
+    assert '"' in allowed and 'x"' in allowed
+    assert "\\" not in allowed and 'a"b' not in allowed
+    state = _walk(guide, ["{", '"', "name", '":', '"a', '"', "}"])
+    assert _allowed(guide, state) == {"<eos>"}
+
+    with pytest.raises(ValueError):
+        schema_to_regex({"type": "string", "pattern": '"'})
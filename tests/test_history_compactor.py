@@ -0,0 +1,87 @@
+"""HistoryCompactor 的 token 预算、滑动窗口和摘要缓存"""
+
+from model_service.history_compactor import (
+    DEFAULT_CONTEXT_BUDGET, MESSAGE_OVERHEAD_TOKENS, MODEL_CONTEXT_BUDGETS, HistoryCompactor,
+)
+
+
+class WordTokenizer:
+    """按空格分词，每个词一个 token"""
+
+    def encode(self, text, add_special_tokens=True):
+        return text.split()
+
+
+def _message(role, words):
+    return {"role": role, "content": " ".join([role] * words)}
+
+
+def _conversation(turns, words=6):
+    """system + turns 轮 user/assistant + 本轮 user，除 system 外每条消息 words + 4 个 token"""
+    messages = [_message("system", 2)]
+    for _ in range(turns):
+        messages += [_message("user", words), _message("assistant", words)]
+    return messages + [_message("user", words)]
+
+
+def _tokens(compactor, messages):
+    return sum(compactor.count_tokens(m) for m in messages)
+
+
+def test_under_budget_is_unchanged():
+    compactor = HistoryCompactor(WordTokenizer(), max_prompt_tokens=1000)
+    messages = _conversation(3)
+    assert compactor.compact(messages) is messages
+
+
+def test_window_keeps_system_and_latest_whole_turns():
+    compactor = HistoryCompactor(WordTokenizer(), max_prompt_tokens=50)
+    messages = _conversation(5)
+
+    compacted = compactor.compact(messages)
+    assert compacted[0] == messages[0]
+    assert compacted[-3:] == messages[-3:]
+    assert compacted[1]["role"] == "user"
+    assert _tokens(compactor, compacted) <= 50
+    # system 6 个 token，其余每条 10 个，预算内最多 4 条，从 user 开始只能保留 3 条
+    assert len(compacted) == 4
+
+
+def test_latest_message_is_kept_over_budget():
+    compactor = HistoryCompactor(WordTokenizer(), max_prompt_tokens=20)
+    messages = _conversation(2, words=40)
+    compacted = compactor.compact(messages)
+    assert compacted == [messages[0], messages[-1]]
+
+
+def test_summary_replaces_dropped_turns_and_is_cached():
+    calls = []
+
+    def summarizer(dropped):
+        calls.append(dropped)
+        return "s"
+
+    compactor = HistoryCompactor(WordTokenizer(), max_prompt_tokens=50, summarizer=summarizer)
+    messages = _conversation(5)
+
+    compacted = compactor.compact(messages)
+    assert compacted[0] == messages[0]
+    assert compacted[1]["role"] == "system" and compacted[1]["content"].endswith("s")
+    assert compacted[-1] == messages[-1]
+    assert _tokens(compactor, compacted) <= 50
+
+    assert compactor.compact(messages) == compacted
+    assert len(calls) == 1
+
+
+def test_budget_per_model():
+    tokenizer = WordTokenizer()
+    name = next(iter(MODEL_CONTEXT_BUDGETS))
+    assert HistoryCompactor.for_model(name, tokenizer).max_prompt_tokens == MODEL_CONTEXT_BUDGETS[name]
+    assert HistoryCompactor.for_model("unknown/model", tokenizer).max_prompt_tokens == DEFAULT_CONTEXT_BUDGET
+    assert HistoryCompactor.for_model(name, tokenizer, max_prompt_tokens=100).max_prompt_tokens == 100
+
+
+def test_count_tokens_includes_message_overhead():
+    compactor = HistoryCompactor(WordTokenizer())
+    assert compactor.count_tokens({"role": "user", "content": "a b c"}) == 3 + MESSAGE_OVERHEAD_TOKENS
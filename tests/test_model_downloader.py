@@ -0,0 +1,111 @@
+"""model_downloader 的下载、续传、校验和跳过逻辑，使用本地目录作为假镜像"""
+
+import hashlib
+import json
+
+import pytest
+
+from prepare.model_downloader import (
+    PARTIAL_SUFFIX, ChecksumError, LocalMirror, ModelDownloader, RemoteFile,
+)
+
+MODEL = "org/tiny-model"
+
+
+class RecordingMirror(LocalMirror):
+    """记录每次读取的文件和起始位置"""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.requests = []
+
+    def iter_content(self, model_name, path, offset=0, revision="main"):
+        self.requests.append((path, offset))
+        return super().iter_content(model_name, path, offset, revision)
+
+
+@pytest.fixture
+def mirror_dir(tmp_path):
+    model_dir = tmp_path / "mirror" / MODEL
+    model_dir.mkdir(parents=True)
+    (model_dir / "model-00001.safetensors").write_bytes(bytes(range(256)) * 64)
+    (model_dir / "config.json").write_text(json.dumps({"hidden_size": 8}))
+    return tmp_path / "mirror"
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_resume_from_truncated_part(mirror_dir, tmp_path):
+    content = (mirror_dir / MODEL / "model-00001.safetensors").read_bytes()
+    target = tmp_path / "target"
+    target.mkdir()
+    (target / ("model-00001.safetensors" + PARTIAL_SUFFIX)).write_bytes(content[:1000])
+
+    mirror = RecordingMirror(mirror_dir)
+    manifest = ModelDownloader(mirror).download(MODEL, target)
+
+    assert ("model-00001.safetensors", 1000) in mirror.requests
+    assert (target / "model-00001.safetensors").read_bytes() == content
+    assert not (target / ("model-00001.safetensors" + PARTIAL_SUFFIX)).exists()
+    assert manifest["files"]["model-00001.safetensors"]["sha256"] == _sha256(content)
+
+
+def test_corrupted_file_raises_checksum_error(mirror_dir, tmp_path):
+    content = (mirror_dir / MODEL / "model-00001.safetensors").read_bytes()
+    target = tmp_path / "target"
+    target.mkdir()
+    # 已下载部分与镜像内容不一致，续传后整体哈希不匹配
+    partial = target / ("model-00001.safetensors" + PARTIAL_SUFFIX)
+    partial.write_bytes(b"\xff" * 1000)
+
+    remote = RemoteFile("model-00001.safetensors", len(content), _sha256(content))
+    with pytest.raises(ChecksumError):
+        ModelDownloader(LocalMirror(mirror_dir))._download_file(MODEL, "main", remote, target, None)
+    # 损坏的临时文件被删除，下次从头下载
+    assert not partial.exists()
+    assert not (target / "model-00001.safetensors").exists()
+
+
+def test_download_reports_checksum_failure(mirror_dir, tmp_path):
+    model_dir = mirror_dir / MODEL
+    (model_dir / "manifest.json").write_text(json.dumps({"files": {
+        "model-00001.safetensors": {"size": (model_dir / "model-00001.safetensors").stat().st_size, "sha256": "0" * 64},
+    }}))
+
+    with pytest.raises(RuntimeError, match="SHA256"):
+        ModelDownloader(LocalMirror(mirror_dir)).download(MODEL, tmp_path / "target")
+
+
+def test_rerun_skips_downloaded_files(mirror_dir, tmp_path):
+    model_dir = mirror_dir / MODEL
+    weights = (model_dir / "model-00001.safetensors").read_bytes()
+    # 与 HuggingFace 一致：只有 LFS 文件提供 SHA256，config.json 没有
+    (model_dir / "manifest.json").write_text(json.dumps({"files": {
+        "model-00001.safetensors": {"size": len(weights), "sha256": _sha256(weights)},
+        "config.json": {"size": (model_dir / "config.json").stat().st_size},
+    }}))
+    target = tmp_path / "target"
+
+    first = RecordingMirror(mirror_dir)
+    ModelDownloader(first).download(MODEL, target)
+    assert sorted(path for path, _ in first.requests) == ["config.json", "model-00001.safetensors"]
+
+    second = RecordingMirror(mirror_dir)
+    downloader = ModelDownloader(second)
+    manifest = downloader.download(MODEL, target)
+    assert second.requests == []
+    assert downloader._downloaded_bytes == 0
+    assert set(manifest["files"]) == {"config.json", "model-00001.safetensors"}
+
+
+def test_completed_file_without_manifest_is_verified_and_skipped(mirror_dir, tmp_path):
+    target = tmp_path / "target"
+    target.mkdir()
+    content = (mirror_dir / MODEL / "model-00001.safetensors").read_bytes()
+    (target / "model-00001.safetensors").write_bytes(content)
+
+    mirror = RecordingMirror(mirror_dir)
+    ModelDownloader(mirror).download(MODEL, target)
+    assert [path for path, _ in mirror.requests] == ["config.json"]
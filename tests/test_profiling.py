@@ -0,0 +1,55 @@
+"""torch.profiler 在执行前向的线程上启动，trace 中包含该线程的算子"""
+
+import json
+import queue
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from model_service.profiling import ProfilerManager  # noqa: E402
+
+
+class ModelThread:
+    """模拟引擎线程：循环执行前向，在两步之间执行 call 提交的函数"""
+
+    def __init__(self, model):
+        self.model = model
+        self._calls = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def call(self, fn):
+        future = Future()
+        self._calls.put((future, fn))
+        return future.result(timeout=30)
+
+    def _run(self):
+        inputs = torch.randn(4, 8)
+        while not self._stop.is_set():
+            while not self._calls.empty():
+                future, fn = self._calls.get()
+                future.set_result(fn())
+            with torch.no_grad():
+                self.model(inputs)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def test_trace_contains_ops_from_engine_thread(tmp_path):
+    model = torch.nn.Sequential(torch.nn.Linear(8, 8), torch.nn.ReLU())
+    engine = ModelThread(model)
+    try:
+        result = ProfilerManager(tmp_path).profile_torch(model, steps=3, timeout=30, run_on=engine.call)
+    finally:
+        engine.stop()
+
+    assert result["steps"] == 3 and not result["timed_out"]
+    trace = json.loads((tmp_path / result["artifacts"][0]).read_text())
+    names = {event.get("name", "") for event in trace["traceEvents"]}
+    assert any(name.startswith("aten::") for name in names)
@@ -0,0 +1,83 @@
+"""RequestCoalescer 在事件循环中合并相同请求并向所有订阅者分发文本块"""
+
+import asyncio
+
+import pytest
+
+from model_service.request_coalescer import RequestCoalescer
+
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_subscribers_share_one_flight():
+    coalescer = RequestCoalescer()
+    calls = []
+    release = None
+
+    async def source():
+        calls.append(1)
+        yield "a"
+        await release.wait()
+        yield "b"
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.ensure_future(_collect(coalescer.subscribe("key", source)))
+        await asyncio.sleep(0)
+        # 后加入的订阅者先回放已产生的文本块
+        second = asyncio.ensure_future(_collect(coalescer.subscribe("key", source)))
+        await asyncio.sleep(0)
+        release.set()
+        return await first, await second
+
+    assert asyncio.run(main()) == (["a", "b"], ["a", "b"])
+    assert calls == [1]
+    assert coalescer.get_stats() == {"in_flight": 0, "flights": 1, "coalesced": 1}
+
+
+def test_error_reaches_every_subscriber():
+    coalescer = RequestCoalescer()
+
+    async def source():
+        yield "a"
+        raise ValueError("boom")
+
+    async def main():
+        streams = [coalescer.subscribe("key", source) for _ in range(2)]
+        return await asyncio.gather(*(_collect(s) for s in streams), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) and "boom" in str(r) for r in results)
+
+
+def test_flight_continues_after_subscriber_leaves():
+    coalescer = RequestCoalescer()
+    produced = []
+
+    async def source():
+        for chunk in "abc":
+            produced.append(chunk)
+            yield chunk
+            await asyncio.sleep(0)
+
+    async def main():
+        stream = coalescer.subscribe("key", source)
+        assert await stream.__anext__() == "a"
+        await stream.aclose()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert produced == ["a", "b", "c"]
+
+
+def test_subscribe_requires_running_loop():
+    async def source():
+        yield "a"
+
+    coalescer = RequestCoalescer()
+    with pytest.raises(RuntimeError):
+        coalescer.subscribe("key", source)
+    assert coalescer.get_stats()["in_flight"] == 0
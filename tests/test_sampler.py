@@ -0,0 +1,77 @@
+"""BatchSampler 与 transformers 逐请求 logits warper 的对照"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from model_service.sampler import BatchSampler, SamplingParams  # noqa: E402
+
+VOCAB = 32
+SAMPLES = 8000
+
+
+def _reference_probs(logits, params, presence=None):
+    """用 transformers 的 processor 和 warper 计算单个序列的采样分布"""
+    processors = transformers.LogitsProcessorList()
+    input_ids = torch.zeros((1, 1), dtype=torch.long)
+    if presence is not None and params.repetition_penalty != 1.0:
+        input_ids = presence.nonzero().view(1, -1)
+        processors.append(transformers.RepetitionPenaltyLogitsProcessor(params.repetition_penalty))
+    processors.append(transformers.TemperatureLogitsWarper(params.temperature))
+    if params.top_k:
+        processors.append(transformers.TopKLogitsWarper(params.top_k))
+    if params.top_p < 1.0:
+        processors.append(transformers.TopPLogitsWarper(params.top_p))
+    return processors(input_ids, logits.view(1, -1).clone()).softmax(dim=-1)[0]
+
+
+def _empirical_probs(logits, params, presence=None):
+    """同一行重复 SAMPLES 次组成一个批次采样，统计各 token 的频率"""
+    batch_logits = logits.view(1, -1).repeat(SAMPLES, 1)
+    batch_presence = presence.view(1, -1).repeat(SAMPLES, 1) if presence is not None else None
+    tokens = BatchSampler().sample(batch_logits, [params] * SAMPLES, batch_presence)
+    return torch.bincount(tokens, minlength=VOCAB).float() / SAMPLES
+
+
+@pytest.mark.parametrize("params", [
+    SamplingParams(temperature=0.7),
+    SamplingParams(temperature=1.0, top_k=5),
+    SamplingParams(temperature=1.3, top_p=0.8),
+    SamplingParams(temperature=0.9, top_k=10, top_p=0.9, repetition_penalty=1.3),
+])
+def test_matches_reference_distribution(params):
+    torch.manual_seed(0)
+    generator = torch.Generator().manual_seed(0)
+    logits = torch.randn(VOCAB, generator=generator) * 2
+    presence = torch.zeros(VOCAB, dtype=torch.bool)
+    presence[:8] = True
+
+    expected = _reference_probs(logits, params, presence)
+    actual = _empirical_probs(logits, params, presence)
+    # 被 top-k/top-p 去掉的 token 不会被采样到，其余按概率分布
+    assert not actual[expected == 0].any()
+    assert torch.allclose(actual, expected, atol=0.03)
+
+
+def test_greedy_rows_use_penalized_argmax():
+    logits = torch.tensor([[1.0, 3.0, 2.9, -1.0], [0.5, 0.1, 0.2, 0.3]])
+    presence = torch.tensor([[False, True, False, False], [False] * 4])
+    params = [SamplingParams(temperature=0, repetition_penalty=1.2), SamplingParams(temperature=0)]
+
+    tokens = BatchSampler().sample(logits, params, presence)
+    reference = transformers.RepetitionPenaltyLogitsProcessor(1.2)(torch.tensor([[1]]), logits[:1].clone())
+    assert tokens.tolist() == [reference.argmax().item(), 0]
+
+
+def test_seeded_rows_do_not_depend_on_batch():
+    logits = torch.randn(3, VOCAB)
+    params = [SamplingParams(temperature=1.0, seed=42), SamplingParams(), SamplingParams(temperature=0.5)]
+
+    def run(rows):
+        generators = [params[row].make_generator("cpu") for row in rows]
+        return BatchSampler().sample(logits[rows], [params[row] for row in rows], generators=generators)
+
+    alone = [run([0]).item() for _ in range(3)]
+    assert len(set(alone)) == 1
+    assert run([0, 1, 2])[0].item() == alone[0]
@@ -0,0 +1,109 @@
+"""RequestScheduler 的加权公平排队、优先级抢占和令牌桶配额"""
+
+from model_service.scheduler import RequestInfo, RequestScheduler, Tenant
+
+
+class Admissions:
+    """记录 on_admit 回调的顺序"""
+
+    def __init__(self):
+        self.order = []
+
+    def callback(self, label):
+        return lambda ticket: self.order.append(label)
+
+
+def _submit(scheduler, admissions, label, tenant, cost=100, priority="interactive"):
+    return scheduler.submit(cost, admissions.callback(label), RequestInfo(tenant, priority))
+
+
+def test_fair_queueing_interleaves_tenants():
+    scheduler = RequestScheduler(max_running=1)
+    admissions = Admissions()
+    heavy, light = Tenant("heavy"), Tenant("light")
+    tickets = {label: _submit(scheduler, admissions, label, heavy) for label in ("h1", "h2", "h3")}
+    tickets["l1"] = _submit(scheduler, admissions, "l1", light)
+
+    for _ in range(3):
+        scheduler.release(tickets[admissions.order[-1]])
+    # 后到的 light 不用排在 heavy 的所有请求之后
+    assert admissions.order == ["h1", "l1", "h2", "h3"]
+
+
+def test_weight_scales_share():
+    scheduler = RequestScheduler(max_running=1)
+    admissions = Admissions()
+    blocker = _submit(scheduler, admissions, "blocker", Tenant("blocker"))
+    big, small = Tenant("big", weight=4), Tenant("small", weight=1)
+    tickets = {}
+    for i in range(4):
+        tickets[f"b{i}"] = _submit(scheduler, admissions, f"b{i}", big)
+    tickets["s0"] = _submit(scheduler, admissions, "s0", small)
+
+    scheduler.release(blocker)
+    for _ in range(4):
+        scheduler.release(tickets[admissions.order[-1]])
+    # big 的权重是 small 的 4 倍，前 4 个请求的虚拟完成时间都不晚于 small 的第一个
+    assert admissions.order[1:] == ["b0", "b1", "b2", "b3", "s0"]
+
+
+def test_interactive_preempts_batch():
+    scheduler = RequestScheduler(max_running=1)
+    admissions = Admissions()
+    batch = _submit(scheduler, admissions, "batch", Tenant("offline"), priority="batch")
+    assert batch.state == "running"
+
+    interactive = _submit(scheduler, admissions, "interactive", Tenant("web"))
+    assert interactive.state == "waiting"
+    assert batch.preempt_requested
+
+    assert scheduler.try_checkpoint(batch, 1) is False
+    assert batch.state == "waiting" and interactive.state == "running"
+    assert admissions.order == ["batch", "interactive"]
+
+    scheduler.release(interactive)
+    assert batch.state == "running"
+    assert admissions.order == ["batch", "interactive", "batch"]
+    stats = scheduler.get_stats()["classes"]["batch"]
+    assert stats["preemptions"] == 1
+
+
+def test_interactive_does_not_preempt_interactive():
+    scheduler = RequestScheduler(max_running=1)
+    admissions = Admissions()
+    first = _submit(scheduler, admissions, "first", Tenant("a"))
+    _submit(scheduler, admissions, "second", Tenant("b"))
+    assert not first.preempt_requested
+    assert scheduler.try_checkpoint(first, 1) is True
+
+
+def test_quota_throttles_and_poll_resumes():
+    scheduler = RequestScheduler(max_running=4)
+    admissions = Admissions()
+    tenant = Tenant("limited", tokens_per_second=10, burst=5)
+    ticket = _submit(scheduler, admissions, "limited", tenant)
+
+    assert scheduler.try_checkpoint(ticket, 4) is True
+    assert scheduler.try_checkpoint(ticket, 2) is False
+    assert ticket.state == "waiting" and ticket.throttles == 1
+
+    # 透支 1 个令牌，余额恢复为正约需 0.2 秒
+    delay = scheduler.poll()
+    assert 0 < delay <= 0.2
+    # 令牌桶恢复后 poll 重新调度
+    tenant.bucket.updated -= 1.0
+    assert scheduler.poll() is None
+    assert ticket.state == "running"
+    assert admissions.order == ["limited", "limited"]
+
+
+def test_prefill_checkpoint_charges_quota_without_first_token():
+    scheduler = RequestScheduler(max_running=4)
+    admissions = Admissions()
+    tenant = Tenant("limited", tokens_per_second=10, burst=100)
+    ticket = _submit(scheduler, admissions, "limited", tenant)
+
+    assert scheduler.try_checkpoint(ticket, 0, prefill_tokens=60) is True
+    assert scheduler.try_checkpoint(ticket, 0, prefill_tokens=60) is False
+    assert ticket.first_token_at is None
+    assert ticket.tokens == 0 and tenant.tokens == 120
@@ -0,0 +1,60 @@
+"""字幕时间戳和条目格式，以及 video_subtitle 中复用同一实现的 SubtitleWriter"""
+
+import io
+import os
+import sys
+
+import pytest
+
+from model_service.subtitle_format import format_cue, format_timestamp, iter_subtitles
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "video_subtitle", "src", "py"))
+
+from subtitle_writer import SubtitleWriter, format_from_path  # noqa: E402
+
+
+@pytest.mark.parametrize("seconds, srt, vtt", [
+    (0, "00:00:00,000", "00:00:00.000"),
+    (1.2345, "00:00:01,234", "00:00:01.234"),
+    (59.9996, "00:01:00,000", "00:01:00.000"),
+    (3723.5, "01:02:03,500", "01:02:03.500"),
+    (360000, "100:00:00,000", "100:00:00.000"),
+    (-0.4, "00:00:00,000", "00:00:00.000"),
+])
+def test_format_timestamp(seconds, srt, vtt):
+    assert format_timestamp(seconds, "srt") == srt
+    assert format_timestamp(seconds, "vtt") == vtt
+
+
+def test_format_cue():
+    assert format_cue(3, 1.0, 2.5, "  hello \n", "srt") == "3\n00:00:01,000 --> 00:00:02,500\nhello\n\n"
+    assert format_cue(3, 1.0, 2.5, "hello", "vtt") == "00:00:01.000 --> 00:00:02.500\nhello\n\n"
+
+
+def test_iter_subtitles_numbers_non_empty_segments():
+    segments = [
+        {"start": 0.0, "end": 1.0, "text": "a"},
+        {"start": 1.0, "end": 2.0, "text": "   "},
+        {"start": 2.0, "end": 3.0, "text": "b"},
+    ]
+    srt = "".join(iter_subtitles(segments, "srt"))
+    assert srt == "1\n00:00:00,000 --> 00:00:01,000\na\n\n2\n00:00:02,000 --> 00:00:03,000\nb\n\n"
+    vtt = "".join(iter_subtitles(segments, "vtt"))
+    assert vtt.startswith("WEBVTT\n\n00:00:00.000 --> 00:00:01.000\na\n\n")
+
+
+def test_subtitle_writer_matches_service_output():
+    segments = [{"start": 0.5, "end": 1.5, "text": "a"}, {"start": 2.0, "end": 2.0, "text": ""},
+                {"start": 3.0, "end": 4.25, "text": "b"}]
+    for fmt in ("srt", "vtt"):
+        buffer = io.StringIO()
+        writer = SubtitleWriter(buffer, fmt)
+        for segment in segments:
+            writer.write_segment(segment)
+        assert buffer.getvalue() == "".join(iter_subtitles(segments, fmt))
+
+
+def test_format_from_path():
+    assert format_from_path("movie.VTT") == "vtt"
+    assert format_from_path("movie.srt") == "srt"
+    assert format_from_path("movie.txt") == "srt"
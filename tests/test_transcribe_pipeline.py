@@ -0,0 +1,55 @@
+"""transcribe_pipeline 按静音切分长音频和拼接重叠块"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "video_subtitle", "src", "py"))
+
+from transcribe_pipeline import SAMPLING_RATE, plan_chunks, stitch_chunk, stitch_segments  # noqa: E402
+
+
+def _seconds(*pairs):
+    return [{"start": int(s * SAMPLING_RATE), "end": int(e * SAMPLING_RATE)} for s, e in pairs]
+
+
+def _samples(chunks):
+    return [(s / SAMPLING_RATE, e / SAMPLING_RATE) for s, e in chunks]
+
+
+def test_regions_are_grouped_up_to_chunk_length():
+    regions = _seconds((0, 10), (12, 25), (27, 40), (41, 50))
+    chunks = plan_chunks(regions, 60 * SAMPLING_RATE, chunk_seconds=30)
+    # 每块在静音处开始和结束，不超过 30 秒
+    assert _samples(chunks) == [(0, 25), (27, 50)]
+
+
+def test_long_region_is_cut_into_overlapping_windows():
+    chunks = plan_chunks(_seconds((5, 75)), 80 * SAMPLING_RATE, chunk_seconds=30, overlap_seconds=2)
+    assert _samples(chunks) == [(5, 35), (33, 63), (61, 75)]
+    assert all(end - start <= 30 * SAMPLING_RATE for start, end in chunks)
+
+
+def test_no_speech_regions_cover_whole_audio():
+    assert plan_chunks([], 20 * SAMPLING_RATE) == [(0, 20 * SAMPLING_RATE)]
+
+
+def test_region_end_is_clamped_to_audio_length():
+    assert _samples(plan_chunks(_seconds((0, 12)), 10 * SAMPLING_RATE)) == [(0, 10)]
+
+
+def test_overlap_is_split_at_its_middle():
+    chunks = plan_chunks(_seconds((0, 58)), 58 * SAMPLING_RATE, chunk_seconds=30, overlap_seconds=2)
+    assert _samples(chunks) == [(0, 30), (28, 58)]
+
+    first = [{"start": 26.0, "end": 28.5, "text": "a"}, {"start": 28.5, "end": 30.0, "text": "b"}]
+    second = [{"start": 28.6, "end": 29.9, "text": "b"}, {"start": 30.0, "end": 31.0, "text": "c"}]
+    # 重叠区间 28-30 秒的中点是 29 秒，按片段中点归属
+    assert [s["text"] for s in stitch_chunk(first, chunks, 0)] == ["a"]
+    assert [s["text"] for s in stitch_chunk(second, chunks, 1)] == ["b", "c"]
+    assert [s["text"] for s in stitch_segments([first, second], chunks)] == ["a", "b", "c"]
+
+
+def test_chunks_without_overlap_keep_all_segments():
+    chunks = [(0, 10 * SAMPLING_RATE), (12 * SAMPLING_RATE, 20 * SAMPLING_RATE)]
+    segments = [{"start": 9.5, "end": 11.0, "text": "edge"}]
+    assert stitch_chunk(segments, chunks, 0) == segments
@@ -0,0 +1,131 @@
+"""视觉编码缓存：用随机初始化的微型 Qwen3-VL 对同一张图片多次提问"""
+
+import re
+import threading
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+if not hasattr(transformers, "Qwen3VLForConditionalGeneration"):
+    pytest.skip("transformers 版本不支持 Qwen3-VL", allow_module_level=True)
+
+from model_service.vl_manager import VLModelManager  # noqa: E402
+
+PAD, IMAGE, VISION_START, VISION_END = 0, 100, 102, 103
+SPECIAL_TOKENS = {"<|image_pad|>": IMAGE, "<|vision_start|>": VISION_START, "<|vision_end|>": VISION_END}
+
+
+class TinyTokenizer:
+    """字符级 tokenizer，特殊 token 使用模型配置中的 id，左侧 padding"""
+
+    padding_side = "left"
+
+    def _encode(self, text):
+        ids = []
+        for piece in re.split(r"(<\|[a-z_]+\|>)", text):
+            if piece in SPECIAL_TOKENS:
+                ids.append(SPECIAL_TOKENS[piece])
+            else:
+                ids.extend(ord(ch) % 90 + 1 for ch in piece)
+        return ids
+
+    def __call__(self, texts, padding=True, return_tensors="pt"):
+        rows = [self._encode(text) for text in texts]
+        width = max(len(row) for row in rows)
+        input_ids = torch.tensor([[PAD] * (width - len(row)) + row for row in rows])
+        attention_mask = torch.tensor([[0] * (width - len(row)) + [1] * len(row) for row in rows])
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+
+class TinyProcessor:
+    """只提供 VLModelManager 用到的处理器接口，图片处理使用真实的 Qwen2VLImageProcessor"""
+
+    image_token = "<|image_pad|>"
+
+    def __init__(self):
+        self.image_processor = transformers.Qwen2VLImageProcessor(
+            patch_size=16, merge_size=2, temporal_patch_size=2,
+        )
+        self.tokenizer = TinyTokenizer()
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        prompt = messages[0]["content"][1]["text"]
+        return f"<|vision_start|>{self.image_token}<|vision_end|>{prompt}:"
+
+    def batch_decode(self, token_ids, skip_special_tokens=True):
+        return [" ".join(str(t) for t in row.tolist()) for row in token_ids]
+
+
+def _tiny_model():
+    torch.manual_seed(0)
+    config = transformers.Qwen3VLConfig(
+        text_config=dict(
+            vocab_size=128, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+            num_attention_heads=4, num_key_value_heads=2, head_dim=8, max_position_embeddings=512,
+            rope_scaling={"rope_type": "default", "mrope_section": [1, 1, 2], "mrope_interleaved": True},
+        ),
+        vision_config=dict(
+            depth=2, hidden_size=32, intermediate_size=64, num_heads=4, out_hidden_size=32,
+            patch_size=16, spatial_merge_size=2, temporal_patch_size=2, in_channels=3,
+            deepstack_visual_indexes=[0], num_position_embeddings=64,
+        ),
+        image_token_id=IMAGE, video_token_id=101, vision_start_token_id=VISION_START,
+        vision_end_token_id=VISION_END,
+    )
+    model = transformers.Qwen3VLForConditionalGeneration(config).eval()
+    model.generation_config.pad_token_id = PAD
+    return model
+
+
+def _manager(model, cached):
+    """不经过 from_pretrained 的管理器，cached 为 False 时不安装视觉编码缓存，作为对照"""
+    manager = VLModelManager(model_name="tiny-qwen3-vl", max_wait_ms=50, max_pixels=448 * 448)
+    manager.model = model
+    manager.processor = TinyProcessor()
+    manager.device = "cpu"
+    if cached:
+        manager.vision_cache.install(model)
+    manager._worker = threading.Thread(target=manager._batch_loop, daemon=True)
+    manager._worker.start()
+    manager.is_loaded = True
+    return manager
+
+
+@pytest.fixture(scope="module")
+def image():
+    from PIL import Image
+
+    generator = torch.Generator().manual_seed(1)
+    pixels = (torch.rand(300, 400, 3, generator=generator) * 255).to(torch.uint8).numpy()
+    return Image.fromarray(pixels)
+
+
+@pytest.fixture(scope="module")
+def model():
+    return _tiny_model()
+
+
+def _ask(manager, image, prompts):
+    futures = manager.submit_many(image, prompts, max_new_tokens=4, digest="same-image")
+    return [future.result(timeout=60) for future in futures]
+
+
+def test_many_questions_on_one_image_share_encoding(model, image):
+    prompts = ["what", "where is it", "count"]
+    reference = _ask(_manager(model, cached=False), image, prompts)
+
+    manager = _manager(model, cached=True)
+    assert _ask(manager, image, prompts) == reference
+    stats = manager.vision_cache.cache.get_stats()
+    # 同一批中的同一张图片只运行一次视觉编码器
+    assert stats["misses"] == 1 and stats["hits"] == len(prompts) - 1
+
+
+def test_asking_again_hits_cache(model, image):
+    reference = _ask(_manager(model, cached=False), image, ["what"])
+
+    manager = _manager(model, cached=True)
+    assert _ask(manager, image, ["what"]) == reference
+    assert manager.generate(image, "what", max_new_tokens=4, digest="same-image") == reference[0]
+    assert manager.vision_cache.cache.get_stats()["hits"] >= 1
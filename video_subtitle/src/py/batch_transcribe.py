@@ -0,0 +1,325 @@
+"""
+Batched Whisper decoding across multiple audio files.
+
+Every file is decoded and split with VAD into windows of at most 30 seconds.
+Windows from all files are interleaved and packed into fixed-size batches, so
+a single encoder pass and a single decoder call serve several files at once.
+Results are routed back to their file by index and stitched into per-file
+segments with absolute timestamps.
+
+Each batch's compute time is attributed to its windows in proportion to their
+audio length, giving a per-file real-time factor (RTF = processing seconds /
+audio seconds) next to the aggregate wall-clock RTF.
+
+Usage:
+    python batch_transcribe.py ep01.m4a ep02.m4a ... [--batch-size 8] [--output-dir subs]
+
+Benchmark batch sizes on CPU:
+    python batch_transcribe.py ep01.m4a ep02.m4a --device cpu --benchmark 1,2,4,8,16
+"""
+
+import os
+import sys
+import time
+import argparse
+from itertools import zip_longest
+
+import numpy as np
+
+from transcribe_pipeline import SAMPLING_RATE, select_device, plan_chunks, stitch_chunk
+from subtitle_writer import SubtitleWriter
+
+# Whisper always encodes 30-second windows (3000 mel frames)
+WINDOW_SECONDS = 30.0
+WINDOW_SAMPLES = int(WINDOW_SECONDS * SAMPLING_RATE)
+N_FRAMES = 3000
+# Duration of one timestamp token step
+TIME_PRECISION = 0.02
+
+
+class AudioFile:
+    """One input file: decoded audio, its windows and the results routed back to it."""
+
+    def __init__(self, index, path, audio, chunks):
+        self.index = index
+        self.path = path
+        self.audio = audio
+        self.chunks = chunks
+        self.duration = len(audio) / SAMPLING_RATE
+        self.results = [None] * len(chunks)
+        self.decode_seconds = 0.0
+        self.compute_seconds = 0.0
+        self.finished_at = None
+
+    @property
+    def done(self):
+        return all(result is not None for result in self.results)
+
+    def segments(self):
+        segments = []
+        for i, result in enumerate(self.results):
+            segments.extend(stitch_chunk(result, self.chunks, i))
+        return segments
+
+
+def split_timestamps(tokens, tokenizer, offset, window_end):
+    """
+    Turn a token sequence with timestamp tokens into segments.
+
+    Whisper emits <|t_start|> text <|t_end|> pairs; text after the last
+    timestamp is closed at the end of the window.
+    """
+    segments = []
+    start = None
+    last_time = offset
+    text_tokens = []
+    for token in tokens:
+        if token >= tokenizer.timestamp_begin:
+            time_seconds = offset + (token - tokenizer.timestamp_begin) * TIME_PRECISION
+            last_time = time_seconds
+            if text_tokens:
+                segments.append({
+                    "start": start if start is not None else offset,
+                    "end": min(time_seconds, window_end),
+                    "text": tokenizer.decode(text_tokens).strip(),
+                })
+                text_tokens = []
+                start = None
+            else:
+                start = time_seconds
+        else:
+            text_tokens.append(token)
+    if text_tokens:
+        segments.append({
+            "start": start if start is not None else last_time,
+            "end": window_end,
+            "text": tokenizer.decode(text_tokens).strip(),
+        })
+    return [segment for segment in segments if segment["text"]]
+
+
+class BatchedTranscriber:
+    """Pack 30-second windows from several files into shared encoder/decoder batches."""
+
+    def __init__(self, model_size="medium", device="auto", compute_type="auto", batch_size=8,
+                 beam_size=5, language=None, cpu_threads=0):
+        """
+        Args:
+            model_size: Whisper model size or path
+            device: "cuda", "cpu" or "auto"
+            compute_type: CTranslate2 compute type, "auto" picks float16 on CUDA and int8 on CPU
+            batch_size: windows per encoder/decoder batch
+            beam_size: beam size for decoding
+            language: language code for every file, None to detect per window
+            cpu_threads: CPU threads for CTranslate2, 0 for its default
+        """
+        from faster_whisper import WhisperModel
+
+        self.device, self.compute_type = select_device(device, compute_type)
+        self.model = WhisperModel(
+            model_size, device=self.device, compute_type=self.compute_type, cpu_threads=cpu_threads
+        )
+        self.batch_size = batch_size
+        self.beam_size = beam_size
+        self.language = language
+        self._tokenizers = {}
+
+    def _tokenizer(self, language):
+        from faster_whisper.tokenizer import Tokenizer
+
+        if language not in self._tokenizers:
+            self._tokenizers[language] = Tokenizer(
+                self.model.hf_tokenizer, self.model.model.is_multilingual,
+                task="transcribe", language=language,
+            )
+        return self._tokenizers[language]
+
+    def load(self, paths):
+        """Decode every file and plan its windows."""
+        from faster_whisper.audio import decode_audio
+        from faster_whisper.vad import get_speech_timestamps, VadOptions
+
+        files = []
+        for index, path in enumerate(paths):
+            start = time.monotonic()
+            audio = decode_audio(path, sampling_rate=SAMPLING_RATE)
+            speech = get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=500))
+            chunks = plan_chunks(speech, len(audio), WINDOW_SECONDS, overlap_seconds=1.0)
+            audio_file = AudioFile(index, path, audio, chunks)
+            audio_file.decode_seconds = time.monotonic() - start
+            files.append(audio_file)
+        return files
+
+    def _windows(self, files):
+        """Interleave windows across files so each batch mixes files: (file, chunk index) pairs."""
+        per_file = [[(f, i) for i in range(len(f.chunks))] for f in files]
+        for group in zip_longest(*per_file):
+            for window in group:
+                if window is not None:
+                    yield window
+
+    def _features(self, audio_file, chunk_index):
+        start, end = audio_file.chunks[chunk_index]
+        window = np.zeros(WINDOW_SAMPLES, dtype=np.float32)
+        window[:end - start] = audio_file.audio[start:end]
+        return self.model.feature_extractor(window)[:, :N_FRAMES]
+
+    def _run_batch(self, batch):
+        """Encode and decode one batch of windows and route the segments back per file."""
+        features = np.stack([self._features(f, i) for f, i in batch])
+        encoder_output = self.model.encode(features)
+
+        if self.language is None and self.model.model.is_multilingual:
+            detected = self.model.model.detect_language(encoder_output)
+            languages = [result[0][0][2:-2] for result in detected]
+        else:
+            languages = [self.language or "en"] * len(batch)
+
+        tokenizers = [self._tokenizer(language) for language in languages]
+        prompts = [list(tokenizer.sot_sequence) for tokenizer in tokenizers]
+        results = self.model.model.generate(
+            encoder_output,
+            prompts,
+            beam_size=self.beam_size,
+            max_length=448,
+            suppress_blank=True,
+            suppress_tokens=[-1],
+        )
+
+        for (audio_file, chunk_index), tokenizer, result in zip(batch, tokenizers, results):
+            start, end = audio_file.chunks[chunk_index]
+            audio_file.results[chunk_index] = split_timestamps(
+                result.sequences_ids[0], tokenizer, start / SAMPLING_RATE, end / SAMPLING_RATE
+            )
+
+    def transcribe_files(self, paths):
+        """
+        Transcribe several files with shared batches.
+
+        Returns:
+            (files, stats): the AudioFile objects with results filled in, and
+            aggregate statistics
+        """
+        load_start = time.monotonic()
+        files = self.load(paths)
+        load_seconds = time.monotonic() - load_start
+
+        start = time.monotonic()
+        batch = []
+        windows = list(self._windows(files))
+        for n, window in enumerate(windows):
+            batch.append(window)
+            if len(batch) < self.batch_size and n + 1 < len(windows):
+                continue
+
+            batch_start = time.monotonic()
+            self._run_batch(batch)
+            batch_seconds = time.monotonic() - batch_start
+
+            # Attribute the batch time to files by the audio length of their windows
+            lengths = [f.chunks[i][1] - f.chunks[i][0] for f, i in batch]
+            total = sum(lengths) or 1
+            for (audio_file, _), length in zip(batch, lengths):
+                audio_file.compute_seconds += batch_seconds * length / total
+                if audio_file.finished_at is None and audio_file.done:
+                    audio_file.finished_at = time.monotonic() - start
+            batch = []
+
+        elapsed = time.monotonic() - start
+        audio_seconds = sum(f.duration for f in files)
+        stats = {
+            "files": len(files),
+            "windows": len(windows),
+            "batch_size": self.batch_size,
+            "audio_seconds": audio_seconds,
+            "decode_seconds": load_seconds,
+            "transcribe_seconds": elapsed,
+            "rtf": elapsed / audio_seconds if audio_seconds else 0.0,
+            "rtf_with_decode": (elapsed + load_seconds) / audio_seconds if audio_seconds else 0.0,
+        }
+        return files, stats
+
+
+def print_report(files, stats):
+    print("-" * 70)
+    print(f"{'file':<36} {'audio':>8} {'compute':>8} {'RTF':>7} {'ready':>8}")
+    for f in files:
+        rtf = f.compute_seconds / f.duration if f.duration else 0.0
+        ready = f.finished_at or 0.0
+        print(f"{os.path.basename(f.path)[:36]:<36} {f.duration:>7.1f}s {f.compute_seconds:>7.1f}s "
+              f"{rtf:>7.3f} {ready:>7.1f}s")
+    print("-" * 70)
+    print(f"{stats['files']} files, {stats['windows']} windows, batch size {stats['batch_size']}")
+    print(f"Audio: {stats['audio_seconds']:.1f}s, decode: {stats['decode_seconds']:.1f}s, "
+          f"transcribe: {stats['transcribe_seconds']:.1f}s")
+    print(f"Aggregate RTF: {stats['rtf']:.3f} (with audio decoding: {stats['rtf_with_decode']:.3f})")
+
+
+def run_benchmark(args, batch_sizes):
+    """Transcribe the same files once per batch size and compare throughput."""
+    rows = []
+    for batch_size in batch_sizes:
+        transcriber = BatchedTranscriber(
+            args.model, args.device, args.compute_type, batch_size,
+            args.beam_size, args.language, args.cpu_threads,
+        )
+        _, stats = transcriber.transcribe_files(args.audio)
+        rows.append(stats)
+        print(f"batch size {batch_size:>3}: RTF {stats['rtf']:.3f} ({stats['transcribe_seconds']:.1f}s)")
+
+    print("-" * 70)
+    print(f"Device: {transcriber.device} ({transcriber.compute_type}), "
+          f"{rows[0]['files']} files, {rows[0]['audio_seconds']:.1f}s of audio")
+    print(f"{'batch size':>10} {'seconds':>10} {'RTF':>8} {'speedup':>8}")
+    for stats in rows:
+        speedup = rows[0]["transcribe_seconds"] / stats["transcribe_seconds"] if stats["transcribe_seconds"] else 0.0
+        print(f"{stats['batch_size']:>10} {stats['transcribe_seconds']:>10.1f} {stats['rtf']:>8.3f} {speedup:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched Whisper transcription across multiple files")
+    parser.add_argument("audio", nargs="+", help="Audio or video files to transcribe")
+    parser.add_argument("--model", default="medium", help="Whisper model size or path (default: medium)")
+    parser.add_argument("--language", default=None, help="Language code for all files, e.g. zh (default: detect)")
+    parser.add_argument("--device", default="auto", choices=["auto", "cuda", "cpu"], help="Inference device (default: auto)")
+    parser.add_argument("--compute-type", default="auto", help="CTranslate2 compute type (default: float16 on CUDA, int8 on CPU)")
+    parser.add_argument("--cpu-threads", type=int, default=0, help="CPU threads (default: CTranslate2 default)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Windows per batch (default: 8)")
+    parser.add_argument("--beam-size", type=int, default=5, help="Beam size (default: 5)")
+    parser.add_argument("--output-dir", default=None, help="Write one .srt per file into this directory")
+    parser.add_argument("--benchmark", default=None, help="Comma-separated batch sizes to compare, e.g. 1,2,4,8")
+    args = parser.parse_args()
+
+    missing = [path for path in args.audio if not os.path.exists(path)]
+    if missing:
+        sys.exit("Audio file not found: " + ", ".join(missing))
+
+    if args.benchmark:
+        run_benchmark(args, [int(size) for size in args.benchmark.split(",")])
+        return
+
+    transcriber = BatchedTranscriber(
+        args.model, args.device, args.compute_type, args.batch_size,
+        args.beam_size, args.language, args.cpu_threads,
+    )
+    print(f"Transcribing {len(args.audio)} files with {args.model} on {transcriber.device} "
+          f"({transcriber.compute_type}), batch size {args.batch_size}")
+    files, stats = transcriber.transcribe_files(args.audio)
+
+    for f in files:
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            name = os.path.splitext(os.path.basename(f.path))[0] + ".srt"
+            with SubtitleWriter.open(os.path.join(args.output_dir, name)) as writer:
+                for segment in f.segments():
+                    writer.write_segment(segment)
+        else:
+            print(f"\n{f.path}")
+            for segment in f.segments():
+                print(f"{segment['start']:.2f} {segment['end']:.2f} {segment['text']}")
+
+    print_report(files, stats)
+
+
+if __name__ == "__main__":
+    main()
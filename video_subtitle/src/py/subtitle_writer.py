@@ -0,0 +1,101 @@
+"""
+Incremental SRT / VTT subtitle writer.
+
+Cues are written and flushed one at a time, so a subtitle file can be
+opened while faster-whisper's segment generator is still running and
+already shows the first minutes of the video.
+
+Usage:
+    python subtitle_writer.py audio.m4a [--output audio.srt] [--model medium] [--language zh]
+"""
+
+import os
+import sys
+import argparse
+
+try:
+    from model_service.subtitle_format import SUBTITLE_FORMATS, format_cue, subtitle_header
+except ImportError:
+    # Not installed as a package: use the formatting shared with the service from the repo's src/py
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "src", "py"))
+    from model_service.subtitle_format import SUBTITLE_FORMATS, format_cue, subtitle_header
+
+
+def format_from_path(path):
+    """Subtitle format from a file extension, defaulting to SRT."""
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    return ext if ext in SUBTITLE_FORMATS else "srt"
+
+
+class SubtitleWriter:
+    """Write cues to a text file object as segments arrive."""
+
+    def __init__(self, fileobj, fmt="srt"):
+        if fmt not in SUBTITLE_FORMATS:
+            raise ValueError(f"Unknown subtitle format: {fmt}")
+        self.fileobj = fileobj
+        self.fmt = fmt
+        self.count = 0
+        self.fileobj.write(subtitle_header(fmt))
+        self.fileobj.flush()
+
+    @classmethod
+    def open(cls, path, fmt=None):
+        """Open a subtitle file for writing, picking the format from the extension if not given."""
+        return cls(open(path, "w", encoding="utf-8"), fmt or format_from_path(path))
+
+    def write(self, start, end, text):
+        """Write one cue and flush it to disk."""
+        if not text.strip():
+            return
+        self.count += 1
+        self.fileobj.write(format_cue(self.count, start, end, text, self.fmt))
+        self.fileobj.flush()
+
+    def write_segment(self, segment):
+        """Write a faster-whisper Segment or a {"start", "end", "text"} dict."""
+        if isinstance(segment, dict):
+            self.write(segment["start"], segment["end"], segment["text"])
+        else:
+            self.write(segment.start, segment.end, segment.text)
+
+    def close(self):
+        self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write subtitles while faster-whisper transcribes")
+    parser.add_argument("audio", help="Audio or video file to transcribe")
+    parser.add_argument("--output", default=None, help="Subtitle file, .srt or .vtt (default: audio name + .srt)")
+    parser.add_argument("--model", default="medium", help="Whisper model size or path (default: medium)")
+    parser.add_argument("--language", default=None, help="Language code, e.g. zh (default: detect)")
+    parser.add_argument("--device", default="auto", choices=["auto", "cuda", "cpu"], help="Inference device (default: auto)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.audio):
+        sys.exit("Audio file not found: " + args.audio)
+    output = args.output or os.path.splitext(args.audio)[0] + ".srt"
+
+    from faster_whisper import WhisperModel
+    from transcribe_pipeline import select_device
+
+    device, compute_type = select_device(args.device)
+    model = WhisperModel(args.model, device=device, compute_type=compute_type)
+    segments, info = model.transcribe(args.audio, language=args.language, vad_filter=True)
+    print(f"Writing {output} ({info.language}, {info.duration:.0f}s of audio)")
+
+    # segments is a generator: each cue is written as soon as it is decoded
+    with SubtitleWriter.open(output) as writer:
+        for segment in segments:
+            writer.write_segment(segment)
+            print(f"{segment.start:.2f} {segment.end:.2f} {segment.text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Chunked, parallel long-audio transcription with faster-whisper.
+
+The audio is decoded once, split into chunks at silences found by VAD, and
+the chunks are transcribed across a pool of worker processes, each holding
+its own WhisperModel. Speech regions longer than one chunk are cut into
+overlapping windows; segments are shifted back to absolute timestamps and
+the overlaps are resolved at the middle of each overlap.
+
+Without CUDA the model runs on CPU with int8 compute, and the cores are
+divided between the workers, so throughput scales with the core count.
+
+Usage:
+    python transcribe_pipeline.py audio.m4a [--model medium] [--language zh] [--workers 4] [--output audio.srt]
+"""
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from subtitle_writer import SubtitleWriter
+
+SAMPLING_RATE = 16000
+
+# Model held by each worker process, created once by _init_worker
+_worker_model = None
+
+
+def select_device(device="auto", compute_type="auto"):
+    """Pick CUDA with float16 when available, otherwise CPU with int8."""
+    if device == "auto":
+        try:
+            import ctranslate2
+            device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+        except Exception:
+            device = "cpu"
+    if compute_type == "auto":
+        compute_type = "float16" if device == "cuda" else "int8"
+    return device, compute_type
+
+
+def plan_chunks(speech_regions, total_samples, chunk_seconds=30.0, overlap_seconds=2.0):
+    """
+    Group VAD speech regions into chunks of at most chunk_seconds.
+
+    Chunks start and end in silence where possible. A single speech region
+    longer than a chunk is cut into windows that overlap by overlap_seconds.
+
+    Args:
+        speech_regions: list of {"start": sample, "end": sample} from VAD
+        total_samples: length of the audio in samples
+        chunk_seconds: maximum chunk length
+        overlap_seconds: overlap between windows of one long speech region
+
+    Returns:
+        list of (start_sample, end_sample) tuples in time order
+    """
+    chunk_len = int(chunk_seconds * SAMPLING_RATE)
+    overlap = int(overlap_seconds * SAMPLING_RATE)
+    if not speech_regions:
+        speech_regions = [{"start": 0, "end": total_samples}]
+
+    chunks = []
+    current = None
+    for region in speech_regions:
+        start, end = region["start"], min(region["end"], total_samples)
+        if current is not None and end - current[0] <= chunk_len:
+            current = (current[0], end)
+            continue
+        if current is not None:
+            chunks.append(current)
+            current = None
+        if end - start <= chunk_len:
+            current = (start, end)
+            continue
+        # Long region: overlapping fixed windows
+        window_start = start
+        while end - window_start > chunk_len:
+            chunks.append((window_start, window_start + chunk_len))
+            window_start += chunk_len - overlap
+        current = (window_start, end)
+    if current is not None:
+        chunks.append(current)
+    return chunks
+
+
+def _init_worker(model_size, device, compute_type, cpu_threads):
+    global _worker_model
+    from faster_whisper import WhisperModel
+
+    _worker_model = WhisperModel(
+        model_size, device=device, compute_type=compute_type, cpu_threads=cpu_threads
+    )
+
+
+def _transcribe_chunk(audio, offset_seconds, language, beam_size):
+    """Transcribe one chunk in a worker and return segments with absolute times."""
+    segments, _ = _worker_model.transcribe(
+        audio, language=language, beam_size=beam_size, vad_filter=False
+    )
+    return [
+        {
+            "start": offset_seconds + segment.start,
+            "end": offset_seconds + segment.end,
+            "text": segment.text.strip(),
+        }
+        for segment in segments
+    ]
+
+
+def _overlap_bounds(chunks, i):
+    """Time range (seconds) in which chunk i owns segments: the middle of each overlap."""
+    lower = float("-inf")
+    upper = float("inf")
+    if i > 0 and chunks[i - 1][1] > chunks[i][0]:
+        lower = (chunks[i][0] + chunks[i - 1][1]) / 2 / SAMPLING_RATE
+    if i + 1 < len(chunks) and chunks[i][1] > chunks[i + 1][0]:
+        upper = (chunks[i + 1][0] + chunks[i][1]) / 2 / SAMPLING_RATE
+    return lower, upper
+
+
+def stitch_chunk(segments, chunks, i):
+    """
+    Keep the segments of chunk i that it owns.
+
+    Where two chunks overlap, segments are kept from the earlier chunk up to
+    the middle of the overlap and from the later chunk after it, judged by
+    each segment's midpoint, so speech in the overlap is not duplicated.
+    """
+    lower, upper = _overlap_bounds(chunks, i)
+    return [s for s in segments if lower <= (s["start"] + s["end"]) / 2 < upper]
+
+
+def stitch_segments(chunk_results, chunks):
+    """Merge per-chunk segments into one list in time order."""
+    stitched = []
+    for i, segments in enumerate(chunk_results):
+        stitched.extend(stitch_chunk(segments, chunks, i))
+    return stitched
+
+
+class TranscriptionPipeline:
+    """VAD chunking plus a process pool of faster-whisper models."""
+
+    def __init__(self, model_size="medium", device="auto", compute_type="auto",
+                 workers=None, cpu_threads=None, chunk_seconds=30.0, overlap_seconds=2.0,
+                 beam_size=5):
+        """
+        Args:
+            model_size: Whisper model size or path
+            device: "cuda", "cpu" or "auto"
+            compute_type: CTranslate2 compute type, "auto" picks float16 on CUDA and int8 on CPU
+            workers: number of worker processes (default: 1 on CUDA, cores // 4 on CPU)
+            cpu_threads: threads per worker (default: cores divided evenly between workers)
+            chunk_seconds: maximum chunk length
+            overlap_seconds: overlap between windows of one long speech region
+            beam_size: beam size for decoding
+        """
+        self.model_size = model_size
+        self.device, self.compute_type = select_device(device, compute_type)
+        cores = os.cpu_count() or 1
+        if workers is None:
+            workers = 1 if self.device == "cuda" else max(1, cores // 4)
+        self.workers = workers
+        self.cpu_threads = cpu_threads or max(1, cores // workers)
+        self.chunk_seconds = chunk_seconds
+        self.overlap_seconds = overlap_seconds
+        self.beam_size = beam_size
+        self._executor = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        """Start the worker processes; each loads the model once."""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.model_size, self.device, self.compute_type, self.cpu_threads),
+            )
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def split(self, audio_path):
+        """Decode the audio and plan chunks. Returns (audio, chunks)."""
+        from faster_whisper.audio import decode_audio
+        from faster_whisper.vad import get_speech_timestamps, VadOptions
+
+        audio = decode_audio(audio_path, sampling_rate=SAMPLING_RATE)
+        speech = get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=500))
+        return audio, plan_chunks(speech, len(audio), self.chunk_seconds, self.overlap_seconds)
+
+    def iter_transcribe(self, audio_path, language=None):
+        """
+        Transcribe a file, yielding stitched segments in time order.
+
+        Chunks are transcribed in parallel; segments are yielded as soon as
+        every earlier chunk has finished.
+        """
+        self.start()
+        audio, chunks = self.split(audio_path)
+        futures = [
+            self._executor.submit(
+                _transcribe_chunk, audio[start:end], start / SAMPLING_RATE, language, self.beam_size
+            )
+            for start, end in chunks
+        ]
+        # Ownership of each chunk only depends on the chunk boundaries, so a
+        # chunk's segments can be yielded as soon as it and all earlier ones finish
+        for i, future in enumerate(futures):
+            yield from stitch_chunk(future.result(), chunks, i)
+
+    def transcribe(self, audio_path, language=None):
+        """Transcribe a file and return the stitched segments."""
+        return list(self.iter_transcribe(audio_path, language))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunked, parallel transcription with faster-whisper")
+    parser.add_argument("audio", help="Audio or video file to transcribe")
+    parser.add_argument("--model", default="medium", help="Whisper model size or path (default: medium)")
+    parser.add_argument("--language", default=None, help="Language code, e.g. zh (default: detect per chunk)")
+    parser.add_argument("--device", default="auto", choices=["auto", "cuda", "cpu"], help="Inference device (default: auto)")
+    parser.add_argument("--compute-type", default="auto", help="CTranslate2 compute type (default: float16 on CUDA, int8 on CPU)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: 1 on CUDA, cores // 4 on CPU)")
+    parser.add_argument("--cpu-threads", type=int, default=None, help="Threads per worker (default: cores / workers)")
+    parser.add_argument("--chunk-seconds", type=float, default=30.0, help="Maximum chunk length (default: 30)")
+    parser.add_argument("--overlap-seconds", type=float, default=2.0, help="Overlap when splitting long speech (default: 2)")
+    parser.add_argument("--beam-size", type=int, default=5, help="Beam size (default: 5)")
+    parser.add_argument("--output", default=None, help="Write subtitles incrementally to this .srt or .vtt file")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.audio):
+        sys.exit("Audio file not found: " + args.audio)
+
+    pipeline = TranscriptionPipeline(
+        model_size=args.model, device=args.device, compute_type=args.compute_type,
+        workers=args.workers, cpu_threads=args.cpu_threads, chunk_seconds=args.chunk_seconds,
+        overlap_seconds=args.overlap_seconds, beam_size=args.beam_size,
+    )
+    print(f"Transcribing {args.audio} with {args.model} on {pipeline.device} ({pipeline.compute_type}), "
+          f"{pipeline.workers} workers x {pipeline.cpu_threads} threads")
+
+    writer = SubtitleWriter.open(args.output) if args.output else None
+    start = time.monotonic()
+    try:
+        with pipeline:
+            for segment in pipeline.iter_transcribe(args.audio, args.language):
+                if writer is not None:
+                    writer.write_segment(segment)
+                print(f"{segment['start']:.2f} {segment['end']:.2f} {segment['text']}")
+    finally:
+        if writer is not None:
+            writer.close()
+    elapsed = time.monotonic() - start
+    print(f"Elapsed: {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,40 +15,121 @@ Usage:
     # Visual question answering
     answer = client.answer_question("path/to/image.jpg", "What is in this image?")
     print(answer)
+
+    # Several questions about one image, uploaded once
+    answers = client.analyze_many("path/to/image.jpg", ["What is this?", "What color is it?"])
 """
 
+import io
+import json
 import base64
+import threading
 import requests
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional, Union
+from typing import Iterator, List, Optional, Union
 
 
 class Qwen3VLClient:
     """Client for Qwen3-VL-4B model via vLLM API."""
 
-    def __init__(self, base_url="http://localhost:8000", model="Qwen/Qwen2-VL-2B-Instruct-AWQ", timeout=120):
+    def __init__(self, base_url="http://localhost:8000", model="Qwen/Qwen2-VL-2B-Instruct-AWQ", timeout=120,
+                 max_pixels=None, payload_cache_size=32, image_transport="base64"):
         """Initialize the client.
 
         Args:
             base_url: Base URL of the vLLM API server
             timeout: Request timeout in seconds
+            max_pixels: If set, images larger than this pixel count are downscaled
+                before upload (requires Pillow)
+            payload_cache_size: Number of encoded image payloads kept in memory, so
+                asking several questions about one image reads and encodes it once
+            image_transport: How images reach the server:
+                "base64" - data URL in the JSON body (works with vLLM)
+                "binary" - raw bytes streamed from disk to the model service /upload route
+                "path"   - file:// reference for a model service on the same machine
         """
+        if image_transport not in ("base64", "binary", "path"):
+            raise ValueError(f"Unknown image transport: {image_transport}")
         self.base_url = base_url.rstrip("/")
         self.timeout = timeout
         self.model = model
+        self.image_transport = image_transport
+        self.max_pixels = max_pixels
+        self.payload_cache_size = payload_cache_size
+        self._payload_cache = OrderedDict()
+        self._payload_lock = threading.Lock()
 
     def _get_image_payload(self, image_path: Union[str, Path]) -> dict:
-        """Read image and return API payload object."""
+        """Read image and return API payload object.
+
+        Payloads are cached by path, modification time and size, so repeated
+        questions about the same file skip reading, resizing and encoding.
+        """
         path = Path(image_path)
         if not path.exists():
             raise FileNotFoundError(f"Image file not found: {image_path}")
 
+        if self.image_transport == "path":
+            return {
+                "type": "image_url",
+                "image_url": {"url": f"file://{path.resolve()}"}
+            }
+
+        stat = path.stat()
+        key = (str(path.resolve()), stat.st_mtime_ns, stat.st_size, self.max_pixels)
+        with self._payload_lock:
+            payload = self._payload_cache.get(key)
+            if payload is not None:
+                self._payload_cache.move_to_end(key)
+                return payload
+
+        payload = self._encode_image(path)
+
+        if self.payload_cache_size > 0:
+            with self._payload_lock:
+                self._payload_cache[key] = payload
+                while len(self._payload_cache) > self.payload_cache_size:
+                    self._payload_cache.popitem(last=False)
+        return payload
+
+    @staticmethod
+    def _mime_type(path: Path) -> str:
         suffix = path.suffix.lower()
         mime = "image/png" if suffix == ".png" else "image/jpeg"
         if suffix == ".webp": mime = "image/webp"
+        return mime
+
+    def _downscaled_bytes(self, path: Path) -> Optional[bytes]:
+        """Return JPEG bytes of the image downscaled to max_pixels, or None if it already fits."""
+        if not self.max_pixels:
+            return None
+
+        from PIL import Image
+
+        with Image.open(path) as image:
+            width, height = image.size
+            if width * height <= self.max_pixels:
+                return None
+            scale = (self.max_pixels / (width * height)) ** 0.5
+            image = image.convert("RGB").resize(
+                (max(1, int(width * scale)), max(1, int(height * scale))), Image.BICUBIC
+            )
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        return buffer.getvalue()
+
+    def _encode_image(self, path: Path) -> dict:
+        """Encode an image file as a data URL payload, downscaling it if needed."""
+        mime = self._mime_type(path)
+        data = self._downscaled_bytes(path)
+        if data is not None:
+            mime = "image/jpeg"
+        else:
+            with open(path, "rb") as f:
+                data = f.read()
 
-        with open(path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode("utf-8")
+        b64 = base64.b64encode(data).decode("utf-8")
 
         return {
             "type": "image_url",
@@ -100,22 +181,13 @@ class Qwen3VLClient:
         Returns:
             Generated image caption
         """
-        image_payload = self._get_image_payload(image_path)
-
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    image_payload,
-                    {"type": "text", "text": "Please describe this image in detail."},
-                ],
-            }
-        ]
-
-        return self._make_request(messages, temperature=temperature)
+        return self.answer_question(
+            image_path, "Please describe this image in detail.", temperature=temperature
+        )
 
     def answer_question(
-        self, image_path: Union[str, Path], question: str, temperature: float = 0.7
+        self, image_path: Union[str, Path], question: str, temperature: float = 0.7,
+        max_tokens: int = 512
     ) -> str:
         """Answer a question about an image.
 
@@ -123,10 +195,14 @@ class Qwen3VLClient:
             image_path: Path to the image file
             question: The question to ask about the image
             temperature: Sampling temperature (0.0-1.0)
+            max_tokens: Maximum tokens in the answer
 
         Returns:
             Answer to the question
         """
+        if self.image_transport == "binary":
+            return self._upload(image_path, [question], temperature, max_tokens)[0]
+
         image_payload = self._get_image_payload(image_path)
 
         messages = [
@@ -139,7 +215,7 @@ class Qwen3VLClient:
             }
         ]
 
-        return self._make_request(messages, temperature=temperature)
+        return self._make_request(messages, temperature=temperature, max_tokens=max_tokens)
 
     def analyze_scene(self, image_path: Union[str, Path], temperature: float = 0.7) -> str:
         """Analyze the scene in an image.
@@ -151,22 +227,131 @@ class Qwen3VLClient:
         Returns:
             Scene analysis
         """
+        return self.answer_question(
+            image_path,
+            "Analyze this scene. What are the main objects, their relationships, and the overall context?",
+            temperature=temperature,
+        )
+
+    def _service_url(self, route: str) -> str:
+        base_url = self.base_url[:-len("/v1")] if self.base_url.endswith("/v1") else self.base_url
+        return f"{base_url}/{route}"
+
+    def _upload(
+        self, image_path: Union[str, Path], questions: List[str], temperature: float, max_tokens: int
+    ) -> List[str]:
+        """Stream the image file as the raw request body to the model service /upload route."""
+        path = Path(image_path)
+        if not path.exists():
+            raise FileNotFoundError(f"Image file not found: {image_path}")
+
+        params = [("question", q) for q in questions]
+        params += [("temperature", temperature), ("max_tokens", max_tokens)]
+
+        try:
+            data = self._downscaled_bytes(path)
+            if data is not None:
+                response = requests.post(
+                    self._service_url("upload"), params=params, data=data,
+                    headers={"Content-Type": "image/jpeg"}, timeout=self.timeout,
+                )
+            else:
+                # requests streams file objects, so the image is never held as one string
+                with open(path, "rb") as f:
+                    response = requests.post(
+                        self._service_url("upload"), params=params, data=f,
+                        headers={"Content-Type": self._mime_type(path)}, timeout=self.timeout,
+                    )
+            response.raise_for_status()
+            return [item["answer"] for item in response.json()["answers"]]
+
+        except requests.exceptions.ConnectionError:
+            raise Exception(f"Could not connect to server at {self.base_url}.")
+        except requests.exceptions.Timeout:
+            raise Exception(f"Request timed out after {self.timeout}s")
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Request failed: {e}")
+
+    def analyze_many(
+        self, image_path: Union[str, Path], questions: List[str], temperature: float = 0.0,
+        max_tokens: int = 512
+    ) -> List[str]:
+        """Ask several questions about one image in a single request.
+
+        The image is uploaded once; the model service encodes it once and
+        decodes all questions as one batch. Against a plain vLLM server, which
+        has no /analyze route, this falls back to one request per question
+        while still reading and encoding the image only once.
+
+        Args:
+            image_path: Path to the image file
+            questions: Questions to ask about the image
+            temperature: Sampling temperature (0.0-1.0)
+            max_tokens: Maximum tokens per answer
+
+        Returns:
+            Answers in the same order as the questions
+        """
+        if self.image_transport == "binary":
+            return self._upload(image_path, questions, temperature, max_tokens)
+
         image_payload = self._get_image_payload(image_path)
+        payload = {
+            "image": image_payload["image_url"]["url"],
+            "questions": questions,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
 
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    image_payload,
-                    {
-                        "type": "text",
-                        "text": "Analyze this scene. What are the main objects, their relationships, and the overall context?",
-                    },
-                ],
-            }
-        ]
+        try:
+            response = requests.post(self._service_url("analyze"), json=payload, timeout=self.timeout)
+            if response.status_code == 404:
+                return [
+                    self.answer_question(image_path, question, temperature=temperature)
+                    for question in questions
+                ]
+            response.raise_for_status()
+            return [item["answer"] for item in response.json()["answers"]]
 
-        return self._make_request(messages, temperature=temperature)
+        except requests.exceptions.ConnectionError:
+            raise Exception(f"Could not connect to server at {self.base_url}.")
+        except requests.exceptions.Timeout:
+            raise Exception(f"Request timed out after {self.timeout}s")
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Request failed: {e}")
+
+    def analyze_many_stream(
+        self, image_path: Union[str, Path], questions: List[str], temperature: float = 0.0,
+        max_tokens: int = 512
+    ) -> Iterator[dict]:
+        """Like analyze_many, but yield each answer as soon as it is ready.
+
+        Yields:
+            Dicts with "index", "question" and "content" keys, in completion order
+        """
+        image_payload = self._get_image_payload(image_path)
+        payload = {
+            "image": image_payload["image_url"]["url"],
+            "questions": questions,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+        }
+
+        try:
+            response = requests.post(self._service_url("analyze"), json=payload, stream=True, timeout=self.timeout)
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: "):])
+                if event["type"] == "answer":
+                    yield event
+                elif event["type"] == "error":
+                    raise Exception(f"Request failed: {event['content']}")
+
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Request failed: {e}")
 
 
 if __name__ == "__main__":
@@ -180,5 +365,7 @@ if __name__ == "__main__":
     print("   answer = client.answer_question('image.jpg', 'What is this?')")
     print("\n3. Scene Analysis:")
     print("   analysis = client.analyze_scene('image.jpg')")
+    print("\n4. Several questions, one upload:")
+    print("   answers = client.analyze_many('image.jpg', ['What is this?', 'Where is it?'])")
     print("\nMake sure the vLLM server is running first:")
     print("   python start_server.py")
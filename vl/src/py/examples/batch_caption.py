@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Example: Caption a whole directory of images with Qwen3-VL.
+
+This script walks a directory lazily, reads and encodes images in a thread
+pool, and keeps a bounded number of requests in flight against the vLLM
+server or the model service VL endpoint. Results are appended to a JSONL
+file as they complete, so an interrupted run can be restarted and will skip
+images that were already captioned successfully.
+
+Usage:
+    python batch_caption.py <image_dir> [--output captions.jsonl] [--concurrency 8]
+
+Against the model service instead of vLLM:
+    python batch_caption.py <image_dir> --base-url http://localhost:19100/api/v1/vl
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+
+# Add parent directory to path to import client
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from client import Qwen3VLClient
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+DEFAULT_PROMPT = "Please describe this image in detail."
+
+
+def iter_images(root):
+    """Yield image paths under root without listing the whole tree up front."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_SUFFIXES:
+                        yield entry.path
+        except OSError as e:
+            print(f"Skipping {directory}: {e}", file=sys.stderr)
+
+
+def load_done(output_path):
+    """Return the set of image paths already captioned successfully."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written last line from an interrupted run
+                continue
+            if "caption" in record:
+                done.add(record["path"])
+    return done
+
+
+def caption_one(client, path, prompt, temperature, max_tokens):
+    """Read, encode and caption one image. Runs in a worker thread."""
+    start = time.monotonic()
+    try:
+        answer = client.answer_question(path, prompt, temperature=temperature, max_tokens=max_tokens)
+        return {"path": path, "caption": answer, "seconds": round(time.monotonic() - start, 3)}
+    except Exception as e:
+        return {"path": path, "error": str(e), "seconds": round(time.monotonic() - start, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Caption a directory of images with Qwen3-VL")
+    parser.add_argument("image_dir", help="Directory to walk for images")
+    parser.add_argument("--output", default="captions.jsonl", help="JSONL output file (default: captions.jsonl)")
+    parser.add_argument("--base-url", default="http://localhost:8000", help="vLLM or model service VL base URL")
+    parser.add_argument("--model", default="Qwen/Qwen2-VL-2B-Instruct-AWQ", help="Model name sent to the server")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum requests in flight (default: 8)")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT, help="Prompt used for every image")
+    parser.add_argument("--temperature", type=float, default=0.0, help="Sampling temperature (default: 0.0)")
+    parser.add_argument("--max-tokens", type=int, default=256, help="Maximum tokens per caption (default: 256)")
+    parser.add_argument("--max-pixels", type=int, default=None, help="Downscale images above this pixel count before upload")
+    parser.add_argument("--timeout", type=int, default=300, help="Per-request timeout in seconds (default: 300)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.image_dir):
+        print(f"Error: not a directory: {args.image_dir}")
+        sys.exit(1)
+
+    # Every image is asked one question, so the payload cache would only hold memory
+    client = Qwen3VLClient(
+        base_url=args.base_url, model=args.model, timeout=args.timeout,
+        max_pixels=args.max_pixels, payload_cache_size=0,
+    )
+
+    done = load_done(args.output)
+    print("=" * 70)
+    print("Batch Image Captioning with Qwen3-VL")
+    print("=" * 70)
+    print(f"\nDirectory: {args.image_dir}")
+    print(f"Output: {args.output} ({len(done)} images already captioned)")
+    print(f"Concurrency: {args.concurrency}")
+
+    completed = failed = skipped = 0
+    start = time.monotonic()
+
+    with open(args.output, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        in_flight = set()
+
+        def drain(return_when):
+            nonlocal completed, failed
+            finished, still_running = wait(in_flight, return_when=return_when)
+            for future in finished:
+                record = future.result()
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                if "caption" in record:
+                    completed += 1
+                else:
+                    failed += 1
+                    print(f"Failed: {record['path']}: {record['error']}", file=sys.stderr)
+                if (completed + failed) % 100 == 0:
+                    rate = (completed + failed) / (time.monotonic() - start)
+                    print(f"  {completed} captioned, {failed} failed, {rate:.1f} images/s")
+            # Flush per batch of completions so a crash loses at most in-flight work
+            out.flush()
+            return still_running
+
+        try:
+            for path in iter_images(args.image_dir):
+                if path in done:
+                    skipped += 1
+                    continue
+                if len(in_flight) >= args.concurrency:
+                    in_flight = drain(FIRST_COMPLETED)
+                in_flight.add(executor.submit(
+                    caption_one, client, path, args.prompt, args.temperature, args.max_tokens
+                ))
+
+            if in_flight:
+                drain(ALL_COMPLETED)
+
+        except KeyboardInterrupt:
+            print("\nInterrupted, waiting for in-flight requests...")
+            for future in in_flight:
+                future.cancel()
+            in_flight = {f for f in in_flight if not f.cancelled()}
+            if in_flight:
+                drain(ALL_COMPLETED)
+
+    elapsed = time.monotonic() - start
+    print("\n" + "-" * 70)
+    print(f"Captioned: {completed}, failed: {failed}, skipped: {skipped}")
+    print(f"Elapsed: {elapsed:.1f}s ({(completed + failed) / elapsed if elapsed else 0:.1f} images/s)")
+    print("-" * 70)
+
+
+if __name__ == "__main__":
+    main()
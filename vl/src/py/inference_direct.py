@@ -6,8 +6,13 @@ vLLM has significant overhead for vision models. This script uses the
 transformers library directly, which has much lower memory usage for
 single inference runs.
 
+The model is loaded once per run, so pass every image you want captioned
+on the same command line. For repeated requests, use the resident VL
+service in model_service instead (POST /api/v1/vl/v1/chat/completions),
+which keeps the model loaded and micro-batches concurrent requests.
+
 Usage:
-    python inference_direct.py /path/to/image.jpg
+    python inference_direct.py /path/to/image.jpg [/path/to/another.jpg ...]
 """
 
 import sys
@@ -15,6 +20,17 @@ import torch
 from PIL import Image
 from transformers import AutoProcessor, AutoModelForCausalLM
 
+# Images above this pixel count are downscaled before processing
+MAX_PIXELS = 896 * 896
+
+def downscale_image(image, max_pixels=MAX_PIXELS):
+    """Downscale an image to at most max_pixels, keeping its aspect ratio."""
+    width, height = image.size
+    if width * height <= max_pixels:
+        return image
+    scale = (max_pixels / (width * height)) ** 0.5
+    return image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.BICUBIC)
+
 def load_model():
     """Load model with memory optimization."""
     model_id = "Qwen/Qwen3-VL-2B-Instruct-FP8"
@@ -41,7 +57,7 @@ def caption_image(image_path, model, processor):
     print(f"\nProcessing image: {image_path}")
 
     # Load image
-    image = Image.open(image_path).convert('RGB')
+    image = downscale_image(Image.open(image_path).convert('RGB'))
     print(f"Image size: {image.size}")
 
     # Prepare input
@@ -105,10 +121,10 @@ def caption_image(image_path, model, processor):
 
 def main():
     if len(sys.argv) < 2:
-        print("Usage: python inference_direct.py /path/to/image.jpg")
+        print("Usage: python inference_direct.py /path/to/image.jpg [/path/to/another.jpg ...]")
         sys.exit(1)
 
-    image_path = sys.argv[1]
+    image_paths = sys.argv[1:]
 
     try:
         # Load model once
@@ -126,14 +142,15 @@ def main():
         print(f"  Allocated: {torch.cuda.memory_allocated() / 1e9:.2f} GB")
         print(f"  Reserved: {torch.cuda.memory_reserved() / 1e9:.2f} GB")
 
-        # Generate caption
-        caption = caption_image(image_path, model, processor)
+        # Generate captions, reusing the loaded model for every image
+        for image_path in image_paths:
+            caption = caption_image(image_path, model, processor)
 
-        print("\n" + "="*70)
-        print("Generated Caption:")
-        print("="*70)
-        print(caption)
-        print("="*70)
+            print("\n" + "="*70)
+            print(f"Generated Caption: {image_path}")
+            print("="*70)
+            print(caption)
+            print("="*70)
 
     except Exception as e:
         print(f"Error: {e}")